@@ -0,0 +1,145 @@
+import asyncio
+import concurrent.futures
+import functools
+import media_tables
+
+class AsyncMediaTable(media_tables.MediaTableABC):
+    """MediaTable operations as coroutines for use in asyncio code.
+    Reads run on a bounded pool of threads, each with its own reader connection from the connection
+    manager, so several reads run at once. Writes run one at a time on a single writer thread.
+    The database must be a file, as each connection to :memory: is a separate database."""
+
+    def __init__(self, connection_manager, main_table_name, column_dict, readers=4):
+        """Parameters:
+            connection_manager (ConnectionManager): manager for the database connections
+            main_table_name (str): name of the main table
+            column_dict (dict): column name to SQLite column type
+            readers (int): maximum number of reads running at once
+        """
+        writer = connection_manager.writer()
+        self.__media_table = media_tables.MediaTable(writer, writer.cursor(), main_table_name, column_dict, connection_manager)
+        self.__connection_manager = connection_manager
+        self.__writer_executor = concurrent.futures.ThreadPoolExecutor(max_workers=1)
+        self.__reader_executor = concurrent.futures.ThreadPoolExecutor(max_workers=readers)
+        # Reader connections of the pool's threads, closed when the pool is shut down
+        self.__reader_connections = set()
+
+    async def __read(self, function, *args, **kwargs):
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self.__reader_executor, functools.partial(self.__run_read, function, *args, **kwargs))
+
+    def __run_read(self, function, *args, **kwargs):
+        # Runs on a pool thread, which reads from its own reader connection
+        self.__reader_connections.add(self.__connection_manager.reader())
+        return function(*args, **kwargs)
+
+    async def __write(self, function, *args, **kwargs):
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self.__writer_executor, functools.partial(function, *args, **kwargs))
+
+    async def add_record(self, record, on_conflict=None):
+        return await self.__write(self.__media_table.add_record, record, on_conflict)
+
+    async def add_records(self, records, batch_size=1000, on_conflict=None):
+        # records is consumed on the writer thread so must be a normal iterable
+        return await self.__write(self.__media_table.add_records, records, batch_size, on_conflict)
+
+    async def edit_record(self, id, **kwargs):
+        return await self.__write(self.__media_table.edit_record, id, **kwargs)
+
+    async def edit_records(self, edits):
+        return await self.__write(self.__media_table.edit_records, edits)
+
+    async def delete_record(self, id):
+        return await self.__write(self.__media_table.delete_record, id)
+
+    async def delete_records(self, ids):
+        return await self.__write(self.__media_table.delete_records, ids)
+
+    async def add_new_category(self, category_name):
+        return await self.__write(self.__media_table.add_new_category, category_name)
+
+    async def add_to_category(self, id, category_name):
+        return await self.__write(self.__media_table.add_to_category, id, category_name)
+
+    async def remove_from_category(self, id, category_name):
+        return await self.__write(self.__media_table.remove_from_category, id, category_name)
+
+    async def add_records_to_category(self, ids, category_name):
+        return await self.__write(self.__media_table.add_records_to_category, ids, category_name)
+
+    async def remove_records_from_category(self, ids, category_name):
+        return await self.__write(self.__media_table.remove_records_from_category, ids, category_name)
+
+    async def run_in_transaction(self, function):
+        """Run function(media_table) on the writer thread inside a single transaction.
+        Used to group several operations into one atomic commit"""
+        def run():
+            with self.__media_table.transaction():
+                return function(self.__media_table)
+        return await self.__write(run)
+
+    async def find_duplicates(self):
+        return await self.__read(self.__media_table.find_duplicates)
+
+    async def get_all_records(self, columnar=False):
+        return await self.__read(self.__media_table.get_all_records, columnar)
+
+    async def read_columns(self, category_name=None, sort=None, descending=False, filters=None, batch_size=500):
+        return await self.__read(self.__media_table.read_columns, category_name, sort, descending, filters, batch_size)
+
+    async def get_record(self, id):
+        return await self.__read(self.__media_table.get_record, id)
+
+    async def get_records(self, category_name=None, after_rowid=0, limit=100, offset=0, sort=None, descending=False, filters=None):
+        return await self.__read(self.__media_table.get_records, category_name, after_rowid, limit, offset, sort, descending, filters)
+
+    async def search(self, query, limit=100, category_name=None):
+        return await self.__read(self.__media_table.search, query, limit, category_name)
+
+    async def fuzzy_search(self, text, limit=100, category_name=None):
+        return await self.__read(self.__media_table.fuzzy_search, text, limit, category_name)
+
+    async def suggest(self, text):
+        return await self.__read(self.__media_table.suggest, text)
+
+    async def stats(self, group_by, most_common=None):
+        return await self.__read(self.__media_table.stats, group_by, most_common)
+
+    async def count_records(self, category_name=None, filters=None):
+        return await self.__read(self.__media_table.count_records, category_name, filters)
+
+    async def get_category_names(self):
+        return await self.__read(self.__media_table.get_category_names)
+
+    async def get_category_catalog(self):
+        return await self.__read(self.__media_table.get_category_catalog)
+
+    def get_column_dict(self):
+        return self.__media_table.get_column_dict()
+
+    def get_summary_names(self):
+        return self.__media_table.get_summary_names()
+
+    async def iter_records(self, category_name=None, batch_size=500, sort=None, descending=False, filters=None):
+        """Async generator over every record of the main table or a category. Each batch is a
+        keyset page read on the reader pool, so only batch_size records are held at a time"""
+        after_rowid = 0
+        while True:
+            records = await self.get_records(category_name, after_rowid, batch_size, 0, sort, descending, filters)
+            if len(records) == 0:
+                break
+            for record in records:
+                yield record
+            after_rowid = records[-1][0]
+
+    async def close(self):
+        """Wait for running work to finish, stop the reader and writer threads and close their reader
+        connections. The connection manager is left open as it may be shared"""
+        loop = asyncio.get_running_loop()
+        self.__writer_executor.submit(self.__connection_manager.release_reader)
+        await loop.run_in_executor(None, self.__writer_executor.shutdown)
+        await loop.run_in_executor(None, self.__reader_executor.shutdown)
+        for connection in self.__reader_connections:
+            self.__connection_manager.release_reader(connection)
+        self.__reader_connections = set()
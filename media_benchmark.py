@@ -0,0 +1,251 @@
+import argparse
+import json
+import os
+import platform
+import random
+import sqlite3
+import statistics
+import sys
+import tempfile
+import time
+import media_gui
+import media_tables
+
+# Words are made of these syllables so generated text has a realistic number of distinct words to search
+SYLLABLES = ["ka", "lo", "mi", "ne", "ru", "sa", "to", "vi", "za", "be", "do", "fu", "ga", "hi", "jo",
+    "ke", "la", "mo", "nu", "pe", "ri", "so", "ta", "wu", "ya", "zen", "mar", "tel", "dor", "lin"]
+
+def generate_word(rng):
+    return "".join(rng.choice(SYLLABLES) for x in range(rng.randint(2, 3))).capitalize()
+
+
+def generate_records(column_dict, record_count, seed=0):
+    """Generator of record_count random records for the columns in column_dict. The same seed
+    always gives the same records"""
+    rng = random.Random(seed)
+    for i in range(record_count):
+        record = []
+        for column_type in column_dict.values():
+            if column_type == "integer":
+                record.append(rng.randint(1900, 2025))
+            else:
+                record.append(" ".join(generate_word(rng) for x in range(rng.randint(1, 4))))
+        yield tuple(record)
+
+
+def initialise_database_for_testing(database_path, media_type="movies", record_count=10000, category_count=10,
+    category_fraction=0.1, seed=0, row_cache=None):
+    """Fill a database with generated records for one type of media. Each of the category_count categories
+    holds a random category_fraction of the records. Returns the connection manager and MediaTable, which
+    uses row_cache if given"""
+    main_table_name, column_dict = media_tables.MEDIA_TYPES[media_type]
+    connection_manager = media_tables.ConnectionManager(database_path)
+    db_connection = connection_manager.writer()
+    media_table = media_tables.MediaTable(db_connection, db_connection.cursor(), main_table_name, column_dict,
+        connection_manager, row_cache=row_cache)
+    media_table.add_records(generate_records(column_dict, record_count, seed))
+    rng = random.Random(seed)
+    with media_table.transaction():
+        for category in range(category_count):
+            media_table.add_new_category(f"category_{category}")
+            media_table.add_records_to_category(sorted(rng.sample(range(1, record_count + 1), int(record_count * category_fraction))),
+                f"category_{category}")
+    return connection_manager, media_table
+
+
+def time_operation(function, repeat, number):
+    """Seconds per call of function, as the minimum and median of repeat samples of number calls.
+    function is passed the number of calls made before it, so each call can use different data"""
+    samples = []
+    for sample in range(repeat):
+        start = time.perf_counter()
+        for i in range(sample * number, (sample + 1) * number):
+            function(i)
+        samples.append((time.perf_counter() - start) / number)
+    return {"min": min(samples), "median": statistics.median(samples), "number": number}
+
+
+def run_benchmarks(media_table, repeat=5, seed=0):
+    """Time every MediaTable operation and the database work of a GUI table refresh. Returns a dictionary
+    of operation name to timings. Records added while timing are deleted again afterwards"""
+    rng = random.Random(seed)
+    column_dict = media_table.get_column_dict()
+    record_count = media_table.count_records()
+    last_id = media_table.get_records(limit=1, offset=record_count - 1)[0][0]
+    record_ids = [rng.randint(1, last_id) for x in range(1000)]
+    category_names = media_table.get_category_names()
+    category_name = category_names[0] if len(category_names) > 0 else None
+    search_text = media_table.get_record(record_ids[0])[1].split()[0][:4]
+    # The first word of a record with its second letter changed, as a typing mistake
+    misspelt_text = media_table.get_record(record_ids[1])[1].split()[0]
+    misspelt_text = misspelt_text[0] + ("x" if misspelt_text[1:2] != "x" else "z") + misspelt_text[2:]
+    sort_column = list(column_dict)[1]
+    filters = {sort_column: media_table.get_record(record_ids[0])[2]}
+    new_records = list(generate_records(column_dict, 1000, seed + 1))
+    summary_names = media_table.get_summary_names()
+    added_ids = []
+
+    def add_record(i):
+        added_ids.append(media_table.add_record(new_records[i % 1000]))
+
+    def edit_record(i):
+        media_table.edit_record(added_ids[i], **dict(zip(column_dict, new_records[(i + 1) % 1000])))
+
+    def read_table(*args):
+        return lambda i : media_gui.read_table(media_table, *args)
+
+    benchmarks = [
+        # Single record writes, all made to records added by add_record
+        ("add_record", add_record, 100),
+        ("edit_record", edit_record, 100),
+        ("add_to_category", lambda i : media_table.add_to_category(added_ids[i], "benchmark"), 100),
+        ("remove_from_category", lambda i : media_table.remove_from_category(added_ids[i], "benchmark"), 100),
+        ("delete_record", lambda i : media_table.delete_record(added_ids[i]), 100),
+        # Bulk writes of 1000 records
+        ("add_records", lambda i : media_table.add_records(new_records), 1),
+        ("add_records_skip_duplicates", lambda i : media_table.add_records(new_records, on_conflict="skip"), 1),
+        ("edit_records", lambda i : media_table.edit_records({last_id + 1 + x : dict(zip(column_dict, new_records[x - i]))
+            for x in range(1000)}), 1),
+        ("add_records_to_category", lambda i : media_table.add_records_to_category(record_ids, f"benchmark_{i}"), 1),
+        ("remove_records_from_category", lambda i : media_table.remove_records_from_category(record_ids, f"benchmark_{i}"), 1),
+        ("delete_records", lambda i : media_table.delete_records(range(last_id + 1 + i * 1000, last_id + 1 + (i + 1) * 1000)), 1),
+        # Reads
+        ("get_record", lambda i : media_table.get_record(record_ids[i % 1000]), 100),
+        ("get_record_hot", lambda i : media_table.get_record(record_ids[i % 10]), 100),
+        ("get_records_first_page", lambda i : media_table.get_records(limit=100), 10),
+        ("get_records_after_rowid", lambda i : media_table.get_records(after_rowid=record_ids[i % 1000], limit=100), 10),
+        ("get_records_middle_offset", lambda i : media_table.get_records(limit=100, offset=record_count // 2), 1),
+        ("get_records_category", lambda i : media_table.get_records(category_name, limit=100), 10),
+        ("get_records_sorted", lambda i : media_table.get_records(limit=100, sort=sort_column), 10),
+        ("get_records_sorted_after_rowid", lambda i : media_table.get_records(after_rowid=record_ids[i % 1000], limit=100,
+            sort=sort_column, descending=True), 10),
+        ("get_records_category_sorted", lambda i : media_table.get_records(category_name, limit=100, sort=sort_column), 10),
+        ("get_records_filtered", lambda i : media_table.get_records(limit=100, filters=filters), 10),
+        ("count_records", lambda i : media_table.count_records(), 100),
+        ("count_records_category", lambda i : media_table.count_records(category_name), 100),
+        ("count_records_filtered", lambda i : media_table.count_records(filters=filters), 10),
+        ("get_category_catalog", lambda i : media_table.get_category_catalog(), 100),
+        ("find_duplicates", lambda i : media_table.find_duplicates(), 1),
+        ("stats", lambda i : media_table.stats(summary_names[0]), 100),
+        ("stats_most_common", lambda i : media_table.stats(summary_names[-1], 10), 100),
+        ("search", lambda i : media_table.search(search_text, 100), 10),
+        ("search_category", lambda i : media_table.search(search_text, 100, category_name), 10),
+        ("fuzzy_search", lambda i : media_table.fuzzy_search(misspelt_text, 100), 10),
+        ("iter_records", lambda i : sum(1 for x in media_table.iter_records()), 1),
+        ("export_records", lambda i : sum(len(x) for x in media_table.export_records()), 1),
+        ("get_all_records", lambda i : media_table.get_all_records(), 1),
+        ("get_all_records_columnar", lambda i : media_table.get_all_records(columnar=True), 1),
+        ("read_columns", lambda i : media_table.read_columns(), 1),
+        # What MusicTab.update_table reads for the scrolled table, a category, a search, a sorted table
+        # and a table that isn't virtual
+        ("update_table_window", read_table(None, "", record_count // 2, 10), 10),
+        ("update_table_category", read_table(category_name, "", 0, 10), 10),
+        ("update_table_search", read_table(None, search_text, 0, 10), 10),
+        ("update_table_sorted", read_table(None, "", 0, 10, 100, 1000, True, sort_column), 10),
+        ("update_table_all_rows", read_table(None, "", 0, 10, 100, 1000, False), 1),
+    ]
+    results = {}
+    for name, function, number in benchmarks:
+        results[name] = time_operation(function, repeat, number)
+
+    # delete_records removed the records added by add_records, as rowids follow on from last_id since
+    # add_record's were deleted. Anything left over is removed here
+    media_table.delete_records(x[0] for x in media_table.get_records(after_rowid=last_id, limit=repeat * len(new_records)))
+    return results
+
+
+def compare_results(results, baseline, threshold=1.25):
+    """Operations that have got slower than the baseline by more than threshold times. The minimum
+    of the samples is compared since it is the least affected by other work on the machine.
+    Returns a list of (size, operation, baseline seconds, seconds)"""
+    regressions = []
+    for size, timings in results["sizes"].items():
+        for name, timing in timings.items():
+            baseline_timing = baseline["sizes"].get(size, {}).get(name)
+            if baseline_timing is not None and timing["min"] > baseline_timing["min"] * threshold:
+                regressions.append((size, name, baseline_timing["min"], timing["min"]))
+    return regressions
+
+
+def check_insert_rates(results, minimum):
+    """Sizes whose library was generated at fewer than minimum records per second. Generating a library
+    is one add_records call for all its records, so this catches bulk inserts becoming slow without a baseline.
+    Returns a list of (size, records per second)"""
+    slow_sizes = []
+    for size, timings in results["sizes"].items():
+        records_per_second = int(size) / timings["generate"]["min"]
+        if records_per_second < minimum:
+            slow_sizes.append((size, records_per_second))
+    return slow_sizes
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Time MediaTable operations on generated libraries")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[10000, 100000, 1000000], help="number of records in each library")
+    parser.add_argument("--categories", type=int, default=10, help="number of categories in each library")
+    parser.add_argument("--category-fraction", type=float, default=0.1, help="fraction of the records in each category")
+    parser.add_argument("--media", default="movies", choices=list(media_tables.MEDIA_TYPES))
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--repeat", type=int, default=5, help="samples taken of each operation")
+    parser.add_argument("--row-cache", type=int, default=0, help="size of the MediaTable row cache, 0 for none")
+    parser.add_argument("--directory", help="where to generate the databases, by default a temporary directory")
+    parser.add_argument("--output", help="write the results to this JSON file")
+    parser.add_argument("--baseline", help="JSON results of an earlier run to check for regressions against")
+    parser.add_argument("--threshold", type=float, default=1.25, help="slowdown over the baseline counted as a regression")
+    parser.add_argument("--min-insert-rate", type=float, default=8000,
+        help="records per second that generating each library must reach, 0 to not check")
+    args = parser.parse_args()
+
+    settings = {"media": args.media, "categories": args.categories, "category_fraction": args.category_fraction,
+        "seed": args.seed, "repeat": args.repeat, "row_cache": args.row_cache}
+    results = {
+        "environment": {"python": platform.python_version(), "sqlite": sqlite3.sqlite_version, "platform": platform.platform()},
+        "settings": settings,
+        "sizes": {},
+    }
+    with tempfile.TemporaryDirectory() as temporary_directory:
+        directory = args.directory or temporary_directory
+        for size in args.sizes:
+            database_path = os.path.join(directory, f"benchmark_{args.media}_{size}_{args.categories}_{args.seed}.db")
+            for suffix in ("", "-wal", "-shm"):
+                if os.path.exists(database_path + suffix):
+                    os.remove(database_path + suffix)
+            start = time.perf_counter()
+            row_cache = media_tables.RowCache(args.row_cache) if args.row_cache > 0 else None
+            connection_manager, media_table = initialise_database_for_testing(database_path, args.media, size,
+                args.categories, args.category_fraction, args.seed, row_cache)
+            generate_seconds = time.perf_counter() - start
+            timings = {"generate": {"min": generate_seconds, "median": generate_seconds, "number": 1}}
+            timings.update(run_benchmarks(media_table, args.repeat, args.seed))
+            connection_manager.close()
+            results["sizes"][str(size)] = timings
+            print(f"{size} records:", file=sys.stderr)
+            for name, timing in timings.items():
+                print(f"    {name:<32} {timing['median'] * 1000:10.3f} ms", file=sys.stderr)
+
+    if args.output is not None:
+        with open(args.output, "w") as file:
+            json.dump(results, file, indent=4)
+    else:
+        print(json.dumps(results, indent=4))
+
+    failed = False
+    for size, records_per_second in check_insert_rates(results, args.min_insert_rate):
+        print(f"Regression: generating {size} records added {records_per_second:.0f} records per second, "
+            f"minimum {args.min_insert_rate:.0f}", file=sys.stderr)
+        failed = True
+    if args.baseline is not None:
+        with open(args.baseline) as file:
+            baseline = json.load(file)
+        if baseline["settings"] != settings:
+            print("Warning: the baseline was run with different settings", file=sys.stderr)
+        regressions = compare_results(results, baseline, args.threshold)
+        for size, name, baseline_seconds, seconds in regressions:
+            print(f"Regression: {name} on {size} records took {seconds * 1000:.3f} ms, "
+                f"baseline {baseline_seconds * 1000:.3f} ms", file=sys.stderr)
+        failed = failed or len(regressions) > 0
+    if failed:
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
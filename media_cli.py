@@ -0,0 +1,204 @@
+import argparse
+import sys
+
+# Modules are imported by the commands that use them, so a simple query starts quickly. Nothing
+# here imports tkinter, so the tool runs on machines without a display.
+
+def parse_values(assignments, column_dict):
+    """Column values from command line arguments of the form column=value"""
+    import media_files
+    values = {}
+    for assignment in assignments:
+        key, separator, value = assignment.partition("=")
+        if separator == "" or key not in column_dict:
+            raise ValueError(f"expected column=value with a column of {', '.join(column_dict)}, got {assignment!r}")
+        column_type = media_files.COLUMN_TYPES.get(column_dict[key].lower(), str)
+        try:
+            values[key] = column_type(value)
+        except ValueError:
+            raise ValueError(f"column '{key}' expects {column_dict[key]}, got {value!r}") from None
+    return values
+
+
+def parse_filters(assignments, column_dict):
+    """Filters for MediaTable.get_records from arguments of the form column=value or column=low..high"""
+    filters = {}
+    for assignment in assignments:
+        key, separator, value = assignment.partition("=")
+        if ".." in value:
+            low, high = value.split("..", 1)
+            filters.update(parse_values([f"{key}={low}"], column_dict))
+            filters[key] = (filters[key], parse_values([f"{key}={high}"], column_dict)[key])
+        else:
+            filters.update(parse_values([assignment], column_dict))
+    return filters
+
+
+def print_records(media_table, records, as_json):
+    """Print records one per line, tab separated or as JSON objects"""
+    if as_json:
+        import json
+        keys = ["id"] + list(media_table.get_column_dict())
+        for record in records:
+            print(json.dumps(dict(zip(keys, record))))
+    else:
+        for record in records:
+            print("\t".join("" if x is None else str(x) for x in record))
+
+
+def run_table_command(args, media_table):
+    """Run a command on one MediaTable, returns the exit status"""
+    column_dict = media_table.get_column_dict()
+    if args.command == "list":
+        filters = parse_filters(args.filter, column_dict)
+        records = media_table.get_records(args.category, args.after, args.limit, sort=args.sort, descending=args.descending,
+            filters=filters)
+        print_records(media_table, records, args.json)
+    elif args.command == "search":
+        search = media_table.fuzzy_search if args.fuzzy else media_table.search
+        print_records(media_table, search(args.query, args.limit, args.category), args.json)
+    elif args.command == "get":
+        records = [media_table.get_record(x) for x in args.ids]
+        print_records(media_table, [x for x in records if x is not None], args.json)
+        if None in records:
+            return 1
+    elif args.command == "count":
+        print(media_table.count_records(args.category, parse_filters(args.filter, column_dict)))
+    elif args.command == "add":
+        import media_files
+        record = media_files.coerce_record(parse_values(args.values, column_dict), column_dict)
+        print(media_table.add_record(record, args.on_conflict))
+    elif args.command == "edit":
+        media_table.edit_record(args.id, **parse_values(args.values, column_dict))
+    elif args.command == "delete":
+        print(media_table.delete_records(args.ids))
+    elif args.command == "import":
+        import media_files
+        added, rejected = media_files.import_file(media_table, args.path, on_conflict=args.on_conflict)
+        for line_number, reason in rejected:
+            print(f"line {line_number}: {reason}", file=sys.stderr)
+        print(added)
+    elif args.command == "export":
+        import media_files
+        media_files.export_file(media_table, args.path, args.category)
+    elif args.command == "duplicates":
+        for group in media_table.find_duplicates():
+            print("\t".join(str(x) for x in group))
+    elif args.command == "categories":
+        for name, count in media_table.get_category_catalog():
+            print(f"{name}\t{count}")
+    elif args.command == "stats":
+        for value, count in media_table.stats(args.group_by, args.most_common):
+            print(f"{'' if value is None else value}\t{count}")
+    elif args.command == "category-create":
+        media_table.add_new_category(args.name)
+    elif args.command == "category-add":
+        print(media_table.add_records_to_category(args.ids, args.name))
+    elif args.command == "category-remove":
+        print(media_table.remove_records_from_category(args.ids, args.name))
+    elif args.command == "optimize":
+        media_table.optimize()
+    return 0
+
+
+def run_database_command(args, db_connection):
+    """Run a maintenance command on the whole database, returns the exit status"""
+    if args.command == "check":
+        problems = [x[0] for x in db_connection.execute("PRAGMA integrity_check").fetchall() if x[0] != "ok"]
+        for problem in problems:
+            print(problem)
+        print("ok" if len(problems) == 0 else f"{len(problems)} problems")
+        return 1 if len(problems) > 0 else 0
+    if args.command == "vacuum":
+        db_connection.execute("VACUUM")
+    elif args.command == "checkpoint":
+        # Copies the write-ahead log into the database file and truncates it
+        db_connection.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+    return 0
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(description="Query and maintain the media library without the GUI")
+    parser.add_argument("--database", default="media.db", help="path of the database file")
+    parser.add_argument("--json", action="store_true", help="print records as JSON objects rather than tab separated")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    def table_command(name, help):
+        command = commands.add_parser(name, help=help)
+        command.add_argument("media", help="type of media: movies, games or music")
+        return command
+
+    command = table_command("list", "print a page of records")
+    command.add_argument("--category")
+    command.add_argument("--after", type=int, default=0, help="only records after this rowid")
+    command.add_argument("--limit", type=int, default=100)
+    command.add_argument("--sort", help="column to sort by")
+    command.add_argument("--descending", action="store_true")
+    command.add_argument("--filter", action="append", default=[], help="column=value or column=low..high, may be repeated")
+    command = table_command("search", "print records matching a search")
+    command.add_argument("query")
+    command.add_argument("--limit", type=int, default=100)
+    command.add_argument("--category")
+    command.add_argument("--fuzzy", action="store_true", help="correct misspelt words and rank by similarity")
+    command = table_command("get", "print records by rowid")
+    command.add_argument("ids", type=int, nargs="+")
+    command = table_command("count", "print the number of records")
+    command.add_argument("--category")
+    command.add_argument("--filter", action="append", default=[], help="column=value or column=low..high, may be repeated")
+    command = table_command("add", "add a record and print its rowid")
+    command.add_argument("values", nargs="+", help="column=value for every column")
+    command.add_argument("--on-conflict", choices=["skip", "update", "error"], help="what to do if the record already exists")
+    command = table_command("edit", "change columns of a record")
+    command.add_argument("id", type=int)
+    command.add_argument("values", nargs="+", help="column=value")
+    command = table_command("delete", "delete records and print how many were deleted")
+    command.add_argument("ids", type=int, nargs="+")
+    command = table_command("import", "add the records of a CSV or JSONL file, optionally gzipped")
+    command.add_argument("path")
+    command.add_argument("--on-conflict", choices=["skip", "update", "error"], help="what to do with records that already exist")
+    command = table_command("export", "write records to a CSV or JSONL file, gzipped if the path ends in .gz")
+    command.add_argument("path")
+    command.add_argument("--category")
+    table_command("duplicates", "print the rowids of each group of records that only differ in case and spacing")
+    table_command("categories", "print the categories and their record counts")
+    command = table_command("stats", "print the record count for each value of a summary")
+    command.add_argument("group_by", help="summary name, e.g. decade for movies")
+    command.add_argument("--most-common", type=int, help="only this many values with the most records")
+    command = table_command("category-create", "add an empty category")
+    command.add_argument("name")
+    command = table_command("category-add", "add records to a category")
+    command.add_argument("name")
+    command.add_argument("ids", type=int, nargs="+")
+    command = table_command("category-remove", "remove records from a category")
+    command.add_argument("name")
+    command.add_argument("ids", type=int, nargs="+")
+    table_command("optimize", "merge the search index and update the query planner's statistics")
+    commands.add_parser("check", help="check the database file for corruption")
+    commands.add_parser("vacuum", help="rebuild the database file to reclaim unused space")
+    commands.add_parser("checkpoint", help="copy the write-ahead log into the database file")
+    return parser
+
+
+def main(argv=None):
+    """Run the command line tool, returns the exit status"""
+    args = build_parser().parse_args(argv)
+    import media_tables
+    if hasattr(args, "media") and args.media not in media_tables.MEDIA_TYPES:
+        print(f"error: unknown media type {args.media!r}, expected one of {', '.join(media_tables.MEDIA_TYPES)}", file=sys.stderr)
+        return 2
+    connection_manager = media_tables.ConnectionManager(args.database)
+    try:
+        db_connection = connection_manager.writer()
+        if not hasattr(args, "media"):
+            return run_database_command(args, db_connection)
+        main_table_name, column_dict = media_tables.MEDIA_TYPES[args.media]
+        media_table = media_tables.MediaTable(db_connection, db_connection.cursor(), main_table_name, column_dict, connection_manager)
+        return run_table_command(args, media_table)
+    except ValueError as error:
+        print(f"error: {error}", file=sys.stderr)
+        return 2
+    finally:
+        connection_manager.close()
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,125 @@
+import csv
+import gzip
+import json
+
+# Functions used to convert values read from files to the type of each column
+COLUMN_TYPES = {"text": str, "integer": int, "int": int, "real": float}
+
+
+def open_text_file(path, mode):
+    """Open a text file for reading ("r") or writing ("w"), compressed with gzip if path ends in .gz"""
+    if path.endswith(".gz"):
+        return gzip.open(path, mode + "t", encoding="utf-8", newline="")
+    return open(path, mode, encoding="utf-8", newline="")
+
+
+def get_file_format(path):
+    """Returns "csv" or "jsonl" based on the extension of path"""
+    name = path[:-3] if path.endswith(".gz") else path
+    if name.endswith(".csv"):
+        return "csv"
+    if name.endswith(".jsonl"):
+        return "jsonl"
+    raise ValueError(f"Unsupported file type: {path}")
+
+
+def coerce_record(values, column_dict):
+    """Convert a dictionary of values read from a file to a record tuple for the table
+    Parameters:
+        values (dict): column name to value
+        column_dict (dict): column name to SQLite column type
+    Returns:
+        A tuple of values in column order
+    """
+    record = []
+    for key in column_dict:
+        if key not in values:
+            raise ValueError(f"missing column '{key}'")
+        record.append(coerce_value(key, values[key], column_dict))
+    return tuple(record)
+
+
+def coerce_values(values, column_dict):
+    """Convert a dictionary of some columns' new values, such as the body of an edit, to the column types
+    Parameters:
+        values (dict): column name to value
+        column_dict (dict): column name to SQLite column type
+    Returns:
+        A dict of column name to converted value
+    """
+    for key in values:
+        if key not in column_dict:
+            raise ValueError(f"unknown column '{key}'")
+    return {key: coerce_value(key, values[key], column_dict) for key in values}
+
+
+def coerce_value(key, value, column_dict):
+    """Convert a value read from a file or request to the type of column key, None for empty values"""
+    column_type = COLUMN_TYPES.get(column_dict[key].lower(), str)
+    if value is None or (value == "" and column_type is not str):
+        return None
+    try:
+        return column_type(value)
+    except (TypeError, ValueError):
+        raise ValueError(f"column '{key}' expects {column_dict[key]}, got {value!r}") from None
+
+
+def read_lines(lines, file_format, column_dict, rejected):
+    """Generator of record tuples read from lines of CSV (with a header row) or JSONL text.
+    Rows that can't be converted are not yielded but appended to rejected as (line_number, reason)."""
+    if file_format == "csv":
+        reader = csv.DictReader(lines)
+        rows = ((reader.line_num, row) for row in reader)
+    elif file_format == "jsonl":
+        rows = ((line_number, line) for line_number, line in enumerate(lines, start=1) if line.strip() != "")
+    else:
+        raise ValueError(f"Unsupported file type: {file_format}")
+    for line_number, row in rows:
+        try:
+            if file_format == "jsonl":
+                row = json.loads(row)
+                if not isinstance(row, dict):
+                    raise ValueError("expected a JSON object")
+            yield coerce_record(row, column_dict)
+        except ValueError as error:
+            rejected.append((line_number, str(error)))
+
+
+def read_file(path, column_dict, rejected):
+    """Generator of record tuples read from a CSV or JSONL file, see read_lines"""
+    file_format = get_file_format(path)
+    with open_text_file(path, "r") as file:
+        yield from read_lines(file, file_format, column_dict, rejected)
+
+
+def import_file(media_table, path, batch_size=1000, on_conflict=None):
+    """Stream records from a CSV or JSONL file (optionally gzipped) into a MediaTable.
+    The file is read and inserted batch_size records at a time inside one transaction.
+    Parameters:
+        media_table (MediaTable): table to add the records to
+        path (str): path of the file to import
+        batch_size (int): number of records inserted at a time
+        on_conflict (str): what to do with records that are already in the table, as for MediaTable.add_records.
+            "skip" makes importing the same file again add nothing
+    Returns:
+        A tuple of the number of records added and a list of (line_number, reason) for rejected rows
+    """
+    rejected = []
+    records = read_file(path, media_table.get_column_dict(), rejected)
+    added = media_table.add_records(records, batch_size, on_conflict)
+    return added, rejected
+
+
+def export_file(media_table, path, category_name=None, batch_size=500):
+    """Stream the records of a MediaTable, or one of its categories, to a CSV or JSONL file.
+    The file is gzipped if path ends in .gz.
+    Parameters:
+        media_table (MediaTable): table to export
+        path (str): path of the file to write
+        category_name (str): category to export, None for all records
+        batch_size (int): number of records fetched and written at a time
+    """
+    file_format = get_file_format(path)
+    with open_text_file(path, "w") as file:
+        for chunk in media_table.export_records(category_name, file_format, batch_size):
+            file.write(chunk)
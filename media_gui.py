@@ -1,17 +1,31 @@
 import tkinter as tk
 from tkinter import ttk
+import concurrent.futures
+import logging
+import queue
+import time
+import traceback
+import media_stats
 import media_tables
 import sqlite3
 
+logger = logging.getLogger("media_gui")
+
 class GUI(tk.Tk):
     """Main class for media library GUI"""
-    def __init__(self, title="Media Library", w=700, h=500, database_path="media.db"):
+    def __init__(self, title="Media Library", w=700, h=500, database_path="media.db", status_bar=False, row_cache_size=10000):
         super().__init__()
+        self.__started = time.perf_counter()
+        self.first_paint_seconds = None # Time from starting to the first page of the default tab being drawn
         self.title(title)
         self.geometry(f"{w}x{h}")
         self.w = w
         self.h = h
         self.__database_path = database_path
+        # The status bar shows how long the last table refresh took and how many queries have been run
+        self.__query_stats = media_stats.QueryStats() if status_bar else None
+        # Records shown in the tabs, so editing or categorising them doesn't have to read them again
+        self.__row_cache = media_tables.RowCache(row_cache_size)
         self.__connect_to_database(self.__database_path)
         self.__initialise_widgets()
 
@@ -29,60 +43,205 @@ class GUI(tk.Tk):
         style.map("Treeview", 
             background=[("selected", "blue")])
         
+        if self.__query_stats is not None:
+            self.status_bar = tk.Label(self, text="", anchor="w", fg="grey")
+            self.status_bar.pack(side="bottom", fill="x")
+
         # Create tabs for each media type
-        window = ttk.Notebook(self)
-        window.pack(fill="both", expand=1)
+        self.notebook = ttk.Notebook(self)
+        self.notebook.pack(fill="both", expand=1)
 
-        movies_frame = tk.Frame(window, width=self.w, height=self.h)
-        games_frame = tk.Frame(window, width=self.w, height=self.h)
-        music_frame = tk.Frame(window, width=self.w, height=self.h)
+        movies_frame = tk.Frame(self.notebook, width=self.w, height=self.h)
+        games_frame = tk.Frame(self.notebook, width=self.w, height=self.h)
+        music_frame = tk.Frame(self.notebook, width=self.w, height=self.h)
 
         movies_frame.pack(fill="both", expand=1)
         games_frame.pack(fill="both", expand=1)
         music_frame.pack(fill="both", expand=1)
 
-        window.add(movies_frame, text="Movies")
-        window.add(games_frame, text="Games")
-        window.add(music_frame, text="Music")
-
-        self.movies_tab = MoviesTab(movies_frame, self.__db_connection, self.__db_cursor, main_table_name="movies_table", 
-            column_dict={"title": "text", "director": "text", "year": "integer"})
-        self.games_tab = GamesTab(games_frame, self.__db_connection, self.__db_cursor, main_table_name="games_table", 
-            column_dict={"name": "text", "platform": "text", "developer": "text"})
-        self.music_tab = MusicTab(music_frame, self.__db_connection, self.__db_cursor, main_table_name="music_table", 
-            column_dict={"song": "text", "album": "text", "artist": "text"})
+        self.notebook.add(movies_frame, text="Movies")
+        self.notebook.add(games_frame, text="Games")
+        self.notebook.add(music_frame, text="Music")
+
+        # Tabs are built the first time the notebook shows them, so startup only opens the default
+        # tab's table and reads its first page however large the other libraries are
+        self.movies_tab = None
+        self.games_tab = None
+        self.music_tab = None
+        self.__unbuilt_tabs = {
+            str(movies_frame): ("movies_tab", MoviesTab, "Movies", "movies"),
+            str(games_frame): ("games_tab", GamesTab, "Games", "games"),
+            str(music_frame): ("music_tab", MusicTab, "Music", "music"),
+        }
+        self.__build_selected_tab()
+        self.notebook.bind("<<NotebookTabChanged>>", lambda event : self.__build_selected_tab())
 
         # Define action to perform after quitting
         self.protocol("WM_DELETE_WINDOW", self.__on_close)
     
     def __connect_to_database(self, database_path):
-        # persistent storage DB
-        self.__db_connection = sqlite3.connect(database_path)
+        # persistent storage DB, in WAL mode with a writer connection and per-thread readers
+        self.__connection_manager = media_tables.ConnectionManager(database_path, query_stats=self.__query_stats)
+        self.__db_connection = self.__connection_manager.writer()
         # create cursor
         self.__db_cursor = self.__db_connection.cursor()
     
+    def __build_selected_tab(self):
+        """Build the tab the notebook is showing if it hasn't been built yet"""
+        frame_name = self.notebook.select()
+        if frame_name not in self.__unbuilt_tabs:
+            return
+        attribute, tab_class, name, media_type = self.__unbuilt_tabs.pop(frame_name)
+        main_table_name, column_dict = media_tables.MEDIA_TYPES[media_type]
+        # Each tab's table has its own cursor, so results of another tab's queries can't be mixed into its own
+        tab = tab_class(self.nametowidget(frame_name), self.__db_connection, self.__db_connection.cursor(), main_table_name, column_dict,
+            connection_manager=self.__connection_manager, query_stats=self.__query_stats, row_cache=self.__row_cache)
+        tab.refresh_callback = lambda tab : self.__show_refresh(name, tab)
+        setattr(self, attribute, tab)
+
+    def __show_refresh(self, name, tab):
+        """Update the status bar after a tab's table has been refreshed"""
+        if self.first_paint_seconds is None:
+            # Draw the first page now so the time includes it
+            self.update_idletasks()
+            self.first_paint_seconds = time.perf_counter() - self.__started
+            logger.info("First page drawn %.1f ms after starting", self.first_paint_seconds * 1000)
+        if self.__query_stats is None:
+            return
+        stats = self.__query_stats.stats()
+        cache_stats = self.__row_cache.stats()
+        self.status_bar["text"] = (f"{name} refreshed in {tab.last_refresh_seconds * 1000:.1f} ms    "
+            f"{stats['queries']} queries, {stats['commits']} commits, {len(stats['slow_queries'])} slow queries    "
+            f"row cache {cache_stats['hits']} hits, {cache_stats['misses']} misses    "
+            f"started in {self.first_paint_seconds * 1000:.0f} ms")
+
     def __close_database_connection(self):
-        self.__db_connection.close()
+        self.__connection_manager.close()
     
     def __on_close(self):
         """Called after exiting window"""
+        for tab in (self.movies_tab, self.games_tab, self.music_tab):
+            if tab is not None:
+                tab.close()
         self.__close_database_connection()
         self.destroy()
 
 
+class DatabaseWorker:
+    """Runs database work on a background thread so the Tk mainloop never blocks. Finished work is
+    put on a queue that is drained with after(), so callbacks always run on the Tk thread."""
+    def __init__(self, widget, poll_ms=20):
+        self.widget = widget
+        self.poll_ms = poll_ms
+        self.executor = concurrent.futures.ThreadPoolExecutor(max_workers=1)
+        self.finished = queue.Queue()
+        self.pending = {} # future -> (callback, group), only used from the Tk thread
+        self.polling = False
+        self.busy_callback = None # Called with True when work starts and False when all work is done
+
+    def submit(self, function, callback=None, group=None):
+        """Run function in the background and call callback with its result on the Tk thread.
+        Work submitted with a group can be cancelled together"""
+        future = self.executor.submit(function)
+        self.pending[future] = (callback, group)
+        future.add_done_callback(self.finished.put)
+        if not self.polling:
+            self.polling = True
+            if self.busy_callback is not None:
+                self.busy_callback(True)
+            self.widget.after(self.poll_ms, self.poll)
+        return future
+
+    def cancel(self, group):
+        """Cancel work in a group. Work that has already started runs on but its result is ignored"""
+        for future in self.pending:
+            if self.pending[future][1] == group:
+                future.cancel()
+                self.pending[future] = (None, group)
+
+    def poll(self):
+        """Hand finished work to its callback, keep polling while work is pending"""
+        while True:
+            try:
+                future = self.finished.get_nowait()
+            except queue.Empty:
+                break
+            callback, group = self.pending.pop(future)
+            if future.cancelled() or callback is None:
+                continue
+            error = future.exception()
+            if error is not None:
+                traceback.print_exception(type(error), error, error.__traceback__)
+                continue
+            try:
+                callback(future.result())
+            except Exception:
+                traceback.print_exc()
+        if len(self.pending) > 0:
+            self.widget.after(self.poll_ms, self.poll)
+        else:
+            self.polling = False
+            if self.busy_callback is not None:
+                self.busy_callback(False)
+
+    def shutdown(self):
+        """Cancel waiting work and wait for running work to finish"""
+        self.executor.shutdown(wait=True, cancel_futures=True)
+
+
 class MediaTab:
     """Parent class for tabs in GUI for each type of media"""
-    def __init__(self, master):
+    def __init__(self, master, virtual_table=True):
         self.master = master
+        # In virtual table mode only the visible rows exist as Treeview items and the
+        # rest are fetched from the database as the table is scrolled
+        self.virtual_table = virtual_table
+        self.window_start = 0 # Position of the first visible row
+        self.row_count = 0
+        self.row_buffer = [] # Rows fetched around the visible window
+        self.buffer_start = 0 # Position of the first row in row_buffer
+        self.buffer_rows = 100 # Rows fetched either side of the visible window
+        self.buffer_request = None # (start, limit) of the rows being fetched in the background
+        self.buffer_future = None # Future of that fetch, cancelled if the table scrolls on before it starts
+        self.pending_refresh = None # None, "render" or "update" while a refresh is waiting for idle time
+        self.showing_search_results = False
+        self.search_after_id = None
+        self.search_limit = 1000 # Maximum number of search results shown
+        self.sort_column = None # Column the table is sorted by, None for rowid order
+        self.sort_descending = False
+        self.filters = {} # Column name -> value or (low, high) range, as for MediaTable.get_records
+        self.worker = None # DatabaseWorker, if database work can run in the background
+        self.refresh_started = None # time.perf_counter() when the table refresh being loaded started
+        self.last_refresh_seconds = None # Time from asking for the last refresh to it being displayed
+        self.refresh_callback = None # Called with the tab after each refresh is displayed
 
         # Dropdown for selecting category
         self.dropdown_frame = tk.Frame(self.master)
         self.dropdown_frame.pack(fill="both", expand=1)
         self.dropdown_label = tk.Label(self.dropdown_frame, text="Category")
         self.dropdown_label.grid(row=0, column=0, sticky="NESW")
-        self.dropdown_menu = ttk.Combobox(self.dropdown_frame, state="readonly", values=["All"])
+        # Categories are read when the dropdown is opened rather than when the tab is built
+        self.dropdown_menu = ttk.Combobox(self.dropdown_frame, state="readonly", values=["All"],
+            postcommand=lambda : self.update_dropdown_categories())
         self.dropdown_menu.grid(row=0, column=1)
         self.dropdown_menu.set("All")
+
+        # Search box, filters the table as the user types
+        self.search_label = tk.Label(self.dropdown_frame, text="Search")
+        self.search_label.grid(row=0, column=2, sticky="NESW", padx=(20, 0))
+        self.search_entry = tk.Entry(self.dropdown_frame, width=30)
+        self.search_entry.grid(row=0, column=3)
+        self.search_entry.bind("<KeyRelease>", lambda x : self.search_changed())
+
+        # Shown while database work is running in the background
+        self.busy_label = tk.Label(self.dropdown_frame, text="", fg="grey")
+        self.busy_label.grid(row=0, column=4, sticky="NESW", padx=(20, 0))
+
+        # "Did you mean" for a search with misspelt words, clicking it searches for the suggestion
+        self.suggestion = None
+        self.suggestion_label = tk.Label(self.dropdown_frame, text="", fg="blue", cursor="hand2")
+        self.suggestion_label.grid(row=0, column=5, sticky="NESW", padx=(20, 0))
+        self.suggestion_label.bind("<Button-1>", lambda x : self.accept_suggestion())
         
         # Frame for table
         self.table_frame = tk.Frame(self.master)
@@ -94,40 +253,295 @@ class MediaTab:
         self.table_scroll.pack(side=tk.RIGHT, fill=tk.Y)
 
         # Table is a Treeview object
-        self.table = ttk.Treeview(self.table_frame, yscrollcommand=self.table_scroll.set, selectmode="extended")
+        self.table = ttk.Treeview(self.table_frame, selectmode="extended")
         self.table.pack(pady=50)
 
         # Attach scrollbar
-        self.table_scroll.config(command=self.table.yview)
+        if self.virtual_table:
+            self.table_scroll.config(command=self.scroll_table)
+            self.table.bind("<MouseWheel>", self.scroll_wheel)
+            self.table.bind("<Button-4>", lambda event : self.scroll_table("scroll", -1, "units"))
+            self.table.bind("<Button-5>", lambda event : self.scroll_table("scroll", 1, "units"))
+        else:
+            self.table.config(yscrollcommand=self.table_scroll.set)
+            self.table_scroll.config(command=self.table.yview)
 
         self.buttons_frame = tk.LabelFrame(self.master, text="Options")
         self.buttons_frame.pack(fill="x", expand="yes", padx=20)
 
+    def start_worker(self):
+        """Run database work for this tab on a background thread"""
+        self.worker = DatabaseWorker(self.table)
+        self.worker.busy_callback = self.show_busy
+
+    def show_busy(self, busy):
+        if busy:
+            self.busy_label["text"] = "Loading..."
+        else:
+            self.busy_label["text"] = ""
+
+    def run_in_background(self, function, callback=None, group=None):
+        """Run database work on the tab's worker, or straight away if the tab doesn't have one"""
+        if self.worker is None:
+            result = function()
+            if callback is not None:
+                callback(result)
+        else:
+            self.worker.submit(function, callback, group)
+
+    def close(self):
+        """Called when the window is closing"""
+        if self.worker is not None:
+            self.worker.shutdown()
+
+    def rows_reader(self):
+        """Function fetching rows for the virtual table, reading the category, sort and filters shown
+        when it was made so it can run on the worker. Implemented by child classes"""
+        raise NotImplementedError
+
+    def search_changed(self):
+        """Wait until typing pauses before searching"""
+        if self.search_after_id is not None:
+            self.table.after_cancel(self.search_after_id)
+        self.search_after_id = self.table.after(250, self.run_search)
+
+    def run_search(self):
+        self.search_after_id = None
+        self.window_start = 0
+        self.update_table()
+
+    def show_suggestion(self, suggestion):
+        """Offer a corrected search, or clear the offer if suggestion is None"""
+        self.suggestion = suggestion
+        self.suggestion_label["text"] = "" if suggestion is None else f"Did you mean: {suggestion}?"
+
+    def accept_suggestion(self):
+        if self.suggestion is None:
+            return
+        self.search_entry.delete(0, tk.END)
+        self.search_entry.insert(0, self.suggestion)
+        self.show_suggestion(None)
+        self.run_search()
+
+    def show_rows(self, rows):
+        """Display a fixed list of rows, such as search results, instead of the database table"""
+        self.showing_search_results = True
+        if self.virtual_table:
+            self.row_buffer = rows
+            self.buffer_start = 0
+            self.buffer_request = None
+            self.row_count = len(rows)
+            self.render_window()
+        else:
+            for item in self.table.get_children():
+                self.table.delete(item)
+            for position, record in enumerate(rows):
+                self.insert_row(position, record)
+
+    def visible_rows(self):
+        """Number of rows shown in the table at once"""
+        return int(str(self.table.cget("height")))
+
+    def load_virtual_table(self, row_count, rows, buffer_start):
+        """Show the table with rows already fetched starting from position buffer_start"""
+        self.showing_search_results = False
+        self.row_count = row_count
+        self.row_buffer = rows
+        self.buffer_start = buffer_start
+        self.buffer_request = None
+        self.render_window()
+
+    def scroll_table(self, *args):
+        """Command for the scrollbar, also used for mouse wheel scrolling"""
+        visible_rows = self.visible_rows()
+        if args[0] == "moveto":
+            self.window_start = int(float(args[1]) * self.row_count)
+        elif args[0] == "scroll":
+            step = int(args[1])
+            if args[2] == "pages":
+                step *= visible_rows
+            self.window_start += step
+        self.render_window()
+
+    def scroll_wheel(self, event):
+        """Mouse wheel scrolling. Windows gives multiples of 120 for the delta and macOS gives
+        small values, so any delta scrolls at least one row in its direction"""
+        if event.delta != 0:
+            direction = -1 if event.delta > 0 else 1
+            self.scroll_table("scroll", direction * max(1, abs(event.delta) // 120), "units")
+
+    def render_window(self):
+        """Replace the Treeview items with the rows in the visible window"""
+        visible_rows = self.visible_rows()
+        self.window_start = max(0, min(self.window_start, self.row_count - visible_rows))
+        window_end = min(self.window_start + visible_rows, self.row_count)
+        self.fill_buffer(self.window_start, window_end)
+
+        # Items are keyed by rowid so the selection survives a redraw. Rows that are still being
+        # fetched are left out until they arrive
+        selection = self.table.selection()
+        focus = self.table.focus()
+        for item in self.table.get_children():
+            self.table.delete(item)
+        for position in range(self.window_start, window_end):
+            index = position - self.buffer_start
+            if 0 <= index < len(self.row_buffer):
+                self.insert_row(position, self.row_buffer[index])
+        self.table.selection_set([x for x in selection if self.table.exists(x)])
+        if focus != '' and self.table.exists(focus):
+            self.table.focus(focus)
+
+        if self.row_count > 0:
+            self.table_scroll.set(self.window_start / self.row_count, window_end / self.row_count)
+        else:
+            self.table_scroll.set(0, 1)
+
+    def insert_row(self, position, record):
+        """Insert a record at the end of the table, striped by its position"""
+        if position % 2 == 0:
+            self.table.insert(parent="", index="end", iid=record[0], text="", values=tuple(record), tags=("evenrow",))
+        else:
+            self.table.insert(parent="", index="end", iid=record[0], text="", values=tuple(record), tags=("oddrow",))
+
+    def restripe_rows(self):
+        """Reapply alternating row colours after rows have been added or removed"""
+        for position, item in enumerate(self.table.get_children()):
+            if position % 2 == 0:
+                self.table.item(item, tags=("evenrow",))
+            else:
+                self.table.item(item, tags=("oddrow",))
+
+    def in_rowid_order(self):
+        """Whether the table shows every record in rowid order, so changes can be made without reloading it"""
+        return self.sort_column in (None, "rowid") and not self.sort_descending and len(self.filters) == 0
+
+    def record_added(self, record):
+        """Show a newly added record, which has the highest rowid so goes at the end"""
+        if self.showing_search_results or not self.in_rowid_order():
+            self.schedule_refresh("update")
+        elif self.virtual_table:
+            if self.buffer_start + len(self.row_buffer) == self.row_count:
+                self.row_buffer.append(record)
+            self.row_count += 1
+            self.schedule_refresh("render")
+        else:
+            self.insert_row(len(self.table.get_children()), record)
+
+    def record_changed(self, record):
+        """Show new values for a record that is already displayed"""
+        if not self.in_rowid_order():
+            # The record may have moved or no longer match the filters
+            self.schedule_refresh("update")
+            return
+        for index, buffered_record in enumerate(self.row_buffer):
+            if buffered_record[0] == record[0]:
+                self.row_buffer[index] = record
+                break
+        if self.table.exists(record[0]):
+            self.table.item(record[0], values=tuple(record))
+
+    def record_removed(self, record_id):
+        """Remove a deleted record from the table"""
+        if self.showing_search_results or not self.in_rowid_order():
+            self.schedule_refresh("update")
+        elif self.virtual_table:
+            self.row_count -= 1
+            if len(self.row_buffer) > 0 and record_id < self.row_buffer[0][0]:
+                self.buffer_start -= 1
+            else:
+                self.row_buffer = [x for x in self.row_buffer if x[0] != record_id]
+            self.schedule_refresh("render")
+        else:
+            if self.table.exists(record_id):
+                self.table.delete(record_id)
+            self.schedule_refresh("render")
+
+    def schedule_refresh(self, refresh):
+        """Merge back-to-back changes into a single refresh when Tk is next idle.
+        refresh is "render" to redraw from memory or "update" to reload from the database"""
+        if self.pending_refresh is None:
+            self.table.after_idle(self.run_pending_refresh)
+        if self.pending_refresh != "update":
+            self.pending_refresh = refresh
+
+    def run_pending_refresh(self):
+        refresh = self.pending_refresh
+        self.pending_refresh = None
+        if refresh == "update":
+            self.update_table()
+        elif self.virtual_table:
+            self.render_window()
+        else:
+            self.restripe_rows()
+
+    def fill_buffer(self, start, end):
+        """Make sure rows from start to end are in the buffer, fetching around them if not. With a worker
+        the rows are fetched in the background and the window is drawn again when they arrive"""
+        buffer_end = self.buffer_start + len(self.row_buffer)
+        if self.buffer_start <= start and end <= buffer_end:
+            return
+        fetch_start = max(0, start - self.buffer_rows)
+        limit = end + self.buffer_rows - fetch_start
+        if len(self.row_buffer) > 0 and fetch_start >= buffer_end:
+            # Continue on from the end of the buffer so the query seeks by rowid
+            after_rowid, offset = self.row_buffer[-1][0], fetch_start - buffer_end
+        else:
+            after_rowid, offset = 0, fetch_start
+        read_rows = self.rows_reader()
+        if self.worker is None:
+            self.row_buffer = read_rows(after_rowid, offset, limit)
+            self.buffer_start = fetch_start
+            return
+        request = (fetch_start, limit)
+        if request == self.buffer_request:
+            return
+        # Only the latest fetch is wanted, one that has already started is ignored when it finishes
+        if self.buffer_future is not None:
+            self.buffer_future.cancel()
+        self.buffer_request = request
+
+        def buffer_filled(rows):
+            if request != self.buffer_request:
+                return
+            self.buffer_request = None
+            self.buffer_future = None
+            self.row_buffer = rows
+            self.buffer_start = fetch_start
+            self.render_window()
+        self.buffer_future = self.worker.submit(lambda : read_rows(after_rowid, offset, limit), buffer_filled, "table")
+
 
 class MusicTab(MediaTab):
     """Class for music media displayed in tab in the GUI"""
-    def __init__(self, master, db_connection, db_cursor, main_table_name, column_dict):
-        super().__init__(master)
+    # Headings of the table's columns after ID, set by the tabs for other media
+    headings = ("Song", "Album", "Artist")
+
+    def __init__(self, master, db_connection, db_cursor, main_table_name, column_dict, virtual_table=True, connection_manager=None,
+        query_stats=None, row_cache=None):
+        super().__init__(master, virtual_table)
         self.__db_connection = db_connection
         self.__db_cursor = db_cursor
         self.main_table_name = main_table_name
 
         # Link database handling classes
-        self.media_tables = media_tables.MediaTable(self.__db_connection, self.__db_cursor, main_table_name, column_dict)
+        self.media_tables = media_tables.MediaTable(self.__db_connection, self.__db_cursor, main_table_name, column_dict, connection_manager,
+            query_stats, row_cache)
+        # Background work needs the per-thread connections of a connection manager
+        if connection_manager is not None:
+            self.start_worker()
 
         # Columns
-        self.table["columns"] = ("ID", "Song", "Album", "Artist")
+        self.table["columns"] = ("ID",) + self.headings
         self.table.column("#0", width=0, stretch=tk.NO) # Disable column 0
         self.table.column("ID", anchor=tk.W, width=65)
-        self.table.column("Song", anchor=tk.W, width=165)
-        self.table.column("Album", anchor=tk.W, width=165)
-        self.table.column("Artist", anchor=tk.W, width=165)
+        for heading in self.headings:
+            self.table.column(heading, anchor=tk.W, width=165)
 
         self.table.heading("#0", text="")
         self.table.heading("ID", text="ID", anchor=tk.CENTER)
-        self.table.heading("Song", text="Song", anchor=tk.CENTER)
-        self.table.heading("Album", text="Album", anchor=tk.CENTER)
-        self.table.heading("Artist", text="Artist", anchor=tk.CENTER)
+        for heading in self.headings:
+            self.table.heading(heading, text=heading, anchor=tk.CENTER)
+        self.bind_headings(column_dict)
 
         # Buttons
         self.add_button = tk.Button(self.buttons_frame, text="Add Item", command=self.add_item_popup)
@@ -148,15 +562,20 @@ class MusicTab(MediaTab):
         self.add_to_cat_button.grid(row=0, column=5, padx=10, pady=10)
         self.add_to_cat_button["state"] = "disabled"
 
+        self.filter_button = tk.Button(self.buttons_frame, text="Filter Items", command=self.filter_popup)
+        self.filter_button.grid(row=0, column=6, padx=10, pady=10)
+
+        self.summary_button = tk.Button(self.buttons_frame, text="Summary", command=self.summary_popup)
+        self.summary_button.grid(row=0, column=7, padx=10, pady=10)
+
         # Bindings for selecting table rows or dropdown items
         self.table.bind("<ButtonRelease-1>", lambda x : self.enable_buttons(""))
         self.dropdown_menu.bind("<<ComboboxSelected>>", lambda x : self.change_category(""))
 
         self.display_category = 0 # Initial dropdown key to display 0 = "All"
         
-        # Populate table and dropdown
+        # Populate table, the dropdown is filled when it is opened
         self.update_table()
-        self.update_dropdown_categories()
     
     def enable_buttons(self, event):
         """Enable 3 buttons that sometimes require state change"""
@@ -208,21 +627,32 @@ class MusicTab(MediaTab):
     def add_item(self):
         """Command exectured after confirming details when adding items"""
         record = [self.entry1.get(), self.entry2.get(), self.entry3.get()]
-        self.media_tables.add_record(record)
         self.add_window.destroy()
-        self.update_table()
+        self.run_in_background(lambda : self.media_tables.get_record(self.media_tables.add_record(record)), self.item_added)
         self.disable_buttons()
+
+    def item_added(self, record):
+        """Called with the new record once it has been added"""
+        if self.display_category == 0:
+            self.record_added(record)
     
+    def selected_record_ids(self):
+        """Rowids of the selected rows, or of the focused row when nothing is selected"""
+        selected_items = self.table.selection()
+        if len(selected_items) == 0 and self.table.focus() != '':
+            selected_items = (self.table.focus(),)
+        return [int(self.table.item(x, 'values')[0]) for x in selected_items]
+
     def delete_item(self):
-        """Retrieve focus from table and delete selected item"""
-        selected_item = self.table.focus()
-        if selected_item == '':
+        """Delete every selected item in one statement"""
+        record_ids = self.selected_record_ids()
+        if len(record_ids) == 0:
             return
-        
-        values = self.table.item(selected_item, 'values')
-        record_id = int(values[0])
-        self.media_tables.delete_record(record_id)
-        self.update_table()
+
+        def removed(count):
+            for record_id in record_ids:
+                self.record_removed(record_id)
+        self.run_in_background(lambda : self.media_tables.delete_records(record_ids), removed)
         self.disable_buttons()
 
     def edit_item_popup(self):
@@ -272,52 +702,237 @@ class MusicTab(MediaTab):
     def edit_item(self, record_id):
         """Command exectured after confirming details when editing items"""
         record = [self.entry1.get(), self.entry2.get(), self.entry3.get()]
-        self.media_tables.edit_record(record_id, song=record[0], album=record[1], artist=record[2])
+        self.save_edit(int(record_id), song=record[0], album=record[1], artist=record[2])
         self.edit_window.destroy()
-        self.update_table()
         self.disable_buttons()
 
-    def update_table(self):
-        """Called whenever the treeview table needs to be refreshed"""
-        tables = self.media_tables.get_all_records()
+    def save_edit(self, record_id, **kwargs):
+        """Edit a record in the background and show its new values when done. When several rows are
+        selected the values changed from the edited record are given to all of them"""
+        record_ids = self.selected_record_ids()
+        if record_id not in record_ids:
+            record_ids = [record_id]
 
-        for item in self.table.get_children():
-            self.table.delete(item)
+        def edit():
+            if len(record_ids) == 1:
+                self.media_tables.edit_record(record_id, **kwargs)
+            else:
+                record = self.media_tables.get_record(record_id)
+                columns = list(self.media_tables.get_column_dict())
+                changes = {key: value for key, value in kwargs.items() if str(record[columns.index(key) + 1]) != str(value)}
+                if len(changes) > 0:
+                    self.media_tables.edit_records({x: changes for x in record_ids})
+            return [self.media_tables.get_record(x) for x in record_ids]
+
+        def changed(records):
+            for record in records:
+                if record is not None:
+                    self.record_changed(record)
+        self.run_in_background(edit, changed)
 
+    def update_table(self):
+        """Called whenever the treeview table needs to be refreshed"""
         self.table.tag_configure("oddrow", background="white")
         self.table.tag_configure("evenrow", background="lightblue")
-        category = list(tables.keys())[self.display_category]
-        table_data = tables[category]
-        
-        count = 0
-        for record in table_data:
-            if category != self.main_table_name:
-                record = tuple(list(record[1:]))
-            if count % 2 == 0:
-                self.table.insert(parent="", index="end", iid=count, text="", values=tuple(record), tags=("evenrow",))
+        # A new load replaces any that hasn't finished, e.g. after changing category again
+        if self.worker is not None:
+            self.worker.cancel("table")
+        self.refresh_started = time.perf_counter()
+        category_name = self.get_display_category_name()
+        search_text = self.search_entry.get().strip()
+        window_start = self.window_start
+        visible_rows = self.visible_rows()
+        sort_column, sort_descending, filters = self.sort_column, self.sort_descending, dict(self.filters)
+        self.run_in_background(lambda : read_table(self.media_tables, category_name, search_text, window_start, visible_rows,
+            self.buffer_rows, self.search_limit, self.virtual_table, sort_column, sort_descending, filters),
+            self.show_table, group="table")
+
+    def show_table(self, table):
+        """Display what read_table returned"""
+        if table[0] == "search":
+            self.show_rows(table[1])
+            self.show_suggestion(table[2])
+        else:
+            self.show_suggestion(None)
+            if table[0] == "window":
+                self.load_virtual_table(*table[1:])
             else:
-                self.table.insert(parent="", index="end", iid=count, text="", values=tuple(record), tags=("oddrow",))
-            count += 1
+                self.show_all_rows(table[1])
+        if self.refresh_started is not None:
+            self.last_refresh_seconds = time.perf_counter() - self.refresh_started
+            self.refresh_started = None
+            if self.refresh_callback is not None:
+                self.refresh_callback(self)
+
+    def show_all_rows(self, rows):
+        """Replace the rows in a table that isn't virtual"""
+        self.showing_search_results = False
+        for item in self.table.get_children():
+            self.table.delete(item)
+        for position, record in enumerate(rows):
+            self.insert_row(position, record)
+
+    def get_display_category_name(self):
+        """Name of the category selected in the dropdown, None when showing all records"""
+        if self.display_category == 0:
+            return None
+        return self.media_tables.get_category_names()[self.display_category-1]
+
+    def rows_reader(self):
+        category_name, sort_column, sort_descending = self.get_display_category_name(), self.sort_column, self.sort_descending
+        filters = dict(self.filters)
+        return lambda after_rowid, offset, limit : self.media_tables.get_records(category_name, after_rowid, limit, offset,
+            sort_column, sort_descending, filters)
 
     def get_categories(self):
         """Helper function to get the names of categories from database"""
-        tables = self.media_tables.get_all_records()
-        category_names = list(tables.keys())[1:]
-        return category_names
+        return self.media_tables.get_category_names()
     
     def change_category(self, event):
         """Changes table being displayed based on category dropdown menu"""
         self.display_category = self.dropdown_menu.current()
+        self.window_start = 0
         self.update_table()
         self.disable_buttons()
     
     def update_dropdown_categories(self):
         """Called whenever the categories in the dropdown menu need to be refreshed"""
-        categories = self.get_categories()
-        categories = ["All"] + [x[len(self.main_table_name)+1:] for x in categories]
+        categories = ["All"] + self.get_categories()
         categories = [x.replace('_', ' ') for x in categories]
         self.dropdown_menu["values"] = tuple(categories)
     
+    def bind_headings(self, column_dict):
+        """Sort the table by a column when its heading is clicked"""
+        self.heading_columns = dict(zip(self.table["columns"], ["rowid"] + list(column_dict)))
+        for heading in self.heading_columns:
+            self.table.heading(heading, command=lambda heading=heading : self.sort_by(heading))
+
+    def sort_by(self, heading):
+        """Sort by the column of a heading, or reverse the order if it is already sorted by it"""
+        column = self.heading_columns[heading]
+        if column == self.sort_column:
+            self.sort_descending = not self.sort_descending
+        else:
+            self.sort_column = column
+            self.sort_descending = False
+        # Mark the sorted column with the direction
+        for other_heading, other_column in self.heading_columns.items():
+            if other_column != column:
+                self.table.heading(other_heading, text=other_heading)
+            elif self.sort_descending:
+                self.table.heading(other_heading, text=f"{other_heading} \u25bc")
+            else:
+                self.table.heading(other_heading, text=f"{other_heading} \u25b2")
+        self.window_start = 0
+        self.update_table()
+
+    def filter_popup(self):
+        """Popup window for filtering the table by column. Number columns take a range and text columns an exact value"""
+        self.filter_window = tk.Tk()
+        self.filter_window.title("Filter Items")
+        self.filter_window.geometry(f"400x250")
+
+        # Text fields
+        text_field_frame = tk.LabelFrame(self.filter_window, borderwidth=0, highlightthickness=0)
+        text_field_frame.pack(fill="x", expand="yes", padx=20)
+
+        self.filter_entries = {}
+        for row, (key, column_type) in enumerate(self.media_tables.get_column_dict().items()):
+            label = tk.Label(text_field_frame, text=key.capitalize())
+            label.grid(row=row, column=0, padx=10, pady=5)
+            value = self.filters.get(key)
+            if column_type == "integer":
+                low_entry = tk.Entry(text_field_frame, width=10)
+                low_entry.grid(row=row, column=1)
+                to_label = tk.Label(text_field_frame, text="to")
+                to_label.grid(row=row, column=2, padx=5)
+                high_entry = tk.Entry(text_field_frame, width=10)
+                high_entry.grid(row=row, column=3)
+                if value is not None:
+                    low_entry.insert(0, "" if value[0] is None else str(value[0]))
+                    high_entry.insert(0, "" if value[1] is None else str(value[1]))
+                self.filter_entries[key] = (low_entry, high_entry)
+            else:
+                entry = tk.Entry(text_field_frame, width=30)
+                entry.grid(row=row, column=1, columnspan=3)
+                if value is not None:
+                    entry.insert(0, value)
+                self.filter_entries[key] = entry
+
+        # Buttons
+        button_frame = tk.LabelFrame(self.filter_window, borderwidth=0, highlightthickness=0)
+        button_frame.pack(fill="x", expand="yes", padx=20)
+
+        confirm_button_popup = tk.Button(button_frame, text="Apply", command=lambda : self.apply_filters())
+        confirm_button_popup.grid(row=0, column=0, padx=10, pady=10)
+
+        clear_button_popup = tk.Button(button_frame, text="Clear", command=lambda : self.apply_filters(clear=True))
+        clear_button_popup.grid(row=0, column=1, padx=10, pady=10)
+
+        cancel_button_popup = tk.Button(button_frame, text="Cancel", command=self.filter_window.destroy)
+        cancel_button_popup.grid(row=0, column=2, padx=10, pady=10)
+
+    def apply_filters(self, clear=False):
+        """Command executed after confirming the filters. Numbers that can't be read leave that end of the range open"""
+        filters = {}
+        if not clear:
+            for key, entries in self.filter_entries.items():
+                if isinstance(entries, tuple):
+                    bounds = []
+                    for entry in entries:
+                        try:
+                            bounds.append(int(entry.get().strip()))
+                        except ValueError:
+                            bounds.append(None)
+                    if bounds != [None, None]:
+                        filters[key] = tuple(bounds)
+                elif entries.get().strip() != "":
+                    filters[key] = entries.get().strip()
+        self.filter_window.destroy()
+        self.filters = filters
+        if len(filters) > 0:
+            self.filter_button["text"] = f"Filter Items ({len(filters)})"
+        else:
+            self.filter_button["text"] = "Filter Items"
+        self.window_start = 0
+        self.update_table()
+
+    def summary_popup(self):
+        """Popup window showing how many records there are for each value of one of the table's summaries"""
+        summary_names = self.media_tables.get_summary_names()
+        if len(summary_names) == 0:
+            return
+        self.summary_window = tk.Tk()
+        self.summary_window.title("Summary")
+        self.summary_window.geometry(f"400x400")
+
+        self.summary_menu = ttk.Combobox(self.summary_window, state="readonly", values=summary_names)
+        self.summary_menu.pack(padx=20, pady=10)
+        self.summary_menu.set(summary_names[0])
+        self.summary_menu.bind("<<ComboboxSelected>>", lambda x : self.show_summary())
+
+        summary_frame = tk.Frame(self.summary_window)
+        summary_frame.pack(fill="both", expand=1, padx=20, pady=(0, 20))
+        summary_scroll = tk.Scrollbar(summary_frame)
+        summary_scroll.pack(side=tk.RIGHT, fill=tk.Y)
+        self.summary_table = ttk.Treeview(summary_frame, yscrollcommand=summary_scroll.set, columns=("Value", "Count"),
+            show="headings")
+        self.summary_table.heading("Value", text="Value", anchor=tk.CENTER)
+        self.summary_table.heading("Count", text="Count", anchor=tk.CENTER)
+        self.summary_table.pack(fill="both", expand=1)
+        summary_scroll.config(command=self.summary_table.yview)
+        self.show_summary()
+
+    def show_summary(self):
+        """Read the chosen summary, which costs the same however many records there are"""
+        group_by = self.summary_menu.get()
+        def show(rows):
+            for item in self.summary_table.get_children():
+                self.summary_table.delete(item)
+            for value, count in rows:
+                self.summary_table.insert(parent="", index="end", values=("(none)" if value is None else value, count))
+        self.run_in_background(lambda : self.media_tables.stats(group_by), show)
+
     def create_new_category_popup(self):
         """Popup window for adding a new category"""
         self.create_cat_window = tk.Tk()
@@ -347,9 +962,8 @@ class MusicTab(MediaTab):
         """Command exectured after confirming details when creating a category"""
         category_name = self.entry1.get()
         category_name = category_name.replace(' ', '_')
-        self.media_tables.add_new_category(category_name)
         self.create_cat_window.destroy()
-        self.update_dropdown_categories()
+        self.run_in_background(lambda : self.media_tables.add_new_category(category_name), lambda x : self.update_dropdown_categories())
 
     def add_to_category_popup(self):
         """Popup window for adding item to a category"""
@@ -364,8 +978,8 @@ class MusicTab(MediaTab):
         label1 = tk.Label(text_field_frame, text="Category Name")
         label1.grid(row=0, column=0, padx=10, pady=5)
 
-        categories = self.get_categories()
-        categories = [x[len(self.main_table_name)+1:] for x in categories]
+        # Show how many records are already in each category
+        categories = [f"{name} ({count})" for name, count in self.media_tables.get_category_catalog()]
         self.popup_dropdown_menu = ttk.Combobox(text_field_frame, state="readonly", values=categories)
         self.popup_dropdown_menu.grid(row=0, column=1)
 
@@ -380,78 +994,32 @@ class MusicTab(MediaTab):
         cancel_button_popup.pack(padx=10, pady=10)
     
     def add_to_category(self):
-        """Command exectured after confirming details adding item to a category"""
-        selected_item = self.table.focus()
-        if selected_item == '':
+        """Command exectured after confirming details adding the selected items to a category"""
+        record_ids = self.selected_record_ids()
+        if len(record_ids) == 0:
             return
-        
-        values = self.table.item(selected_item, 'values')
-        record_id = int(values[0])
 
-        categories = self.get_categories()
         category_id = self.popup_dropdown_menu.current()
-        category = categories[category_id][len(self.main_table_name)+1:]
-        self.media_tables.add_to_category(record_id, category)
+        if category_id == -1:
+            return
+        category = self.get_categories()[category_id]
         self.add_to_cat_window.destroy()
-        self.update_table()
+        self.run_in_background(lambda : self.media_tables.add_records_to_category(record_ids, category),
+            lambda x : self.added_to_category(category))
         self.disable_buttons()
 
+    def added_to_category(self, category):
+        """Called once a record has been added to a category"""
+        # Only the category being displayed changes what is shown
+        if self.get_display_category_name() == category:
+            self.schedule_refresh("update")
+
 
 class MoviesTab(MusicTab):
     """Class for movies media displayed in tab in the GUI. A lot of the behabiour
     is identical to the MusicTab class so this class inherits from it."""
-    def __init__(self, master, db_connection, db_cursor, main_table_name, column_dict):
-        super().__init__(master, db_connection, db_cursor, main_table_name, column_dict)
-        self.__db_connection = db_connection
-        self.__db_cursor = db_cursor
-        self.main_table_name = main_table_name
-
-        # Link database handling classes
-        self.media_tables = media_tables.MediaTable(self.__db_connection, self.__db_cursor, main_table_name, column_dict)
-
-        # Columns
-        self.table["columns"] = ("ID", "Title", "Director", "Year")
-        self.table.column("#0", width=0, stretch=tk.NO) # Disable column 0
-        self.table.column("ID", anchor=tk.W, width=65)
-        self.table.column("Title", anchor=tk.W, width=165)
-        self.table.column("Director", anchor=tk.W, width=165)
-        self.table.column("Year", anchor=tk.W, width=165)
-
-        self.table.heading("#0", text="")
-        self.table.heading("ID", text="ID", anchor=tk.CENTER)
-        self.table.heading("Title", text="Title", anchor=tk.CENTER)
-        self.table.heading("Director", text="Director", anchor=tk.CENTER)
-        self.table.heading("Year", text="Year", anchor=tk.CENTER)
-
-        # Buttons
-        self.add_button = tk.Button(self.buttons_frame, text="Add Item", command=self.add_item_popup)
-        self.add_button.grid(row=0, column=0, padx=10, pady=10)
-
-        self.edit_button = tk.Button(self.buttons_frame, text="Edit Item", command=self.edit_item_popup)
-        self.edit_button.grid(row=0, column=1, padx=10, pady=10)
-        self.edit_button["state"] = "disabled"
-
-        self.delete_button = tk.Button(self.buttons_frame, text="Delete Item", command=self.delete_item)
-        self.delete_button.grid(row=0, column=2, padx=10, pady=10)
-        self.delete_button["state"] = "disabled"
-
-        self.new_cat_button = tk.Button(self.buttons_frame, text="Create New Category", command=self.create_new_category_popup)
-        self.new_cat_button.grid(row=0, column=3, padx=10, pady=10)
-
-        self.add_to_cat_button = tk.Button(self.buttons_frame, text="Add Item to Category", command=self.add_to_category_popup)
-        self.add_to_cat_button.grid(row=0, column=5, padx=10, pady=10)
-        self.add_to_cat_button["state"] = "disabled"
+    headings = ("Title", "Director", "Year")
 
-        # Bindings for selecting table rows or dropdown items
-        self.table.bind("<ButtonRelease-1>", lambda x : self.enable_buttons(""))
-        self.dropdown_menu.bind("<<ComboboxSelected>>", lambda x : self.change_category(""))
-        
-        self.display_category = 0 # Initial dropdown key to display 0 = "All"
-        
-        # Populate table and dropdown
-        self.update_table()
-        self.update_dropdown_categories()
-    
     def add_item_popup(self):
         """Popup window for adding new media items"""
         self.add_window = tk.Tk()
@@ -534,67 +1102,16 @@ class MoviesTab(MusicTab):
     def edit_item(self, record_id):
         """Command exectured after confirming details when editing items"""
         record = [self.entry1.get(), self.entry2.get(), self.entry3.get()]
-        self.media_tables.edit_record(record_id, title=record[0], director=record[1], year=record[2])
+        self.save_edit(int(record_id), title=record[0], director=record[1], year=record[2])
         self.edit_window.destroy()
-        self.update_table()
         self.disable_buttons()
 
 
 class GamesTab(MusicTab):
     """Class for games media displayed in tab in the GUI. A lot of the behabiour
     is identical to the MusicTab class so this class inherits from it."""
-    def __init__(self, master, db_connection, db_cursor, main_table_name, column_dict):
-        super().__init__(master, db_connection, db_cursor, main_table_name, column_dict)
-        self.__db_connection = db_connection
-        self.__db_cursor = db_cursor
-        self.main_table_name = main_table_name
-
-        # Link database handling classes
-        self.media_tables = media_tables.MediaTable(self.__db_connection, self.__db_cursor, main_table_name, column_dict)
-
-        # Columns
-        self.table["columns"] = ("ID", "Name", "Platform", "Developer")
-        self.table.column("#0", width=0, stretch=tk.NO) # Disable column 0
-        self.table.column("ID", anchor=tk.W, width=65)
-        self.table.column("Name", anchor=tk.W, width=165)
-        self.table.column("Platform", anchor=tk.W, width=165)
-        self.table.column("Developer", anchor=tk.W, width=165)
-
-        self.table.heading("#0", text="")
-        self.table.heading("ID", text="ID", anchor=tk.CENTER)
-        self.table.heading("Name", text="Name", anchor=tk.CENTER)
-        self.table.heading("Platform", text="Platform", anchor=tk.CENTER)
-        self.table.heading("Developer", text="Developer", anchor=tk.CENTER)
-
-        # Buttons
-        self.add_button = tk.Button(self.buttons_frame, text="Add Item", command=self.add_item_popup)
-        self.add_button.grid(row=0, column=0, padx=10, pady=10)
-
-        self.edit_button = tk.Button(self.buttons_frame, text="Edit Item", command=self.edit_item_popup)
-        self.edit_button.grid(row=0, column=1, padx=10, pady=10)
-        self.edit_button["state"] = "disabled"
-
-        self.delete_button = tk.Button(self.buttons_frame, text="Delete Item", command=self.delete_item)
-        self.delete_button.grid(row=0, column=2, padx=10, pady=10)
-        self.delete_button["state"] = "disabled"
-
-        self.new_cat_button = tk.Button(self.buttons_frame, text="Create New Category", command=self.create_new_category_popup)
-        self.new_cat_button.grid(row=0, column=3, padx=10, pady=10)
-
-        self.add_to_cat_button = tk.Button(self.buttons_frame, text="Add Item to Category", command=self.add_to_category_popup)
-        self.add_to_cat_button.grid(row=0, column=5, padx=10, pady=10)
-        self.add_to_cat_button["state"] = "disabled"
+    headings = ("Name", "Platform", "Developer")
 
-        # Bindings for selecting table rows or dropdown items
-        self.table.bind("<ButtonRelease-1>", lambda x : self.enable_buttons(""))
-        self.dropdown_menu.bind("<<ComboboxSelected>>", lambda x : self.change_category(""))
-        
-        self.display_category = 0 # Initial dropdown key to display 0 = "All"
-        
-        # Populate table and dropdown
-        self.update_table()
-        self.update_dropdown_categories()
-    
     def edit_item_popup(self):
         """Popup window for editing items"""
         selected_item = self.table.focus()
@@ -642,9 +1159,8 @@ class GamesTab(MusicTab):
     def edit_item(self, record_id):
         """Command exectured after confirming details when editing items"""
         record = [self.entry1.get(), self.entry2.get(), self.entry3.get()]
-        self.media_tables.edit_record(record_id, name=record[0], platform=record[1], developer=record[2])
+        self.save_edit(int(record_id), name=record[0], platform=record[1], developer=record[2])
         self.edit_window.destroy()
-        self.update_table()
         self.disable_buttons()
     
     def add_item_popup(self):
@@ -683,6 +1199,32 @@ class GamesTab(MusicTab):
         cancel_button_popup.pack(padx=10, pady=10)
     
 
+def read_table(media_table, category_name, search_text, window_start, visible_rows, buffer_rows=100, search_limit=1000,
+    virtual_table=True, sort_column=None, sort_descending=False, filters=None):
+    """The database work of MusicTab.update_table, which doesn't need Tk so can run on a worker thread.
+    Search results are ranked by relevance, otherwise rows are sorted and filtered in the database.
+    A search that finds nothing is tried again with its misspelt words corrected.
+    Returns ("search", rows, suggestion), ("window", row_count, rows, buffer_start) or ("all", rows)"""
+    if search_text != "":
+        rows = media_table.search(search_text, search_limit, category_name)
+        suggestion = None
+        if len(rows) == 0:
+            suggestion = media_table.suggest(search_text)
+            if suggestion is not None:
+                rows = media_table.search(suggestion, search_limit, category_name)
+        return "search", rows, suggestion
+    if virtual_table:
+        # Count and fetch the rows around the current scroll position together
+        row_count = media_table.count_records(category_name, filters)
+        buffer_start = max(0, min(window_start, row_count - visible_rows) - buffer_rows)
+        rows = media_table.get_records(category_name, 0, visible_rows + 2 * buffer_rows, buffer_start,
+            sort_column, sort_descending, filters)
+        return "window", row_count, rows, buffer_start
+    # Records are read in batches on the worker thread into compact columns, then inserted on the Tk
+    # thread with each row's tuple built as it is inserted
+    return "all", media_table.read_columns(category_name, sort_column, sort_descending, filters)
+
+
 def initialise_database_for_testing(database_path):
     # persistent storage DB
     db_connection = sqlite3.connect(database_path)
@@ -744,5 +1286,5 @@ def initialise_database_for_testing(database_path):
 
 if __name__ == "__main__":
     # initialise_database_for_testing("media.db")
-    gui = GUI(database_path="media.db")
+    gui = GUI(database_path="media.db", status_bar=True)
     gui.mainloop()
@@ -0,0 +1,82 @@
+import argparse
+import http.client
+import json
+import threading
+import time
+import urllib.parse
+
+def percentile(sorted_values, fraction):
+    """Value at fraction (0 to 1) of a sorted list"""
+    if len(sorted_values) == 0:
+        return 0.0
+    index = min(len(sorted_values) - 1, int(fraction * len(sorted_values)))
+    return sorted_values[index]
+
+
+def run_client(host, port, paths, deadline, latencies, errors, use_etags):
+    """Send requests over one keep-alive connection until the deadline, recording latencies"""
+    connection = http.client.HTTPConnection(host, port, timeout=30)
+    etags = {}
+    count = 0
+    while time.perf_counter() < deadline:
+        path = paths[count % len(paths)]
+        count += 1
+        headers = {}
+        if use_etags and path in etags:
+            headers["If-None-Match"] = etags[path]
+        start = time.perf_counter()
+        try:
+            connection.request("GET", path, headers=headers)
+            response = connection.getresponse()
+            response.read()
+        except (OSError, http.client.HTTPException):
+            errors.append(path)
+            connection.close()
+            connection = http.client.HTTPConnection(host, port, timeout=30)
+            continue
+        latencies.append(time.perf_counter() - start)
+        if response.status >= 400:
+            errors.append(path)
+        elif response.getheader("ETag") is not None:
+            etags[path] = response.getheader("ETag")
+    connection.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Generate load against media_server.py and report throughput and latency")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8080)
+    parser.add_argument("--clients", type=int, default=8, help="concurrent keep-alive connections")
+    parser.add_argument("--duration", type=float, default=10.0, help="seconds to run for")
+    parser.add_argument("--media", default="movies", help="media type to request")
+    parser.add_argument("--search", default="the", help="search query mixed in with the listing requests")
+    parser.add_argument("--etags", action="store_true", help="send If-None-Match with the last ETag seen")
+    args = parser.parse_args()
+
+    # Mix of listing pages and searches
+    paths = [f"/{args.media}?limit=100", f"/{args.media}?limit=100&after=100",
+        f"/{args.media}/search?q={urllib.parse.quote(args.search)}&limit=20", f"/{args.media}/categories"]
+    deadline = time.perf_counter() + args.duration
+    latencies = [[] for x in range(args.clients)]
+    errors = []
+    threads = [threading.Thread(target=run_client, args=(args.host, args.port, paths, deadline, latencies[i], errors, args.etags))
+        for i in range(args.clients)]
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - start
+
+    all_latencies = sorted(x for client_latencies in latencies for x in client_latencies)
+    print(json.dumps({
+        "requests": len(all_latencies),
+        "errors": len(errors),
+        "seconds": round(elapsed, 3),
+        "requests_per_second": round(len(all_latencies) / elapsed, 1),
+        "p50_ms": round(percentile(all_latencies, 0.50) * 1000, 3),
+        "p99_ms": round(percentile(all_latencies, 0.99) * 1000, 3),
+    }, indent=4))
+
+if __name__ == "__main__":
+    main()
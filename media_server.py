@@ -0,0 +1,324 @@
+import argparse
+import concurrent.futures
+import http.server
+import json
+import tempfile
+import threading
+import urllib.parse
+import media_files
+import media_tables
+
+class MediaLibrary:
+    """The MediaTable for each type of media, shared by every request handler"""
+    def __init__(self, connection_manager, row_cache=None):
+        self.connection_manager = connection_manager
+        self.row_cache = row_cache
+        # PRAGMA data_version last read on each thread's reader connection
+        self.__local = threading.local()
+        self.__changes = 0
+        db_connection = connection_manager.writer()
+        self.tables = {}
+        for media_type in media_tables.MEDIA_TYPES:
+            main_table_name, column_dict = media_tables.MEDIA_TYPES[media_type]
+            self.tables[media_type] = media_tables.MediaTable(db_connection, db_connection.cursor(), main_table_name,
+                column_dict, connection_manager, row_cache=row_cache)
+        self.__writes = 0
+        self.__writes_lock = threading.Lock()
+
+    def record_write(self):
+        """Called after every write made through the server"""
+        with self.__writes_lock:
+            self.__writes += 1
+
+    def version(self):
+        """Changes whenever the database changes. PRAGMA data_version on the calling thread's reader
+        connection changes when any other connection commits, and the write counter covers the server's
+        own writes straight away. It is read without the write lock, so it never waits for a write.
+        Each reader connection notices a commit separately, so one commit can change the version more
+        than once, which only costs a client a full response instead of a 304"""
+        data_version = self.connection_manager.reader().execute("PRAGMA data_version").fetchone()[0]
+        last_data_version = getattr(self.__local, "data_version", None)
+        self.__local.data_version = data_version
+        if last_data_version is not None and data_version != last_data_version:
+            with self.__writes_lock:
+                self.__changes += 1
+            # The commit may have been made by another program, so cached records may be out of date
+            if self.row_cache is not None:
+                self.row_cache.clear()
+        return f"{self.__writes}.{self.__changes}"
+
+
+class MediaServer(http.server.HTTPServer):
+    """HTTP server handling requests on a fixed pool of threads. Each thread keeps its own reader
+    connection, so the pool size is also the number of reader connections."""
+    def __init__(self, server_address, library, threads=8):
+        super().__init__(server_address, MediaRequestHandler)
+        self.library = library
+        self.executor = concurrent.futures.ThreadPoolExecutor(max_workers=threads)
+
+    def process_request(self, request, client_address):
+        self.executor.submit(self.process_request_thread, request, client_address)
+
+    def process_request_thread(self, request, client_address):
+        try:
+            self.finish_request(request, client_address)
+        except Exception:
+            self.handle_error(request, client_address)
+        finally:
+            self.shutdown_request(request)
+
+    def server_close(self):
+        super().server_close()
+        self.executor.shutdown(wait=True)
+
+
+class RequestError(Exception):
+    """Raised while handling a request to send an error response"""
+    def __init__(self, status, message):
+        super().__init__(message)
+        self.status = status
+
+
+class MediaRequestHandler(http.server.BaseHTTPRequestHandler):
+    """JSON API for the media library. Paths are relative to /<media type>, e.g. /movies:
+        GET    /                           page of records, ?category=&after=&limit=
+        GET    /search                     ?q=&limit=&category=&fuzzy=1
+        GET    /<id>                       one record
+        POST   /                           add a record, body is an object of column values, ?on_conflict=
+        PATCH  /<id>                       edit a record, body is an object of column values
+        DELETE /<id>                       delete a record
+        POST   /import                     bulk import, body is CSV or JSONL (?format=csv or jsonl), ?on_conflict=
+        GET    /duplicates                 groups of ids of records that are the same apart from case and spacing
+        GET    /stats/<summary>            record counts for each value of a summary, ?most_common=
+        GET    /categories                 category names and record counts
+        POST   /categories                 add a category, body is {"name": ...}
+        PUT    /categories/<name>/<id>     add a record to a category
+        DELETE /categories/<name>/<id>     remove a record from a category
+    """
+    # HTTP/1.1 keeps connections alive between requests
+    protocol_version = "HTTP/1.1"
+    # Idle keep-alive connections are closed so they don't hold a pool thread forever
+    timeout = 10
+    # Headers and body are written separately, without this each response waits on a delayed ACK
+    disable_nagle_algorithm = True
+    max_page_size = 1000
+    max_memory_body = 8 * 1024 * 1024
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_GET(self):
+        self.handle_api_request("GET")
+
+    def do_POST(self):
+        self.handle_api_request("POST")
+
+    def do_PUT(self):
+        self.handle_api_request("PUT")
+
+    def do_PATCH(self):
+        self.handle_api_request("PATCH")
+
+    def do_DELETE(self):
+        self.handle_api_request("DELETE")
+
+    def handle_api_request(self, method):
+        self.etag = None
+        self.body_remaining = int(self.headers.get("Content-Length", 0))
+        url = urllib.parse.urlsplit(self.path)
+        parts = [urllib.parse.unquote(x) for x in url.path.split("/") if x != ""]
+        query = dict(urllib.parse.parse_qsl(url.query))
+        try:
+            if len(parts) == 0 or parts[0] not in self.server.library.tables:
+                raise RequestError(404, "Unknown media type")
+            media_table = self.server.library.tables[parts[0]]
+            if self.server.library.row_cache is not None:
+                self.server.library.version()
+            status, body = self.route(method, media_table, parts[1:], query)
+        except RequestError as error:
+            self.discard_body()
+            status, body = error.status, {"error": str(error)}
+        except media_tables.DuplicateRecordError as error:
+            self.discard_body()
+            status, body = 409, {"error": str(error), "id": error.record_id}
+        except ValueError as error:
+            self.discard_body()
+            status, body = 400, {"error": str(error)}
+        except Exception as error:
+            # Any other error still gets a response, so the client's keep-alive connection isn't dropped
+            self.log_error("Error handling %s %s: %r", method, self.path, error)
+            self.discard_body()
+            status, body = 500, {"error": "Internal server error"}
+        self.send_json(status, body)
+
+    def route(self, method, media_table, parts, query):
+        """Returns the status code and JSON body of the response"""
+        library = self.server.library
+        if method == "GET" and len(parts) == 0:
+            return self.list_records(media_table, query)
+        if method == "GET" and parts == ["search"]:
+            limit = self.get_int(query, "limit", 100, self.max_page_size, minimum=1)
+            search = media_table.fuzzy_search if query.get("fuzzy") == "1" else media_table.search
+            records = search(query.get("q", ""), limit, query.get("category"))
+            return 200, {"records": self.to_dicts(media_table, records)}
+        if method == "POST" and len(parts) == 0:
+            values = self.read_json()
+            record = media_files.coerce_record(values, media_table.get_column_dict())
+            record_id = media_table.add_record(record, query.get("on_conflict"))
+            library.record_write()
+            return 201, self.to_dicts(media_table, [media_table.get_record(record_id)])[0]
+        if method == "POST" and parts == ["import"]:
+            return self.import_records(media_table, query)
+        if method == "GET" and parts == ["duplicates"]:
+            return 200, {"duplicates": media_table.find_duplicates()}
+        if method == "GET" and len(parts) == 2 and parts[0] == "stats":
+            most_common = self.get_int(query, "most_common", None, minimum=1) if "most_common" in query else None
+            counts = media_table.stats(parts[1], most_common)
+            return 200, {"stats": [{"value": x[0], "count": x[1]} for x in counts]}
+        if method == "GET" and parts == ["categories"]:
+            return 200, {"categories": [{"name": x[0], "count": x[1]} for x in media_table.get_category_catalog()]}
+        if method == "POST" and parts == ["categories"]:
+            name = self.read_json().get("name")
+            if not isinstance(name, str) or name == "":
+                raise ValueError("name must be a non-empty string")
+            media_table.add_new_category(name)
+            library.record_write()
+            return 201, {"name": name}
+        if method in ("PUT", "DELETE") and len(parts) == 3 and parts[0] == "categories":
+            record_id = self.parse_id(parts[2])
+            if method == "PUT":
+                if media_table.get_record(record_id) is None:
+                    raise RequestError(404, "No such record")
+                media_table.add_to_category(record_id, parts[1])
+            else:
+                media_table.remove_from_category(record_id, parts[1])
+            library.record_write()
+            return 200, {"name": parts[1], "id": record_id}
+        if len(parts) == 1 and method in ("GET", "PATCH", "DELETE"):
+            record_id = self.parse_id(parts[0])
+            if method == "PATCH":
+                values = media_files.coerce_values(self.read_json(), media_table.get_column_dict())
+                media_table.edit_record(record_id, **values)
+                library.record_write()
+            elif method == "DELETE":
+                media_table.delete_record(record_id)
+                library.record_write()
+                return 204, None
+            record = media_table.get_record(record_id)
+            if record is None:
+                raise RequestError(404, "No such record")
+            return 200, self.to_dicts(media_table, [record])[0]
+        raise RequestError(404, "Not found")
+
+    def list_records(self, media_table, query):
+        # The ETag is the database version, so a client with an up to date page gets a
+        # 304 response without the query being run
+        self.etag = f'"{self.server.library.version()}"'
+        if self.headers.get("If-None-Match") == self.etag:
+            return 304, None
+        limit = self.get_int(query, "limit", 100, self.max_page_size, minimum=1)
+        after_rowid = self.get_int(query, "after", 0)
+        records = media_table.get_records(query.get("category"), after_rowid, limit)
+        next_after = records[-1][0] if len(records) == limit else None
+        return 200, {"records": self.to_dicts(media_table, records), "next_after": next_after}
+
+    def import_records(self, media_table, query):
+        file_format = query.get("format", "jsonl")
+        rejected = []
+        # The whole body is received before the import starts, so a slow upload doesn't hold the write
+        # lock. Large bodies are spooled to a temporary file rather than kept in memory
+        with self.spool_body() as body:
+            lines = (line.decode("utf-8") for line in body)
+            records = media_files.read_lines(lines, file_format, media_table.get_column_dict(), rejected)
+            added = media_table.add_records(records, on_conflict=query.get("on_conflict"))
+        self.server.library.record_write()
+        return 200, {"added": added, "rejected": [{"line": x[0], "reason": x[1]} for x in rejected]}
+
+    def spool_body(self):
+        """The request body in a file, in memory up to max_memory_body bytes and on disk after that"""
+        body = tempfile.SpooledTemporaryFile(max_size=self.max_memory_body)
+        while self.body_remaining > 0:
+            data = self.rfile.read(min(self.body_remaining, 65536))
+            if data == b"":
+                break
+            self.body_remaining -= len(data)
+            body.write(data)
+        body.seek(0)
+        return body
+
+    def read_json(self):
+        body = self.rfile.read(self.body_remaining)
+        self.body_remaining = 0
+        try:
+            values = json.loads(body or b"{}")
+        except json.JSONDecodeError as error:
+            raise ValueError(f"Invalid JSON: {error}") from None
+        if not isinstance(values, dict):
+            raise ValueError("Expected a JSON object")
+        return values
+
+    def discard_body(self):
+        """Read any unread body so the next request on a keep-alive connection starts cleanly"""
+        while self.body_remaining > 0:
+            data = self.rfile.read(min(self.body_remaining, 65536))
+            if data == b"":
+                break
+            self.body_remaining -= len(data)
+
+    def get_int(self, query, key, default, maximum=None, minimum=None):
+        try:
+            value = int(query.get(key, default))
+        except ValueError:
+            raise ValueError(f"{key} must be an integer") from None
+        if minimum is not None and value < minimum:
+            raise ValueError(f"{key} must be at least {minimum}")
+        if maximum is not None:
+            value = min(value, maximum)
+        return value
+
+    def parse_id(self, text):
+        try:
+            return int(text)
+        except ValueError:
+            raise RequestError(404, "Not found") from None
+
+    def to_dicts(self, media_table, records):
+        keys = ["id"] + list(media_table.get_column_dict())
+        return [dict(zip(keys, x)) for x in records]
+
+    def send_json(self, status, body):
+        data = b"" if body is None else json.dumps(body).encode("utf-8")
+        self.send_response(status)
+        if self.etag is not None:
+            self.send_header("ETag", self.etag)
+        if status not in (204, 304):
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        if status not in (204, 304):
+            self.wfile.write(data)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Serve the media library as a JSON API over HTTP")
+    parser.add_argument("--database", default="media.db", help="path of the database file")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8080)
+    parser.add_argument("--threads", type=int, default=8, help="request threads, each with its own reader connection")
+    parser.add_argument("--row-cache", type=int, default=10000, help="records kept in memory for GET by id, 0 to turn off")
+    args = parser.parse_args()
+
+    connection_manager = media_tables.ConnectionManager(args.database)
+    row_cache = media_tables.RowCache(args.row_cache) if args.row_cache > 0 else None
+    server = MediaServer((args.host, args.port), MediaLibrary(connection_manager, row_cache), args.threads)
+    print(f"Serving {args.database} on http://{args.host}:{args.port}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        connection_manager.close()
+
+if __name__ == "__main__":
+    main()
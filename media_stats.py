@@ -0,0 +1,283 @@
+import functools
+import threading
+import time
+
+# Flag set on the code of generator functions, as in inspect. media_tables imports this module, so it avoids
+# importing inspect and logging, which would take most of the time of a command line query to start
+CO_GENERATOR = 0x20
+
+class OperationStats:
+    """Totals for one MediaTable operation"""
+    def __init__(self, bucket_count):
+        self.calls = 0
+        self.queries = 0
+        self.statements = 0
+        self.rows = 0
+        self.commits = 0
+        self.seconds = 0.0
+        self.max_seconds = 0.0
+        self.histogram = [0] * bucket_count
+
+
+class QueryStats:
+    """Opt-in instrumentation of what MediaTable objects send to SQLite. Counts calls, queries, rows
+    returned and commits for each operation, with a histogram of operation latency. Queries slower than
+    slow_query_ms are logged with the statements SQLite ran for them, which are captured with the
+    connection's trace callback so include the bound values and any statements run by triggers.
+    One QueryStats can be shared by several tables and threads."""
+
+    # Upper bounds of the latency histogram buckets in milliseconds, the last bucket has no bound
+    BUCKETS_MS = (0.1, 0.25, 0.5, 1, 2.5, 5, 10, 25, 50, 100, 250, 500, 1000)
+
+    def __init__(self, slow_query_ms=100.0, slow_query_count=100, traced_statements=20):
+        """Parameters:
+            slow_query_ms (float): queries taking at least this long are logged, None to turn off
+            slow_query_count (int): number of the most recent slow queries kept for stats()
+            traced_statements (int): statements kept for each slow query, executemany runs one per record
+        """
+        self.slow_query_ms = slow_query_ms
+        self.slow_query_count = slow_query_count
+        self.traced_statements = traced_statements
+        self.__lock = threading.Lock()
+        self.__local = threading.local()
+        self.reset()
+
+    def reset(self):
+        """Clear every count"""
+        with self.__lock:
+            self.__operations = {}
+            self.__totals = OperationStats(len(self.BUCKETS_MS) + 1)
+            self.__slow_queries = []
+
+    def watch(self, connection):
+        """Capture the statements run by a connection so slow queries can be logged in full"""
+        connection.set_trace_callback(self.__trace)
+
+    def cursor(self, cursor):
+        """Wrap a cursor so its queries are counted"""
+        return InstrumentedCursor(cursor, self)
+
+    def __trace(self, statement):
+        self.__totals_add("statements", 1)
+        statements = getattr(self.__local, "statements", None)
+        if statements is not None and len(statements) < self.traced_statements:
+            statements.append(statement)
+
+    def __current(self):
+        # Operations running on this thread, innermost last
+        operations = getattr(self.__local, "operations", None)
+        if operations is None:
+            operations = self.__local.operations = []
+        return operations
+
+    def __totals_add(self, name, value):
+        # Add to the totals and the innermost operation running on this thread
+        operations = self.__current()
+        with self.__lock:
+            setattr(self.__totals, name, getattr(self.__totals, name) + value)
+            if len(operations) > 0:
+                operation = self.__operation(operations[-1])
+                setattr(operation, name, getattr(operation, name) + value)
+
+    def start_query(self):
+        """Called by InstrumentedCursor before each query"""
+        self.__totals_add("queries", 1)
+        self.__local.statements = []
+
+    def record_rows(self, count):
+        self.__totals_add("rows", count)
+
+    def record_commit(self):
+        self.__totals_add("commits", 1)
+
+    def record_slow_query(self, sql, seconds, slow_query):
+        """Called whenever a query's time so far is over slow_query_ms. slow_query is None the first time
+        and the returned entry after that, so a slow query is logged once and its time kept up to date"""
+        if slow_query is None:
+            operations = self.__current()
+            slow_query = {"operation": operations[-1] if len(operations) > 0 else None, "sql": " ".join(sql.split()),
+                "statements": list(getattr(self.__local, "statements", None) or []), "ms": 0.0}
+            import logging
+            logging.getLogger("media_stats").warning("Slow query in %s: %s", slow_query["operation"],
+                "; ".join(slow_query["statements"]) or slow_query["sql"])
+            with self.__lock:
+                self.__slow_queries.append(slow_query)
+                del self.__slow_queries[:-self.slow_query_count]
+        with self.__lock:
+            slow_query["ms"] = seconds * 1000
+        return slow_query
+
+    def __bucket(self, seconds):
+        milliseconds = seconds * 1000
+        for index, bound in enumerate(self.BUCKETS_MS):
+            if milliseconds <= bound:
+                return index
+        return len(self.BUCKETS_MS)
+
+    def __operation(self, name):
+        # Operations are added on first use, including after a reset while they were running
+        if name not in self.__operations:
+            self.__operations[name] = OperationStats(len(self.BUCKETS_MS) + 1)
+        return self.__operations[name]
+
+    def begin_operation(self, name, call=True):
+        """Queries on this thread count towards operation name until end_operation. call is False
+        when a generator carries on with an operation that has already been counted"""
+        self.__current().append(name)
+        if call:
+            with self.__lock:
+                self.__operation(name).calls += 1
+
+    def end_operation(self):
+        self.__current().pop()
+
+    def record_latency(self, name, seconds):
+        """Time taken by one call of an operation"""
+        with self.__lock:
+            operation = self.__operation(name)
+            operation.seconds += seconds
+            operation.max_seconds = max(operation.max_seconds, seconds)
+            operation.histogram[self.__bucket(seconds)] += 1
+
+    def stats(self):
+        """Snapshot of the counts as a dictionary that can be dumped as JSON
+        Returns:
+            totals over all operations, "operations" with the counts and latency in milliseconds
+            for each operation and "slow_queries" with the most recent slow queries
+        """
+        bucket_names = [str(x) for x in self.BUCKETS_MS] + ["inf"]
+        with self.__lock:
+            operations = {}
+            for name, operation in sorted(self.__operations.items()):
+                operations[name] = {
+                    "calls": operation.calls,
+                    "queries": operation.queries,
+                    "statements": operation.statements,
+                    "rows": operation.rows,
+                    "commits": operation.commits,
+                    "total_ms": operation.seconds * 1000,
+                    "mean_ms": operation.seconds * 1000 / operation.calls if operation.calls > 0 else 0.0,
+                    "max_ms": operation.max_seconds * 1000,
+                    "latency_ms": dict(zip(bucket_names, operation.histogram)),
+                }
+            return {
+                "queries": self.__totals.queries,
+                "statements": self.__totals.statements,
+                "rows": self.__totals.rows,
+                "commits": self.__totals.commits,
+                "operations": operations,
+                "slow_queries": [dict(x) for x in self.__slow_queries],
+            }
+
+
+class InstrumentedCursor:
+    """Cursor that reports its queries, rows and time to a QueryStats. Anything else is passed to the
+    wrapped cursor"""
+    def __init__(self, cursor, query_stats):
+        self.__cursor = cursor
+        self.__query_stats = query_stats
+        self.__sql = None
+        self.__seconds = 0.0
+        self.__slow_query = None
+
+    def __getattr__(self, name):
+        return getattr(self.__cursor, name)
+
+    def __timed(self, function, *args):
+        start = time.perf_counter()
+        try:
+            return function(*args)
+        finally:
+            # Fetches add to the time of the query they are fetching from
+            self.__seconds += time.perf_counter() - start
+            slow_query_ms = self.__query_stats.slow_query_ms
+            if slow_query_ms is not None and self.__seconds * 1000 >= slow_query_ms:
+                self.__slow_query = self.__query_stats.record_slow_query(self.__sql, self.__seconds, self.__slow_query)
+
+    def __start(self, sql):
+        self.__query_stats.start_query()
+        self.__sql = sql
+        self.__seconds = 0.0
+        self.__slow_query = None
+
+    def execute(self, sql, parameters=()):
+        self.__start(sql)
+        self.__timed(self.__cursor.execute, sql, parameters)
+        return self
+
+    def executemany(self, sql, seq_of_parameters):
+        self.__start(sql)
+        self.__timed(self.__cursor.executemany, sql, seq_of_parameters)
+        return self
+
+    def fetchone(self):
+        row = self.__timed(self.__cursor.fetchone)
+        if row is not None:
+            self.__query_stats.record_rows(1)
+        return row
+
+    def fetchmany(self, size=None):
+        rows = self.__timed(self.__cursor.fetchmany, self.__cursor.arraysize if size is None else size)
+        self.__query_stats.record_rows(len(rows))
+        return rows
+
+    def fetchall(self):
+        rows = self.__timed(self.__cursor.fetchall)
+        self.__query_stats.record_rows(len(rows))
+        return rows
+
+    def __iter__(self):
+        while True:
+            row = self.fetchone()
+            if row is None:
+                return
+            yield row
+
+
+def instrumented_generator(query_stats, name, generator):
+    """Count a generator as one call of an operation. Only the time spent producing items counts,
+    not the time the caller spends using them"""
+    seconds = 0.0
+    query_stats.begin_operation(name)
+    try:
+        while True:
+            start = time.perf_counter()
+            try:
+                item = next(generator)
+            except StopIteration as stop:
+                return stop.value
+            finally:
+                seconds += time.perf_counter() - start
+                query_stats.end_operation()
+            yield item
+            query_stats.begin_operation(name, call=False)
+    finally:
+        generator.close()
+        query_stats.record_latency(name, seconds)
+
+
+def instrumented(method):
+    """Decorator for MediaTable methods that counts them as an operation when the table has a QueryStats"""
+    name = method.__name__
+    if method.__code__.co_flags & CO_GENERATOR:
+        @functools.wraps(method)
+        def generator_wrapper(self, *args, **kwargs):
+            # Without a QueryStats the method's own generator is returned, so there is no cost per item
+            if self.query_stats is None:
+                return method(self, *args, **kwargs)
+            return instrumented_generator(self.query_stats, name, method(self, *args, **kwargs))
+        return generator_wrapper
+
+    @functools.wraps(method)
+    def wrapper(self, *args, **kwargs):
+        query_stats = self.query_stats
+        if query_stats is None:
+            return method(self, *args, **kwargs)
+        query_stats.begin_operation(name)
+        start = time.perf_counter()
+        try:
+            return method(self, *args, **kwargs)
+        finally:
+            query_stats.end_operation()
+            query_stats.record_latency(name, time.perf_counter() - start)
+    return wrapper
@@ -1,14 +1,58 @@
 import abc
+import array
+import collections
+import contextlib
+import csv
+import io
+import itertools
+import json
+import re
 import sqlite3
+import threading
+import unicodedata
+import media_stats
+
+# Main table name and columns for each type of media in the library
+MEDIA_TYPES = {
+    "movies": ("movies_table", {"title": "text", "director": "text", "year": "integer"}),
+    "games": ("games_table", {"name": "text", "platform": "text", "developer": "text"}),
+    "music": ("music_table", {"song": "text", "album": "text", "artist": "text"}),
+}
+
+# Record counts kept up to date for each main table, as summary name -> (column, bucket size). Integer
+# columns with a bucket size are counted in ranges, e.g. years by decade. A summary's grouping can't be
+# changed once its table exists, give it a new name instead
+SUMMARIES = {
+    "movies_table": {"decade": ("year", 10), "director": ("director", None)},
+    "games_table": {"platform": ("platform", None), "developer": ("developer", None)},
+    "music_table": {"artist": ("artist", None), "album": ("album", None)},
+}
 
 class MediaTableABC(abc.ABC):
     """Abstract class for MediaTable to define interface"""
 
     @abc.abstractmethod
-    def add_record(self, record):
+    def add_record(self, record, on_conflict=None):
         """Adds a record to the associated table
         Parameters:
             record (tuple): values of record to add
+            on_conflict (str): what to do if a record with the same normalized_key exists. None adds
+                it anyway, "skip" leaves the existing record, "update" gives the existing record the new
+                values and "error" raises DuplicateRecordError
+        Returns:
+            rowid of the added record, or of the existing record when it was skipped or updated
+        """
+        pass
+    
+    @abc.abstractmethod
+    def add_records(self, records, batch_size=1000, on_conflict=None):
+        """Adds many records to the associated table in a single transaction
+        Parameters:
+            records (iterable): tuples of values of records to add
+            batch_size (int): number of records inserted per executemany call
+            on_conflict (str): as for add_record, records also conflict with earlier ones in records
+        Returns:
+            Number of records added
         """
         pass
     
@@ -21,6 +65,16 @@ class MediaTableABC(abc.ABC):
         """
         pass
     
+    @abc.abstractmethod
+    def edit_records(self, edits):
+        """Edits values of many records in a single transaction
+        Parameters:
+            edits (dict): rowid of each record to edit mapped to a dict of its new key-value pair(s)
+        Returns:
+            Number of records edited
+        """
+        pass
+    
     @abc.abstractmethod
     def delete_record(self, id):
         """Deletes a specified record in the table
@@ -29,6 +83,16 @@ class MediaTableABC(abc.ABC):
         """
         pass
 
+    @abc.abstractmethod
+    def delete_records(self, ids):
+        """Deletes many records in a single statement and transaction
+        Parameters:
+            ids (iterable): rowids of the records to be deleted
+        Returns:
+            Number of records deleted
+        """
+        pass
+
     @abc.abstractmethod
     def add_new_category(self, category_name):
         """Adds a new category
@@ -37,6 +101,16 @@ class MediaTableABC(abc.ABC):
         """
         pass
 
+    @abc.abstractmethod
+    def get_category_catalog(self):
+        """Retrieve the categories and how many records each holds
+        Parameters:
+            None
+        Returns:
+            A list of (category_name, record_count) tuples in the order categories were created
+        """
+        pass
+
     @abc.abstractmethod
     def add_to_category(self, id, category_name):
         """Adds a specified record to a category
@@ -54,26 +128,601 @@ class MediaTableABC(abc.ABC):
             category_name (str): name of category to add record to
         """
         pass
+
+    @abc.abstractmethod
+    def add_records_to_category(self, ids, category_name):
+        """Adds many records to a category in a single statement and transaction
+        Parameters:
+            ids (iterable): rowids of the records, ones that don't exist are skipped
+            category_name (str): name of category to add records to
+        Returns:
+            Number of records added that weren't already in the category
+        """
+        pass
+
+    @abc.abstractmethod
+    def remove_records_from_category(self, ids, category_name):
+        """Removes many records from a category in a single statement and transaction
+        Parameters:
+            ids (iterable): rowids of the records
+            category_name (str): name of category to remove records from
+        Returns:
+            Number of records removed
+        """
+        pass
     
     @abc.abstractmethod
-    def get_all_records(self):
-        """Retrieve all records from the database
+    def find_duplicates(self):
+        """Find records with the same normalized_key
+        Parameters:
+            None
+        Returns:
+            A list of groups of duplicate records, each a list of rowids in the order they were added
+        """
+        pass
+
+    @abc.abstractmethod
+    def get_summary_names(self):
+        """Retrieve the names of the summaries kept for the table
         Parameters:
             None
+        Returns:
+            A list of summary names that can be passed to stats
+        """
+        pass
+
+    @abc.abstractmethod
+    def stats(self, group_by, most_common=None):
+        """Record counts from a summary, read without counting the records
+        Parameters:
+            group_by (str): name of the summary
+            most_common (int): only the groups with the most records, largest first, None for every group
+        Returns:
+            A list of (value, record_count) tuples in value order, the start of each bucket for a summary
+            with a bucket size
+        """
+        pass
+
+    @abc.abstractmethod
+    def get_all_records(self, columnar=False):
+        """Retrieve all records from the database
+        Parameters:
+            columnar (bool): return each table as ColumnarRecords rather than a list of tuples
         Returns:
             A dictionary containing all DB records
         """
         pass
 
+    @abc.abstractmethod
+    def read_columns(self, category_name=None, sort=None, descending=False, filters=None, batch_size=500):
+        """Read every record of the main table or a category into compact ColumnarRecords
+        Parameters:
+            category_name (str): category to read, None for all records
+            sort, descending, filters: as for get_records
+            batch_size (int): number of rows fetched at a time
+        Returns:
+            ColumnarRecords with columns "id" and those of the table
+        """
+        pass
+
+    @abc.abstractmethod
+    def get_record(self, id):
+        """Retrieve a single record
+        Parameters:
+            id (int): rowid of the record
+        Returns:
+            A (rowid, *values) tuple, or None if there is no such record
+        """
+        pass
+
+    @abc.abstractmethod
+    def get_records(self, category_name=None, after_rowid=0, limit=100, offset=0, sort=None, descending=False, filters=None):
+        """Retrieve one page of records ordered by rowid, or by a column
+        Parameters:
+            category_name (str): category to retrieve from, None for all records
+            after_rowid (int): only records after the record with this rowid are returned, 0 to start at the beginning
+            limit (int): maximum number of records to return
+            offset (int): number of records after after_rowid to skip
+            sort (str): column to order by, ties are ordered by rowid. None for rowid order
+            descending (bool): reverse the order
+            filters (dict): column name -> value the column must equal, or (low, high) for an inclusive
+                range where either end can be None
+        Returns:
+            A list of (rowid, *values) tuples
+        """
+        pass
+
+    @abc.abstractmethod
+    def search(self, query, limit=100, category_name=None):
+        """Full-text search of the records, matching each word as a prefix
+        Parameters:
+            query (str): words to search for
+            limit (int): maximum number of records to return
+            category_name (str): category to search in, None for all records
+        Returns:
+            A list of (rowid, *values) tuples, best matches first
+        """
+        pass
+
+    @abc.abstractmethod
+    def fuzzy_search(self, text, limit=100, category_name=None):
+        """Search that tolerates misspelt words. Words that don't start any word in the library are
+        replaced by the most similar word that does, and the results are ranked by their similarity to text
+        Parameters:
+            text (str): words to search for
+            limit (int): maximum number of records to return
+            category_name (str): category to search in, None for all records
+        Returns:
+            A list of (rowid, *values) tuples, most similar first
+        """
+        pass
+
+    @abc.abstractmethod
+    def suggest(self, text):
+        """Correct the misspelt words of a search
+        Parameters:
+            text (str): words that were searched for
+        Returns:
+            The search with misspelt words replaced by the most similar words in the library, or None
+            if no word needed replacing or no similar word was found
+        """
+        pass
+
+    @abc.abstractmethod
+    def count_records(self, category_name=None, filters=None):
+        """Count the records in the table or in a category
+        Parameters:
+            category_name (str): category to count, None for all records
+            filters (dict): only count records matching these filters, as for get_records
+        Returns:
+            Number of records
+        """
+        pass
+
+
+ON_CONFLICT_MODES = (None, "skip", "update", "error")
+
+
+def normalized_key(record):
+    """Key that is the same for records whose values only differ in case or spacing, used to find duplicates"""
+    return "\x1f".join("" if x is None else " ".join(str(x).casefold().split()) for x in record)
+
+
+# Words whose trigram similarity to a misspelt word is below this aren't suggested for it
+SIMILARITY_THRESHOLD = 0.3
+
+
+def search_words(text):
+    """Words of text the way the search index stores them, case folded and without accents"""
+    text = text.casefold()
+    if not text.isascii():
+        text = "".join(x for x in unicodedata.normalize("NFKD", text) if not unicodedata.combining(x))
+    return re.findall(r"\w+", text)
+
+
+def trigrams(word):
+    """Three letter sequences of a word padded with spaces, so the start and end of words count for more"""
+    padded = f"  {word} "
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+def similarity(word, other):
+    """Trigram similarity of two words, from 0 for nothing in common to 1 for the same word"""
+    word_trigrams, other_trigrams = trigrams(word), trigrams(other)
+    return len(word_trigrams & other_trigrams) / len(word_trigrams | other_trigrams)
+
+
+class DuplicateRecordError(ValueError):
+    """Raised when adding a record with on_conflict="error" and the same record already exists"""
+    def __init__(self, record_id, record):
+        super().__init__(f"Record {record!r} duplicates record {record_id}")
+        self.record_id = record_id
+        self.record = record
+
+
+class IntegerColumn:
+    """Integers stored in an array('q'), with the positions of NULLs kept separately"""
+    def __init__(self):
+        self.values = array.array("q")
+        self.nulls = set()
+
+    def append(self, value):
+        """Raises TypeError or OverflowError for values that aren't 64 bit integers or None"""
+        if value is None:
+            self.nulls.add(len(self.values))
+            value = 0
+        elif type(value) is not int:
+            raise TypeError(f"expected an integer, got {value!r}")
+        self.values.append(value)
+
+    def extend(self, values):
+        """Append a sequence of values, nothing is appended if one of them can't be"""
+        if None in values:
+            values = list(values)
+            for position, value in enumerate(values):
+                if value is None:
+                    self.nulls.add(len(self.values) + position)
+                    values[position] = 0
+        if any(type(x) is not int for x in values):
+            raise TypeError("expected integers")
+        self.values.extend(array.array("q", values))
+
+    def __len__(self):
+        return len(self.values)
+
+    def __getitem__(self, position):
+        if self.nulls and position in self.nulls:
+            return None
+        return self.values[position]
+
+    def get_range(self, start, stop):
+        """List of the values from position start up to stop"""
+        if self.nulls:
+            return [None if x in self.nulls else self.values[x] for x in range(start, stop)]
+        return self.values[start:stop].tolist()
+
+
+class TextColumn:
+    """Strings stored back to back as UTF-8 in one buffer with an array of where each ends, rather than
+    as a str object each. NULL positions are kept separately"""
+    def __init__(self):
+        self.data = bytearray()
+        self.ends = array.array("q")
+        self.nulls = set()
+
+    def append(self, value):
+        """Raises TypeError for values that aren't strings or None"""
+        if value is None:
+            self.nulls.add(len(self.ends))
+        elif type(value) is str:
+            self.data += value.encode("utf-8")
+        else:
+            raise TypeError(f"expected a string, got {value!r}")
+        self.ends.append(len(self.data))
+
+    def extend(self, values):
+        """Append a sequence of values, nothing is appended if one of them can't be"""
+        if any(type(x) is not str and x is not None for x in values):
+            raise TypeError("expected strings")
+        nulls = [len(self.ends) + x for x, value in enumerate(values) if value is None]
+        encoded = [b"" if x is None else x.encode("utf-8") for x in values]
+        # accumulate starts with the current end, which is already in ends
+        self.ends.extend(itertools.islice(itertools.accumulate(map(len, encoded), initial=len(self.data)), 1, None))
+        self.data += b"".join(encoded)
+        self.nulls.update(nulls)
+
+    def __len__(self):
+        return len(self.ends)
+
+    def __getitem__(self, position):
+        if self.nulls and position in self.nulls:
+            return None
+        start = self.ends[position - 1] if position > 0 else 0
+        return self.data[start:self.ends[position]].decode("utf-8")
+
+    def get_range(self, start, stop):
+        """List of the values from position start up to stop"""
+        if start >= stop:
+            return []
+        begin = self.ends[start - 1] if start > 0 else 0
+        ends = self.ends[start:stop]
+        starts = itertools.chain((begin,), ends)
+        data = self.data[begin:ends[-1]]
+        if data.isascii():
+            # Byte offsets are character offsets, so the range is decoded once and sliced
+            text = data.decode("ascii")
+            values = [text[x - begin:y - begin] for x, y in zip(starts, ends)]
+        else:
+            values = [data[x - begin:y - begin].decode("utf-8") for x, y in zip(starts, ends)]
+        if self.nulls:
+            values = [None if start + x in self.nulls else value for x, value in enumerate(values)]
+        return values
+
+
+class ColumnarRecords:
+    """Read-only records stored column by column, which takes several times less memory than a list of
+    tuples. Integer columns, including the rowids, are IntegerColumns and text columns are TextColumns,
+    so there is no Python object for each value. A column falls back to a list if it holds values of
+    other types, which SQLite allows. Slices and select() share the columns of the records they are
+    taken from rather than copying them, and tuples are only built for rows as they are indexed or iterated."""
+
+    def __init__(self, names, columns, start=0, stop=None):
+        """Parameters:
+            names (list): name of each column
+            columns (list): sequence of values for each column, all of the same length
+            start, stop (int): range of positions in the columns holding these records
+        """
+        self.names = tuple(names)
+        self.__columns = list(columns)
+        self.__start = start
+        self.__stop = (len(self.__columns[0]) if len(self.__columns) > 0 else 0) if stop is None else stop
+
+    @classmethod
+    def from_rows(cls, names, column_types, rows):
+        """Build from an iterable of row tuples, such as a cursor, without holding the rows
+        Parameters:
+            names (list): name of each column
+            column_types (list): SQLite type of each column, "integer" columns are stored as integers
+                and the rest as text
+            rows (iterable): tuples of values in column order
+        """
+        columns = [IntegerColumn() if x.lower() in ("integer", "int") else TextColumn() for x in column_types]
+        rows = iter(rows)
+        while True:
+            # Rows are added a batch at a time, a column at a time
+            batch = list(itertools.islice(rows, 1000))
+            if len(batch) == 0:
+                break
+            for index, values in enumerate(zip(*batch)):
+                try:
+                    columns[index].extend(values)
+                except (TypeError, OverflowError):
+                    column = columns[index]
+                    columns[index] = column.get_range(0, len(column)) + list(values)
+        return cls(names, columns)
+
+    def __len__(self):
+        return self.__stop - self.__start
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            start, stop, step = index.indices(len(self))
+            if step != 1:
+                raise ValueError("ColumnarRecords can only be sliced with a step of 1")
+            return ColumnarRecords(self.names, self.__columns, self.__start + start, self.__start + max(start, stop))
+        if index < 0:
+            index += len(self)
+        if index < 0 or index >= len(self):
+            raise IndexError("record index out of range")
+        position = self.__start + index
+        return tuple(column[position] for column in self.__columns)
+
+    def __iter__(self):
+        # Tuples are built a batch of rows at a time as the caller asks for them
+        for start in range(self.__start, self.__stop, 1000):
+            stop = min(start + 1000, self.__stop)
+            yield from zip(*(self.__get_range(x, start, stop) for x in self.__columns))
+
+    def __get_range(self, column, start, stop):
+        if isinstance(column, list):
+            return column[start:stop]
+        return column.get_range(start, stop)
+
+    def select(self, *names):
+        """Records with only the named columns, in the order given, sharing this object's columns"""
+        for name in names:
+            if name not in self.names:
+                raise ValueError(f"No column '{name}'")
+        return ColumnarRecords(names, [self.__columns[self.names.index(x)] for x in names], self.__start, self.__stop)
+
+    def column(self, name):
+        """Values of one column. Integer columns without NULLs are returned as a memoryview of
+        the array so aren't copied, others as a list"""
+        if name not in self.names:
+            raise ValueError(f"No column '{name}'")
+        column = self.__columns[self.names.index(name)]
+        if isinstance(column, IntegerColumn) and not column.nulls:
+            return memoryview(column.values)[self.__start:self.__stop]
+        return self.__get_range(column, self.__start, self.__stop)
+
+
+class RowCache:
+    """Bounded least recently used cache of records keyed by (table name, rowid), with hit and miss
+    counters. It can be shared by several MediaTable objects and threads. Every write through a MediaTable
+    using the cache removes the records it changes, so a cache must only be shared by tables that make
+    all the writes to the database."""
+
+    def __init__(self, size=1000):
+        """Parameters:
+            size (int): maximum number of records kept
+        """
+        self.size = size
+        self.hits = 0
+        self.misses = 0
+        self.__records = collections.OrderedDict()
+        self.__lock = threading.Lock()
+        # Changed by every invalidation, so a record read before a write can't be stored after it
+        self.__version = 0
+
+    def get(self, key):
+        """The cached record for key, or None"""
+        with self.__lock:
+            record = self.__records.get(key)
+            if record is None:
+                self.misses += 1
+                return None
+            self.__records.move_to_end(key)
+            self.hits += 1
+            return record
+
+    def version(self):
+        """Taken before reading records from the database and passed to put"""
+        return self.__version
+
+    def put(self, table_name, records, version):
+        """Cache (rowid, *values) records read from a table, unless there has been a write since version"""
+        with self.__lock:
+            if version != self.__version:
+                return
+            for record in records:
+                key = (table_name, record[0])
+                self.__records[key] = record
+                self.__records.move_to_end(key)
+            while len(self.__records) > self.size:
+                self.__records.popitem(last=False)
+
+    def invalidate(self, keys):
+        with self.__lock:
+            for key in keys:
+                self.__records.pop(key, None)
+            self.__version += 1
+
+    def clear(self):
+        with self.__lock:
+            self.__records.clear()
+            self.__version += 1
+
+    def stats(self):
+        """Returns:
+            A dictionary of the size, number of cached records, hits and misses
+        """
+        with self.__lock:
+            return {"size": self.size, "records": len(self.__records), "hits": self.hits, "misses": self.misses}
+
+
+class ConnectionManager:
+    """Opens the SQLite connections to a database file. There is a single writer connection, shared
+    between threads behind write_lock, and a reader connection for each thread. The database is put
+    in WAL mode so that readers don't block the writer or each other."""
+
+    SYNCHRONOUS_MODES = ("OFF", "NORMAL", "FULL", "EXTRA")
+
+    def __init__(self, database_path, cache_size=-65536, mmap_size=268435456, synchronous="NORMAL", timeout=5.0,
+        query_stats=None):
+        """Parameters:
+            database_path (str): path of the database file
+            cache_size (int): PRAGMA cache_size for each connection, in pages or in KiB if negative
+            mmap_size (int): PRAGMA mmap_size for each connection in bytes, 0 to disable memory mapping
+            synchronous (str): PRAGMA synchronous, NORMAL is safe in WAL mode and avoids an fsync per commit
+            timeout (float): seconds to wait for a lock held by another connection
+            query_stats (media_stats.QueryStats): traces the statements run on every connection, None to turn off
+        """
+        if str(synchronous).upper() not in self.SYNCHRONOUS_MODES:
+            raise ValueError(f"synchronous must be one of {self.SYNCHRONOUS_MODES}")
+        self.database_path = database_path
+        self.cache_size = int(cache_size)
+        self.mmap_size = int(mmap_size)
+        self.synchronous = str(synchronous).upper()
+        self.timeout = timeout
+        self.query_stats = query_stats
+        self.write_lock = threading.RLock()
+        self.__writer = None
+        self.__local = threading.local()
+        self.__connections = []
+        self.__connections_lock = threading.Lock()
+
+    def __connect(self):
+        # Connections may be closed by a different thread to the one that used them
+        connection = sqlite3.connect(self.database_path, timeout=self.timeout, check_same_thread=False)
+        connection.execute(f"PRAGMA cache_size = {self.cache_size}")
+        connection.execute(f"PRAGMA mmap_size = {self.mmap_size}")
+        connection.execute(f"PRAGMA synchronous = {self.synchronous}")
+        if self.query_stats is not None:
+            self.query_stats.watch(connection)
+        with self.__connections_lock:
+            self.__connections.append(connection)
+        return connection
+
+    def writer(self):
+        """The connection used for all writes"""
+        with self.__connections_lock:
+            writer = self.__writer
+        if writer is None:
+            with self.write_lock:
+                if self.__writer is None:
+                    writer = self.__connect()
+                    writer.execute("PRAGMA journal_mode = WAL")
+                    self.__writer = writer
+                writer = self.__writer
+        return writer
+
+    def reader(self):
+        """The calling thread's read-only connection"""
+        if self.database_path == ":memory:":
+            # Every connection to :memory: is a separate database
+            return self.writer()
+        connection = getattr(self.__local, "connection", None)
+        if connection is None:
+            self.writer() # Make sure the database is in WAL mode first
+            connection = self.__connect()
+            connection.execute("PRAGMA query_only = 1")
+            self.__local.connection = connection
+        return connection
+
+    def release_reader(self, connection=None):
+        """Close the calling thread's reader connection, for threads that are about to finish
+        Parameters:
+            connection (sqlite3.Connection): reader connection of a thread that has already finished to close instead
+        """
+        if connection is None:
+            connection = getattr(self.__local, "connection", None)
+            if connection is None:
+                return
+            self.__local.connection = None
+        with self.__connections_lock:
+            if connection not in self.__connections:
+                return
+            self.__connections.remove(connection)
+        connection.close()
+
+    def close(self):
+        """Close every connection opened by the manager"""
+        with self.__connections_lock:
+            connections = self.__connections
+            self.__connections = []
+            self.__writer = None
+        self.__local = threading.local()
+        for connection in connections:
+            connection.close()
+
 
 class MediaTable(MediaTableABC):
     
-    def __init__(self, db_connection, db_cursor, main_table_name, column_dict):
+    def __init__(self, db_connection, db_cursor, main_table_name, column_dict, connection_manager=None, query_stats=None,
+        row_cache=None, summaries=None):
         self.__db_connection = db_connection
+        # Optional media_stats.QueryStats counting the operations and queries of this table. Statements
+        # are traced on connections opened by a connection manager with the same QueryStats
+        self.query_stats = query_stats
+        if query_stats is not None:
+            db_cursor = query_stats.cursor(db_cursor)
+            if connection_manager is None:
+                query_stats.watch(db_connection)
         self.__db_cursor = db_cursor
+        # Optional RowCache of records by rowid. Rows changed in a transaction are removed from it
+        # straight away and again when it commits, in case another thread read the old values meanwhile
+        self.row_cache = row_cache
+        self.__changed_rowids = set()
+        # With a connection manager, reads outside a transaction use the calling thread's reader
+        # connection and writes from any thread are serialised by the manager's write lock
+        self.__connection_manager = connection_manager
+        if connection_manager is None:
+            self.__write_lock = threading.RLock()
+        else:
+            self.__write_lock = connection_manager.write_lock
+        self.__transaction_thread = None
         self.__table_name = main_table_name
         self.__column_dict = column_dict
-        self.__create_table()
+        # Categories are stored as a list of names plus a record-category membership table
+        self.__categories_table_name = f"{main_table_name}__categories"
+        self.__members_table_name = f"{main_table_name}__category_members"
+        # Catalog of category name -> [category_id, record count] and the main table record count,
+        # read from the database on first use and kept up to date by writes through this object
+        self.__category_catalog = None
+        self.__record_count = None
+        # Goes up when a transaction starts and again when it ends, so it is odd while one is running.
+        # A count read on a reader connection is only cached if no transaction ran while it was read,
+        # otherwise it could miss changes the transaction has already made to the cached counts
+        self.__cache_version = 0
+        self.__cache_lock = threading.Lock()
+        self.__transaction_depth = 0
+        self.__search_table_name = f"{main_table_name}__search"
+        self.__keys_table_name = f"{main_table_name}__keys"
+        self.__words_table_name = f"{main_table_name}__words"
+        self.__word_trigrams_table_name = f"{main_table_name}__word_trigrams"
+        # Summary name -> (column, bucket size), by default the ones in SUMMARIES for this table
+        self.__summaries = dict(SUMMARIES.get(main_table_name, {}) if summaries is None else summaries)
+        # Creating tables, backfills and their commits go through the writer connection like any
+        # other write, so they wait for a transaction another thread has open on it
+        with self.__write_lock:
+            self.__create_table()
+            self.__create_column_indexes()
+            self.__create_category_tables()
+            self.__migrate_legacy_category_tables()
+            self.__create_search_index()
+            self.__create_duplicate_index()
+            self.__create_fuzzy_index()
+            self.__create_summary_tables()
 
     def __create_table(self):
         self.__table_key_value_string = ""
@@ -84,107 +733,983 @@ class MediaTable(MediaTableABC):
         self.__db_cursor.execute(create_table_command)
         self.__db_connection.commit()
     
-    def __create_category_table(self, table_name):
-        table_key_value_string = "orig_id int, "
+    def __create_column_indexes(self):
+        # Sorting by a column walks its index instead of sorting the table, and filters can use them too.
+        # Each index entry ends with the rowid so ties come out in rowid order.
         for key in self.__column_dict:
-            table_key_value_string += f"{key} {self.__column_dict[key]}, "
-        table_key_value_string = table_key_value_string[:-2]
-        create_table_command = f"CREATE TABLE IF NOT EXISTS {table_name} ({table_key_value_string})"
-        self.__db_cursor.execute(create_table_command)
+            self.__db_cursor.execute(f"CREATE INDEX IF NOT EXISTS {self.__table_name}__sort_{key} ON {self.__table_name} ({key})")
         self.__db_connection.commit()
-    
-    def add_record(self, record):
-        record_placeholder = ("?, "*len(record))[:-2]
-        self.__db_cursor.execute(f"INSERT INTO {self.__table_name} VALUES ({record_placeholder})", record)
+
+    def __create_category_tables(self):
+        self.__db_cursor.execute(f"""CREATE TABLE IF NOT EXISTS {self.__categories_table_name} (
+                                    category_id integer PRIMARY KEY,
+                                    name text NOT NULL UNIQUE
+                                )""")
+        # rowid of the membership table keeps the order records were added to a category
+        self.__db_cursor.execute(f"""CREATE TABLE IF NOT EXISTS {self.__members_table_name} (
+                                    category_id integer NOT NULL,
+                                    record_id integer NOT NULL,
+                                    UNIQUE (category_id, record_id)
+                                )""")
+        self.__db_cursor.execute(f"""CREATE INDEX IF NOT EXISTS {self.__members_table_name}_record_id
+                                    ON {self.__members_table_name} (record_id)""")
         self.__db_connection.commit()
     
-    def edit_record(self, id, **kwargs):
-        for key in kwargs:
-            self.__db_cursor.execute(f"UPDATE {self.__table_name} SET {key} = '{kwargs[key]}' WHERE rowid = '{id}'")
+    def __create_search_index(self):
+        # FTS5 index over the main table, kept in sync by triggers. External content means the
+        # text isn't stored twice. If SQLite was built without FTS5, search falls back to LIKE.
+        self.__db_cursor.execute("SELECT name FROM sqlite_master WHERE name = ?", (self.__search_table_name,))
+        index_exists = self.__db_cursor.fetchone() is not None
+        columns = ", ".join(self.__column_dict)
+        new_columns = ", ".join(f"new.{key}" for key in self.__column_dict)
+        old_columns = ", ".join(f"old.{key}" for key in self.__column_dict)
+        try:
+            self.__db_cursor.execute(f"""CREATE VIRTUAL TABLE IF NOT EXISTS {self.__search_table_name}
+                                        USING fts5({columns}, content='{self.__table_name}', content_rowid='rowid')""")
+        except sqlite3.OperationalError:
+            self.__search_enabled = False
+            return
+        self.__search_enabled = True
+        self.__db_cursor.execute(f"""CREATE TRIGGER IF NOT EXISTS {self.__search_table_name}_insert
+                                    AFTER INSERT ON {self.__table_name} BEGIN
+                                        INSERT INTO {self.__search_table_name} (rowid, {columns}) VALUES (new.rowid, {new_columns});
+                                    END""")
+        self.__db_cursor.execute(f"""CREATE TRIGGER IF NOT EXISTS {self.__search_table_name}_delete
+                                    AFTER DELETE ON {self.__table_name} BEGIN
+                                        INSERT INTO {self.__search_table_name} ({self.__search_table_name}, rowid, {columns})
+                                            VALUES ('delete', old.rowid, {old_columns});
+                                    END""")
+        self.__db_cursor.execute(f"""CREATE TRIGGER IF NOT EXISTS {self.__search_table_name}_update
+                                    AFTER UPDATE ON {self.__table_name} BEGIN
+                                        INSERT INTO {self.__search_table_name} ({self.__search_table_name}, rowid, {columns})
+                                            VALUES ('delete', old.rowid, {old_columns});
+                                        INSERT INTO {self.__search_table_name} (rowid, {columns}) VALUES (new.rowid, {new_columns});
+                                    END""")
+        # Index records that were added before the index existed
+        if not index_exists:
+            self.__db_cursor.execute(f"INSERT INTO {self.__search_table_name} ({self.__search_table_name}) VALUES ('rebuild')")
+        self.__db_connection.commit()
+
+    def __create_duplicate_index(self):
+        # The normalized_key of every record, indexed so a duplicate is found with one lookup. Keys are
+        # written by this class and deleted by a trigger. Records added by other programs get keys when
+        # a table is next opened, as long as they were added after the newest record with a key.
+        self.__db_cursor.execute(f"""CREATE TABLE IF NOT EXISTS {self.__keys_table_name} (
+                                    record_id integer PRIMARY KEY,
+                                    key text NOT NULL
+                                )""")
+        # Entries are (key, record_id), so duplicates are next to each other in rowid order
+        self.__db_cursor.execute(f"CREATE INDEX IF NOT EXISTS {self.__keys_table_name}_key ON {self.__keys_table_name} (key)")
+        self.__db_cursor.execute(f"""CREATE TRIGGER IF NOT EXISTS {self.__keys_table_name}_delete
+                                    AFTER DELETE ON {self.__table_name} BEGIN
+                                        DELETE FROM {self.__keys_table_name} WHERE record_id = old.rowid;
+                                    END""")
+        # The function is only used in statements run on this connection, never in the schema, so
+        # other connections don't need it
+        self.__db_connection.create_function("media_normalized_key", len(self.__column_dict), lambda *x : normalized_key(x),
+            deterministic=True)
+        columns = ", ".join(self.__column_dict)
+        self.__set_keys_command = f"""INSERT OR REPLACE INTO {self.__keys_table_name} (record_id, key)
+                                        SELECT rowid, media_normalized_key({columns}) FROM {self.__table_name}"""
+        self.__db_cursor.execute(f"{self.__set_keys_command} WHERE rowid > (SELECT ifnull(max(record_id), 0) FROM {self.__keys_table_name})")
+        self.__db_connection.commit()
+
+    def __create_fuzzy_index(self):
+        # Every distinct word in the library with an FTS5 trigram index over them, so the words most like a
+        # misspelt word are found without reading the records. Words are indexed with a space either side
+        # so their first and last letters make trigrams too. Words are added by this class's writes and
+        # the words of deleted or edited records stay until optimize(), which only costs a suggestion
+        # that finds nothing. Needs FTS5 and its trigram tokenizer, otherwise fuzzy_search is search.
+        self.__fuzzy_enabled = False
+        if not self.__search_enabled:
+            return
+        self.__db_cursor.execute("SELECT name FROM sqlite_master WHERE name = ?", (self.__word_trigrams_table_name,))
+        index_exists = self.__db_cursor.fetchone() is not None
+        self.__db_cursor.execute(f"""CREATE TABLE IF NOT EXISTS {self.__words_table_name} (
+                                    word_id integer PRIMARY KEY,
+                                    word text NOT NULL UNIQUE
+                                )""")
+        try:
+            self.__db_cursor.execute(f"""CREATE VIRTUAL TABLE IF NOT EXISTS {self.__word_trigrams_table_name}
+                                        USING fts5(word, content='{self.__words_table_name}', content_rowid='word_id',
+                                        tokenize='trigram')""")
+        except sqlite3.OperationalError:
             self.__db_connection.commit()
-        self.__edit_record_in_categories(id, **kwargs)
-    
-    def __edit_record_in_categories(self, id, **kwargs):
-        table_names = self.__get_table_names()
+            return
+        self.__fuzzy_enabled = True
+        # New words are indexed by __insert_words, all in one statement rather than with a trigger for each
+        self.__db_cursor.execute(f"DROP TRIGGER IF EXISTS {self.__word_trigrams_table_name}_insert")
+        self.__db_cursor.execute(f"""CREATE TRIGGER IF NOT EXISTS {self.__word_trigrams_table_name}_delete
+                                    AFTER DELETE ON {self.__words_table_name} BEGIN
+                                        INSERT INTO {self.__word_trigrams_table_name} ({self.__word_trigrams_table_name}, rowid, word)
+                                            VALUES ('delete', old.word_id, ' ' || old.word || ' ');
+                                    END""")
+        if not index_exists:
+            self.__sync_words()
+        self.__db_connection.commit()
+
+    def __sync_words(self):
+        # Make the words table hold exactly the words in the search index, read from its vocabulary
+        # rather than the records
+        vocabulary_table_name = f"temp.{self.__search_table_name}_vocabulary"
+        self.__db_cursor.execute(f"""CREATE VIRTUAL TABLE IF NOT EXISTS {vocabulary_table_name}
+                                    USING fts5vocab(main, {self.__search_table_name}, 'row')""")
+        self.__db_cursor.execute(f"DELETE FROM {self.__words_table_name} WHERE word NOT IN (SELECT term FROM {vocabulary_table_name})")
+        self.__db_cursor.execute(f"SELECT term FROM {vocabulary_table_name}")
+        self.__insert_words(x[0] for x in self.__db_cursor.fetchall())
+
+    def __add_words(self, records):
+        # Add the words of records that are new to the library, each distinct word once
+        if self.__fuzzy_enabled:
+            self.__insert_words(self.__record_words(records))
+
+    def __record_words(self, records):
+        # Values can't share a word when joined with spaces, and one long string is split much faster
+        return set(search_words(" ".join(str(value) for record in records for value in record if value is not None)))
+
+    def __insert_words(self, words):
+        self.__db_cursor.execute(f"SELECT ifnull(max(word_id), 0) FROM {self.__words_table_name}")
+        last_word_id = self.__db_cursor.fetchone()[0]
+        self.__db_cursor.executemany(f"INSERT OR IGNORE INTO {self.__words_table_name} (word) VALUES (?)", ((x,) for x in words))
+        self.__db_cursor.execute(f"""INSERT INTO {self.__word_trigrams_table_name} (rowid, word)
+                                    SELECT word_id, ' ' || word || ' ' FROM {self.__words_table_name} WHERE word_id > ?""", (last_word_id,))
+
+    def __create_summary_tables(self):
+        # A table of value -> record count for each summary, kept up to date by triggers so they are right
+        # whichever program writes to the database. Values can be NULL, which a primary key would allow
+        # more than once, so rows are only inserted if the value isn't already there.
+        # add_records pauses the insert triggers of its summaries by naming them in the paused table, and
+        # counts the records it added with one query per summary instead
+        self.__paused_summaries_table_name = f"{self.__table_name}__paused_summaries"
+        self.__db_cursor.execute(f"CREATE TABLE IF NOT EXISTS {self.__paused_summaries_table_name} (name text PRIMARY KEY)")
+        self.__summary_count_commands = []
+        for name, (column, bucket_size) in self.__summaries.items():
+            if re.fullmatch(r"\w+", name) is None:
+                raise ValueError(f"Summary name '{name}' must be letters, digits and underscores")
+            if column not in self.__column_dict:
+                raise ValueError(f"{self.__table_name} has no column '{column}'")
+            if bucket_size is not None and (not isinstance(bucket_size, int) or bucket_size < 1):
+                raise ValueError("bucket size must be a positive integer or None")
+            summary_table_name = self.__summary_table_name(name)
+            self.__db_cursor.execute("SELECT name FROM sqlite_master WHERE name = ?", (summary_table_name,))
+            table_exists = self.__db_cursor.fetchone() is not None
+            self.__db_cursor.execute(f"CREATE TABLE IF NOT EXISTS {summary_table_name} (value, count integer NOT NULL)")
+            self.__db_cursor.execute(f"CREATE UNIQUE INDEX IF NOT EXISTS {summary_table_name}_value ON {summary_table_name} (value)")
+            # So the most common values are read from the start of an index, however many values there are
+            self.__db_cursor.execute(f"""CREATE INDEX IF NOT EXISTS {summary_table_name}_count
+                                        ON {summary_table_name} (count DESC, value)""")
+
+            def value(row):
+                return f"{row}.{column}" if bucket_size is None else f"{row}.{column} / {bucket_size} * {bucket_size}"
+            def add(row):
+                return f"""INSERT INTO {summary_table_name} (value, count) SELECT {value(row)}, 0
+                                WHERE NOT EXISTS (SELECT 1 FROM {summary_table_name} WHERE value IS {value(row)});
+                            UPDATE {summary_table_name} SET count = count + 1 WHERE value IS {value(row)};"""
+            def remove(row):
+                return f"""UPDATE {summary_table_name} SET count = count - 1 WHERE value IS {value(row)};
+                            DELETE FROM {summary_table_name} WHERE value IS {value(row)} AND count = 0;"""
+            # Insert triggers made before they could be paused are replaced
+            self.__db_cursor.execute("SELECT sql FROM sqlite_master WHERE name = ?", (f"{summary_table_name}_insert",))
+            trigger = self.__db_cursor.fetchone()
+            if trigger is not None and self.__paused_summaries_table_name not in trigger[0]:
+                self.__db_cursor.execute(f"DROP TRIGGER {summary_table_name}_insert")
+            self.__db_cursor.execute(f"""CREATE TRIGGER IF NOT EXISTS {summary_table_name}_insert
+                                        AFTER INSERT ON {self.__table_name}
+                                        WHEN NOT EXISTS (SELECT 1 FROM {self.__paused_summaries_table_name} WHERE name = '{name}')
+                                        BEGIN {add("new")} END""")
+            self.__db_cursor.execute(f"""CREATE TRIGGER IF NOT EXISTS {summary_table_name}_delete
+                                        AFTER DELETE ON {self.__table_name} BEGIN {remove("old")} END""")
+            self.__db_cursor.execute(f"""CREATE TRIGGER IF NOT EXISTS {summary_table_name}_update
+                                        AFTER UPDATE OF {column} ON {self.__table_name}
+                                        WHEN {value("old")} IS NOT {value("new")} BEGIN {remove("old")} {add("new")} END""")
+            # Count records that were added before the summary existed
+            if not table_exists:
+                self.__db_cursor.execute(f"""INSERT INTO {summary_table_name} (value, count)
+                                            SELECT {value(self.__table_name)}, count(*) FROM {self.__table_name} GROUP BY 1""")
+            # Add the records from a rowid on to the counts. NULL is never a conflict in a unique index,
+            # so its count is added separately. NOT INDEXED makes them read the rowid range rather than a
+            # whole column index
+            self.__summary_count_commands += [
+                f"""INSERT INTO {summary_table_name} (value, count)
+                    SELECT {value(self.__table_name)}, count(*) FROM {self.__table_name} NOT INDEXED
+                    WHERE rowid >= :rowid AND {value(self.__table_name)} IS NOT NULL GROUP BY 1
+                    ON CONFLICT (value) DO UPDATE SET count = count + excluded.count""",
+                f"""UPDATE {summary_table_name} SET count = count + (SELECT count(*) FROM {self.__table_name} NOT INDEXED
+                    WHERE rowid >= :rowid AND {value(self.__table_name)} IS NULL) WHERE value IS NULL""",
+                f"""INSERT INTO {summary_table_name} (value, count)
+                    SELECT NULL, count(*) FROM {self.__table_name} NOT INDEXED WHERE rowid >= :rowid AND {value(self.__table_name)} IS NULL
+                    HAVING count(*) > 0 AND NOT EXISTS (SELECT 1 FROM {summary_table_name} WHERE value IS NULL)"""]
+        self.__db_connection.commit()
+
+    def __pause_summaries(self):
+        # Stop the insert triggers of this table's summaries until __count_summaries
+        self.__db_cursor.executemany(f"INSERT OR IGNORE INTO {self.__paused_summaries_table_name} (name) VALUES (?)",
+            ((x,) for x in self.__summaries))
+
+    def __count_summaries(self, first_id):
+        # Add the records inserted from first_id on while the triggers were paused, and start them again
+        for command in self.__summary_count_commands:
+            self.__db_cursor.execute(command, {"rowid": first_id})
+        self.__db_cursor.execute(f"DELETE FROM {self.__paused_summaries_table_name}")
 
-        for table_name in table_names:
-            if self.__table_name != table_name:
-                for key in kwargs:
-                    self.__db_cursor.execute(f"UPDATE {table_name} SET {key} = '{kwargs[key]}' WHERE orig_id = '{id}'")
-                    self.__db_connection.commit()
+    def __summary_table_name(self, name):
+        return f"{self.__table_name}__summary_{name}"
+
+    def __update_keys(self, ids):
+        # Recalculate the keys of edited records
+        self.__db_cursor.execute(f"{self.__set_keys_command} WHERE rowid IN (SELECT value FROM json_each(?))", (json.dumps(list(ids)),))
+
+    def __find_keys(self, keys):
+        # rowid of the first record with each of keys that exists
+        self.__db_cursor.execute(f"""SELECT key, min(record_id) FROM {self.__keys_table_name}
+                                    WHERE key IN (SELECT value FROM json_each(?)) GROUP BY key""", (json.dumps(list(keys)),))
+        return dict(self.__db_cursor.fetchall())
     
-    def delete_record(self, id):
-        self.__db_cursor.execute(f"DELETE from {self.__table_name} WHERE rowid = '{id}'")
+    def __migrate_legacy_category_tables(self):
+        # Older databases store each category as a full copy table named <main>_<category>
+        # whose first column is orig_id. Move their membership into the new tables and drop them.
+        self.__db_cursor.execute("SELECT name FROM sqlite_master WHERE type='table' AND name LIKE ? ESCAPE '\\' ORDER BY rowid",
+            (self.__table_name.replace('_', '\\_') + "\\_%",))
+        candidate_names = [x[0] for x in self.__db_cursor.fetchall()]
+        legacy_table_names = []
+        for table_name in candidate_names:
+            self.__db_cursor.execute(f"PRAGMA table_info({table_name})")
+            columns = [x[1] for x in self.__db_cursor.fetchall()]
+            if len(columns) > 0 and columns[0] == "orig_id":
+                legacy_table_names.append(table_name)
+        if len(legacy_table_names) == 0:
+            return
+
+        for table_name in legacy_table_names:
+            category_id = self.__get_or_create_category_id(table_name[len(self.__table_name)+1:])
+            self.__db_cursor.execute(f"""INSERT OR IGNORE INTO {self.__members_table_name} (category_id, record_id)
+                                        SELECT ?, orig_id FROM {table_name} ORDER BY rowid""", (category_id,))
+            self.__db_cursor.execute(f"DROP TABLE {table_name}")
         self.__db_connection.commit()
-        self.__delete_record_in_categories(id)
+        self.__category_catalog = None
     
-    def __delete_record_in_categories(self, id):
-        table_names = self.__get_table_names()
+    def __get_category_catalog(self):
+        catalog = self.__category_catalog
+        if catalog is None:
+            version = self.__cache_version
+            cursor = self.__read_cursor()
+            cursor.execute(f"""SELECT c.name, c.category_id, count(m.record_id) FROM {self.__categories_table_name} c
+                                        LEFT JOIN {self.__members_table_name} m ON m.category_id = c.category_id
+                                        GROUP BY c.category_id ORDER BY c.category_id""")
+            catalog = {x[0]: [x[1], x[2]] for x in cursor.fetchall()}
+            with self.__cache_lock:
+                if self.__can_cache(version):
+                    self.__category_catalog = catalog
+        return catalog
 
-        for table_name in table_names:
-            if self.__table_name != table_name:
-                self.__db_cursor.execute(f"DELETE from {table_name} WHERE orig_id = '{id}'")
+    def __can_cache(self, version):
+        # Whether counts read since the cache version was version can be cached, called holding the cache
+        # lock so a transaction can't start between the check and the counts being cached
+        if self.__transaction_thread == threading.get_ident():
+            return True
+        return version % 2 == 0 and version == self.__cache_version
+
+    def __next_cache_version(self):
+        with self.__cache_lock:
+            self.__cache_version += 1
+    
+    def __get_category_id(self, category_name):
+        catalog_entry = self.__get_category_catalog().get(category_name)
+        if catalog_entry is None:
+            return None
+        return catalog_entry[0]
+    
+    def __get_or_create_category_id(self, category_name):
+        category_id = self.__get_category_id(category_name)
+        if category_id is None:
+            self.__db_cursor.execute(f"INSERT INTO {self.__categories_table_name} (name) VALUES (?)", (category_name,))
+            category_id = self.__db_cursor.lastrowid
+            self.__get_category_catalog()[category_name] = [category_id, 0]
+        return category_id
+    
+    @contextlib.contextmanager
+    def transaction(self):
+        """Context manager grouping any number of operations on this table into one atomic commit.
+        Nested transactions join the outermost one. If an exception is raised everything is rolled back.
+        Every write method runs in a transaction, which also stops other threads writing at the same time."""
+        with self.__write_lock:
+            if self.__transaction_depth == 0:
+                self.__next_cache_version()
+            self.__transaction_depth += 1
+            self.__transaction_thread = threading.get_ident()
+            try:
+                yield self
+            except BaseException:
+                self.__transaction_depth -= 1
+                if self.__transaction_depth == 0:
+                    self.__transaction_thread = None
+                    self.__db_connection.rollback()
+                    self.__next_cache_version()
+                    # Cached counts may include changes that were just undone
+                    self.__category_catalog = None
+                    self.__record_count = None
+                    # Records read inside the transaction may have been added by it, which isn't tracked
+                    if self.row_cache is not None:
+                        self.__changed_rowids = set()
+                        self.row_cache.clear()
+                raise
+            self.__transaction_depth -= 1
+            # Inside a transaction the commit is left to the end of the outermost one
+            if self.__transaction_depth == 0:
+                self.__transaction_thread = None
                 self.__db_connection.commit()
+                self.__next_cache_version()
+                if self.query_stats is not None:
+                    self.query_stats.record_commit()
+                self.__invalidate_changed_rows()
+
+    def __begin_write(self):
+        # Take the database's write lock now instead of at the first write of the transaction
+        if not self.__db_connection.in_transaction:
+            self.__db_cursor.execute("BEGIN IMMEDIATE")
+
+    def __row_changed(self, id):
+        # Called inside a transaction for every record it changes
+        if self.row_cache is not None:
+            self.row_cache.invalidate([(self.__table_name, id)])
+            self.__changed_rowids.add(id)
+
+    def __invalidate_changed_rows(self):
+        if self.row_cache is not None and len(self.__changed_rowids) > 0:
+            self.row_cache.invalidate([(self.__table_name, x) for x in self.__changed_rowids])
+            self.__changed_rowids = set()
+    
+    def __read_connection(self):
+        # A thread inside a transaction reads through the writer so it sees its own changes
+        if self.__connection_manager is None or self.__transaction_thread == threading.get_ident():
+            return self.__db_connection
+        return self.__connection_manager.reader()
+    
+    def __read_cursor(self):
+        connection = self.__read_connection()
+        if connection is self.__db_connection:
+            return self.__db_cursor
+        return self.__new_cursor(connection)
+
+    def __new_cursor(self, connection):
+        if self.query_stats is None:
+            return connection.cursor()
+        return self.query_stats.cursor(connection.cursor())
+    
+    @media_stats.instrumented
+    def add_record(self, record, on_conflict=None):
+        if on_conflict not in ON_CONFLICT_MODES:
+            raise ValueError(f"on_conflict must be one of {ON_CONFLICT_MODES}")
+        record_placeholder = ("?, "*len(record))[:-2]
+        key = normalized_key(record)
+        with self.transaction():
+            if on_conflict is not None:
+                existing_id = self.__find_keys([key]).get(key)
+                if existing_id is not None:
+                    if on_conflict == "error":
+                        raise DuplicateRecordError(existing_id, record)
+                    if on_conflict == "update":
+                        self.__db_cursor.execute(self.__update_command(tuple(self.__column_dict)), tuple(record) + (existing_id,))
+                        self.__row_changed(existing_id)
+                        self.__add_words([record])
+                    return existing_id
+            self.__db_cursor.execute(f"INSERT INTO {self.__table_name} VALUES ({record_placeholder})", record)
+            record_id = self.__db_cursor.lastrowid
+            self.__db_cursor.execute(f"INSERT INTO {self.__keys_table_name} (record_id, key) VALUES (?, ?)", (record_id, key))
+            self.__add_words([record])
+            if self.__record_count is not None:
+                self.__record_count += 1
+        return record_id
     
-    def get_all_records(self):
+    @media_stats.instrumented
+    def add_records(self, records, batch_size=1000, on_conflict=None):
+        if on_conflict not in ON_CONFLICT_MODES:
+            raise ValueError(f"on_conflict must be one of {ON_CONFLICT_MODES}")
+        record_placeholder = ("?, "*len(self.__column_dict))[:-2]
+        insert_command = f"INSERT INTO {self.__table_name} VALUES ({record_placeholder})"
+        update_command = self.__update_command(tuple(self.__column_dict))
+        records = iter(records)
+        count = 0
+        # Words of the records inserted or updated by every batch, added to the fuzzy index once at the end
+        words = set()
+        with self.transaction():
+            # Keys are written for the rowids the records will get, so no other connection may add
+            # records between reading the largest rowid and inserting
+            self.__begin_write()
+            # Without an explicit rowid SQLite gives each new record the largest rowid plus one
+            self.__db_cursor.execute(f"SELECT ifnull(max(rowid), 0) FROM {self.__table_name}")
+            first_id = self.__db_cursor.fetchone()[0] + 1
+            # Summaries count the inserted records once at the end rather than with a trigger for each record
+            self.__pause_summaries()
+            try:
+                # Records are consumed in batches so a generator is never fully loaded into memory
+                while True:
+                    batch = list(itertools.islice(records, batch_size))
+                    if len(batch) == 0:
+                        break
+                    keys = [normalized_key(x) for x in batch]
+                    next_id = first_id + count
+                    if on_conflict is not None:
+                        # One indexed lookup for the batch, records added by earlier batches already have keys
+                        existing_ids = self.__find_keys(set(keys))
+                        inserts, updates = [], []
+                        for record, key in zip(batch, keys):
+                            if key not in existing_ids:
+                                existing_ids[key] = next_id + len(inserts)
+                                inserts.append((record, key))
+                            elif on_conflict == "error":
+                                raise DuplicateRecordError(existing_ids[key], record)
+                            elif on_conflict == "update":
+                                updates.append(tuple(record) + (existing_ids[key],))
+                        batch = [x[0] for x in inserts]
+                        keys = [x[1] for x in inserts]
+                    self.__db_cursor.executemany(insert_command, batch)
+                    if self.__fuzzy_enabled:
+                        words.update(self.__record_words(batch))
+                    self.__db_cursor.executemany(f"INSERT INTO {self.__keys_table_name} (record_id, key) VALUES (?, ?)",
+                        zip(itertools.count(next_id), keys))
+                    if on_conflict == "update" and len(updates) > 0:
+                        self.__db_cursor.executemany(update_command, updates)
+                        for values in updates:
+                            self.__row_changed(values[-1])
+                        if self.__fuzzy_enabled:
+                            words.update(self.__record_words(x[:-1] for x in updates))
+                    count += len(batch)
+            finally:
+                self.__count_summaries(first_id)
+            if self.__fuzzy_enabled:
+                self.__insert_words(words)
+            if self.__record_count is not None:
+                self.__record_count += count
+        return count
+    
+    def get_column_dict(self):
+        return dict(self.__column_dict)
+    
+    @media_stats.instrumented
+    def edit_record(self, id, **kwargs):
+        # Categories only reference the record so there is a single row to update
+        if len(kwargs) == 0:
+            return
+        keys = tuple(kwargs)
+        with self.transaction():
+            self.__db_cursor.execute(self.__update_command(keys), tuple(kwargs[key] for key in keys) + (id,))
+            self.__row_changed(id)
+            self.__update_keys([id])
+            self.__add_words([kwargs.values()])
+    
+    @media_stats.instrumented
+    def edit_records(self, edits):
+        # Records changing the same columns share one statement run with executemany
+        updates = {}
+        for id in edits:
+            keys = tuple(sorted(edits[id]))
+            if len(keys) > 0:
+                updates.setdefault(keys, []).append(tuple(edits[id][key] for key in keys) + (id,))
+        count = 0
+        with self.transaction():
+            for keys in updates:
+                self.__db_cursor.executemany(self.__update_command(keys), updates[keys])
+                count += self.__db_cursor.rowcount
+                for values in updates[keys]:
+                    self.__row_changed(values[-1])
+            self.__update_keys(edits)
+            self.__add_words(x.values() for x in edits.values())
+        return count
+    
+    def __update_command(self, keys):
+        # Column names can't be parameters so they are checked against the table's columns
+        for key in keys:
+            if key not in self.__column_dict:
+                raise ValueError(f"{self.__table_name} has no column '{key}'")
+        set_string = ", ".join(f"{key} = ?" for key in keys)
+        return f"UPDATE {self.__table_name} SET {set_string} WHERE rowid = ?"
+    
+    @media_stats.instrumented
+    def delete_record(self, id):
+        with self.transaction():
+            self.__db_cursor.execute(f"DELETE from {self.__table_name} WHERE rowid = ?", (id,))
+            self.__row_changed(id)
+            if self.__record_count is not None:
+                self.__record_count -= self.__db_cursor.rowcount
+            self.__db_cursor.execute(f"DELETE from {self.__members_table_name} WHERE record_id = ?", (id,))
+            if self.__db_cursor.rowcount > 0:
+                # The record was in some categories, reload their counts when next needed
+                self.__category_catalog = None
+
+    def __id_list(self, ids):
+        # The rowids are bound as one JSON array and read back with json_each, so a statement
+        # takes any number of them without hitting SQLite's limit on parameters
+        ids = [int(x) for x in ids]
+        return ids, json.dumps(ids)
+
+    @media_stats.instrumented
+    def delete_records(self, ids):
+        ids, id_list = self.__id_list(ids)
+        with self.transaction():
+            self.__db_cursor.execute(f"DELETE from {self.__table_name} WHERE rowid IN (SELECT value FROM json_each(?))", (id_list,))
+            count = self.__db_cursor.rowcount
+            for id in ids:
+                self.__row_changed(id)
+            if self.__record_count is not None:
+                self.__record_count -= count
+            self.__db_cursor.execute(f"DELETE from {self.__members_table_name} WHERE record_id IN (SELECT value FROM json_each(?))",
+                (id_list,))
+            if self.__db_cursor.rowcount > 0:
+                self.__category_catalog = None
+        return count
+    
+    @media_stats.instrumented
+    def find_duplicates(self):
+        # A single pass over the key index, which is in key order so each group is read together
+        cursor = self.__read_cursor()
+        cursor.execute(f"""SELECT group_concat(record_id) FROM {self.__keys_table_name}
+                            GROUP BY key HAVING count(*) > 1""")
+        groups = [sorted(int(x) for x in row[0].split(",")) for row in cursor.fetchall()]
+        return sorted(groups)
+
+    def get_summary_names(self):
+        return list(self.__summaries)
+
+    @media_stats.instrumented
+    def stats(self, group_by, most_common=None):
+        if group_by not in self.__summaries:
+            raise ValueError(f"{self.__table_name} has no summary '{group_by}', it has {list(self.__summaries)}")
+        cursor = self.__read_cursor()
+        summary_table_name = self.__summary_table_name(group_by)
+        if most_common is None:
+            cursor.execute(f"SELECT value, count FROM {summary_table_name} ORDER BY value")
+        else:
+            cursor.execute(f"SELECT value, count FROM {summary_table_name} ORDER BY count DESC, value LIMIT ?", (most_common,))
+        return cursor.fetchall()
+
+    @media_stats.instrumented
+    def get_all_records(self, columnar=False):
         tables = {}
-        self.__db_cursor.execute(f"SELECT rowid, * FROM {self.__table_name} ORDER BY rowid")
-        self.__db_connection.commit()
-        fetched_data = self.__db_cursor.fetchall()
-        tables[self.__table_name] = fetched_data
-        table_names = self.__get_table_names()
-        for table_name in table_names:
-            if self.__table_name != table_name:
-                self.__db_cursor.execute(f"SELECT rowid, * FROM {table_name} ORDER BY rowid")
-                self.__db_connection.commit()
-                fetched_data = self.__db_cursor.fetchall()
-                tables[table_name] = fetched_data
+        cursor = self.__read_cursor()
+        cursor.execute(f"SELECT rowid, * FROM {self.__table_name} ORDER BY rowid")
+        tables[self.__table_name] = self.__fetch_result(cursor, ["id"], columnar)
+        # Category records keep the old (rowid, orig_id, *columns) layout, as columnar records the
+        # columns are named member_id and id
+        for category_id, category_name in self.__get_categories():
+            cursor.execute(f"""SELECT m.rowid, t.rowid, t.* FROM {self.__members_table_name} m
+                                JOIN {self.__table_name} t ON t.rowid = m.record_id
+                                WHERE m.category_id = ? ORDER BY m.rowid""", (category_id,))
+            tables[f"{self.__table_name}_{category_name}"] = self.__fetch_result(cursor, ["member_id", "id"], columnar)
         return tables
+
+    def __fetch_result(self, rows, id_names, columnar):
+        # Rows from a cursor or iter_records, as a list of tuples or ColumnarRecords
+        if not columnar:
+            return rows.fetchall()
+        names = id_names + list(self.__column_dict)
+        column_types = ["integer"] * len(id_names) + list(self.__column_dict.values())
+        return ColumnarRecords.from_rows(names, column_types, rows)
+
+    @media_stats.instrumented
+    def read_columns(self, category_name=None, sort=None, descending=False, filters=None, batch_size=500):
+        return self.__fetch_result(self.iter_records(category_name, batch_size, sort, descending, filters), ["id"], True)
+    
+    @media_stats.instrumented
+    def get_record(self, id):
+        if self.row_cache is not None:
+            record = self.row_cache.get((self.__table_name, id))
+            if record is not None:
+                return record
+            version = self.row_cache.version()
+        cursor = self.__read_cursor()
+        cursor.execute(f"SELECT rowid, * FROM {self.__table_name} WHERE rowid = ?", (id,))
+        record = cursor.fetchone()
+        if record is not None and self.row_cache is not None:
+            self.row_cache.put(self.__table_name, [record], version)
+        return record
+    
+    @media_stats.instrumented
+    def get_records(self, category_name=None, after_rowid=0, limit=100, offset=0, sort=None, descending=False, filters=None):
+        if sort in (None, "rowid") and not descending and not filters:
+            query = self.__page_query(category_name)
+            if query is not None:
+                query = (query[0] + " OFFSET ?", query[1] + (after_rowid, limit, offset))
+        else:
+            query = self.__sorted_page_query(category_name, after_rowid, limit, offset, sort, descending, filters)
+        if query is None:
+            return []
+        if self.row_cache is not None:
+            version = self.row_cache.version()
+        cursor = self.__read_cursor()
+        cursor.execute(*query)
+        records = cursor.fetchall()
+        # Records on the page being shown are the ones most likely to be edited or categorised next
+        if self.row_cache is not None:
+            self.row_cache.put(self.__table_name, records, version)
+        return records
+    
+    @media_stats.instrumented
+    def search(self, query, limit=100, category_name=None):
+        words = re.findall(r"\w+", query)
+        if len(words) == 0:
+            return []
+        category_filter = ""
+        parameters = ()
+        if category_name is not None:
+            category_id = self.__get_category_id(category_name)
+            if category_id is None:
+                return []
+            category_filter = f"AND t.rowid IN (SELECT record_id FROM {self.__members_table_name} WHERE category_id = ?)"
+            parameters = (category_id,)
+
+        cursor = self.__read_cursor()
+        if self.__search_enabled:
+            # Every word must match the start of a word in the record, ranked by bm25
+            match = " ".join(f'"{word}"*' for word in words)
+            cursor.execute(f"""SELECT t.rowid, t.* FROM {self.__search_table_name} f
+                                        JOIN {self.__table_name} t ON t.rowid = f.rowid
+                                        WHERE {self.__search_table_name} MATCH ? {category_filter}
+                                        ORDER BY f.rank LIMIT ?""", (match,) + parameters + (limit,))
+        else:
+            word_filter = " OR ".join(f"t.{key} LIKE ?" for key in self.__column_dict)
+            word_filters = " AND ".join(f"({word_filter})" for word in words)
+            word_parameters = tuple(f"%{word}%" for word in words for key in self.__column_dict)
+            cursor.execute(f"""SELECT t.rowid, t.* FROM {self.__table_name} t
+                                WHERE {word_filters} {category_filter}
+                                ORDER BY t.rowid LIMIT ?""", word_parameters + parameters + (limit,))
+        return cursor.fetchall()
+
+    @media_stats.instrumented
+    def suggest(self, text):
+        if not self.__fuzzy_enabled:
+            return None
+        cursor = self.__read_cursor()
+        words = search_words(text)
+        # Search matches words as prefixes, so a word that starts a word in the library is kept as it is.
+        # Words under three letters have no trigram of their own to match on.
+        known = []
+        for word in words:
+            cursor.execute(f"SELECT 1 FROM {self.__words_table_name} WHERE word >= ? AND word < ? LIMIT 1",
+                (word, word + "\U0010ffff"))
+            if len(word) < 3 or cursor.fetchone() is not None:
+                known.append(word)
+        corrected = []
+        for word in words:
+            if word in known:
+                corrected.append(word)
+                continue
+            # Words sharing the most trigrams with it, best first by bm25, then scored on all their trigrams
+            padded = f" {word} "
+            match = " OR ".join(f'"{padded[i:i + 3]}"' for i in range(len(padded) - 2))
+            cursor.execute(f"""SELECT w.word FROM {self.__word_trigrams_table_name} f
+                                JOIN {self.__words_table_name} w ON w.word_id = f.rowid
+                                WHERE {self.__word_trigrams_table_name} MATCH ? ORDER BY f.rank LIMIT 200""", (match,))
+            candidates = [(similarity(word, x[0]), x[0]) for x in cursor.fetchall()]
+            candidates = [x[1] for x in sorted(candidates, key=lambda x : -x[0]) if x[0] >= SIMILARITY_THRESHOLD]
+            if len(candidates) == 0:
+                corrected.append(word)
+                continue
+            # The most similar word that is found in a record together with the rest of the search
+            others = known + [x for x in corrected if x not in known]
+            corrected.append(next((x for x in candidates[:20] if self.__any_record_matches(cursor, others + [x])), candidates[0]))
+        if corrected == words:
+            return None
+        return " ".join(corrected)
+
+    def __any_record_matches(self, cursor, words):
+        cursor.execute(f"SELECT 1 FROM {self.__search_table_name} WHERE {self.__search_table_name} MATCH ? LIMIT 1",
+            (" ".join(f'"{word}"*' for word in words),))
+        return cursor.fetchone() is not None
+
+    @media_stats.instrumented
+    def fuzzy_search(self, text, limit=100, category_name=None):
+        suggestion = self.suggest(text)
+        records = self.search(text if suggestion is None else suggestion, limit, category_name)
+        # Each word searched for scores its similarity to the most similar word of the record. sorted is
+        # stable, so records that score the same keep their bm25 order
+        words = search_words(text)
+        def score(record):
+            record_words = search_words(" ".join(str(x) for x in record[1:] if x is not None))
+            return sum(max((similarity(word, x) for x in record_words), default=0) for word in words)
+        return sorted(records, key=score, reverse=True)
+    
+    @media_stats.instrumented
+    def count_records(self, category_name=None, filters=None):
+        if filters:
+            conditions, parameters = self.__filter_conditions(filters)
+            if category_name is not None:
+                category_id = self.__get_category_id(category_name)
+                if category_id is None:
+                    return 0
+                conditions.append(f"EXISTS (SELECT 1 FROM {self.__members_table_name} m WHERE m.category_id = ? AND m.record_id = t.rowid)")
+                parameters += (category_id,)
+            cursor = self.__read_cursor()
+            cursor.execute(f"SELECT count(*) FROM {self.__table_name} t WHERE {' AND '.join(conditions)}", parameters)
+            return cursor.fetchone()[0]
+        if category_name is not None:
+            catalog_entry = self.__get_category_catalog().get(category_name)
+            if catalog_entry is None:
+                return 0
+            return catalog_entry[1]
+        return self.__count_all_records()
+
+    def __count_all_records(self):
+        # Not instrumented so other operations can use it without being counted as a count_records call
+        record_count = self.__record_count
+        if record_count is None:
+            version = self.__cache_version
+            cursor = self.__read_cursor()
+            cursor.execute(f"SELECT count(*) FROM {self.__table_name}")
+            record_count = cursor.fetchone()[0]
+            with self.__cache_lock:
+                if self.__can_cache(version):
+                    self.__record_count = record_count
+        return record_count
+    
+    @media_stats.instrumented
+    def iter_records(self, category_name=None, batch_size=500, sort=None, descending=False, filters=None):
+        """Generator over every record of the main table or a category, fetched batch_size rows
+        at a time. Uses its own cursor so other operations can run while it is being consumed.
+        sort, descending and filters are as for get_records."""
+        if sort not in (None, "rowid") or descending or filters:
+            after_rowid = 0
+            while True:
+                records = self.get_records(category_name, after_rowid, batch_size, 0, sort, descending, filters)
+                yield from records
+                if len(records) < batch_size:
+                    return
+                after_rowid = records[-1][0]
+        query = self.__page_query(category_name)
+        if query is None:
+            return
+        after_rowid = 0
+        cursor = self.__new_cursor(self.__read_connection())
+        try:
+            while True:
+                cursor.execute(query[0], query[1] + (after_rowid, batch_size))
+                records = cursor.fetchmany(batch_size)
+                if len(records) == 0:
+                    break
+                yield from records
+                after_rowid = records[-1][0]
+        finally:
+            cursor.close()
     
+    @media_stats.instrumented
+    def export_records(self, category_name=None, file_format="csv", batch_size=500):
+        """Generator of CSV (with a header row) or JSONL text for the main table or a category.
+        Each string yielded holds at most batch_size records so memory use stays bounded."""
+        if file_format not in ("csv", "jsonl"):
+            raise ValueError(f"Unsupported export format: {file_format}")
+        column_names = list(self.__column_dict)
+        records = self.iter_records(category_name, batch_size)
+        if file_format == "csv":
+            buffer = io.StringIO()
+            writer = csv.writer(buffer, lineterminator="\n")
+            writer.writerow(column_names)
+            yield buffer.getvalue()
+        while True:
+            batch = list(itertools.islice(records, batch_size))
+            if len(batch) == 0:
+                break
+            if file_format == "csv":
+                buffer = io.StringIO()
+                writer = csv.writer(buffer, lineterminator="\n")
+                writer.writerows(x[1:] for x in batch)
+                yield buffer.getvalue()
+            else:
+                yield "".join(json.dumps(dict(zip(column_names, x[1:]))) + "\n" for x in batch)
+    
+    def __page_query(self, category_name):
+        # Keyset pagination: each page continues from the last rowid so it is a single index seek
+        if category_name is None:
+            return (f"SELECT rowid, * FROM {self.__table_name} WHERE rowid > ? ORDER BY rowid LIMIT ?", ())
+        category_id = self.__get_category_id(category_name)
+        if category_id is None:
+            return None
+        return (f"""SELECT t.rowid, t.* FROM {self.__members_table_name} m
+                    JOIN {self.__table_name} t ON t.rowid = m.record_id
+                    WHERE m.category_id = ? AND m.record_id > ? ORDER BY m.record_id LIMIT ?""", (category_id,))
+    
+    def __filter_conditions(self, filters):
+        # WHERE conditions on the main table aliased as t
+        conditions = []
+        parameters = ()
+        for key, value in (filters or {}).items():
+            # Column names can't be parameters so they are checked against the table's columns
+            if key not in self.__column_dict:
+                raise ValueError(f"{self.__table_name} has no column '{key}'")
+            if isinstance(value, (tuple, list)):
+                low, high = value
+                if low is not None:
+                    conditions.append(f"t.{key} >= ?")
+                    parameters += (low,)
+                if high is not None:
+                    conditions.append(f"t.{key} <= ?")
+                    parameters += (high,)
+            else:
+                conditions.append(f"t.{key} = ?")
+                parameters += (value,)
+        return conditions, parameters
+
+    def __sorted_page_query(self, category_name, after_rowid, limit, offset, sort, descending, filters):
+        # Keyset pagination in the order of a column: the page continues from the sort value and rowid
+        # of the record at after_rowid, so with the column's index it is a single index seek
+        conditions, parameters = self.__filter_conditions(filters)
+        source = f"{self.__table_name} t"
+        members_source = f"{self.__members_table_name} m CROSS JOIN {self.__table_name} t ON t.rowid = m.record_id"
+        category_id = None
+        if category_name is not None:
+            category_id = self.__get_category_id(category_name)
+            if category_id is None:
+                return None
+        direction = "DESC" if descending else "ASC"
+
+        if sort in (None, "rowid"):
+            key = "t.rowid"
+            if category_id is not None:
+                # Walk the category's members in rowid order
+                source = members_source
+                conditions.insert(0, "m.category_id = ?")
+                parameters = (category_id,) + parameters
+                key = "m.record_id"
+            if after_rowid != 0:
+                conditions.append(f"{key} < ?" if descending else f"{key} > ?")
+                parameters += (after_rowid,)
+            where = " AND ".join(conditions) or "1"
+            return (f"SELECT t.rowid, t.* FROM {source} WHERE {where} ORDER BY {key} {direction} LIMIT ? OFFSET ?",
+                parameters + (limit, offset))
+
+        if sort not in self.__column_dict:
+            raise ValueError(f"{self.__table_name} has no column '{sort}'")
+        if category_id is not None:
+            category_size = self.__get_category_catalog()[category_name][1]
+            if category_size ** 2 < (limit + offset) * self.__count_all_records():
+                # A small category is quicker to read in full and sort than to find by walking the column's index
+                source = members_source
+                conditions.insert(0, "m.category_id = ?")
+                parameters = (category_id,) + parameters
+            else:
+                conditions.append(f"EXISTS (SELECT 1 FROM {self.__members_table_name} m WHERE m.category_id = ? AND m.record_id = t.rowid)")
+                parameters += (category_id,)
+        order = f"ORDER BY t.{sort} {direction}, t.rowid {direction} LIMIT ? OFFSET ?"
+        if after_rowid == 0:
+            where = " AND ".join(conditions) or "1"
+            return (f"SELECT t.rowid, t.* FROM {source} WHERE {where} {order}", parameters + (limit, offset))
+
+        cursor = self.__read_cursor()
+        cursor.execute(f"SELECT {sort} FROM {self.__table_name} WHERE rowid = ?", (after_rowid,))
+        row = cursor.fetchone()
+        if row is None:
+            raise ValueError(f"{self.__table_name} has no record {after_rowid}")
+        # NULLs sort before every other value
+        if row[0] is None:
+            if descending:
+                conditions.append(f"t.{sort} IS NULL AND t.rowid < ?")
+            else:
+                conditions.append(f"(t.{sort} IS NOT NULL OR t.rowid > ?)")
+            where = " AND ".join(conditions)
+            return (f"SELECT t.rowid, t.* FROM {source} WHERE {where} {order}", parameters + (after_rowid, limit, offset))
+        if not descending:
+            where = " AND ".join(conditions + [f"(t.{sort}, t.rowid) > (?, ?)"])
+            return (f"SELECT t.rowid, t.* FROM {source} WHERE {where} {order}", parameters + (row[0], after_rowid, limit, offset))
+        # In descending order the NULLs come last, but a row value comparison never matches them. The two
+        # parts are merged in order by SQLite, so both still walk the index
+        where = " AND ".join(conditions + [f"(t.{sort}, t.rowid) < (?, ?)"])
+        null_where = " AND ".join(conditions + [f"t.{sort} IS NULL"])
+        sort_number = list(self.__column_dict).index(sort) + 2
+        return (f"""SELECT t.rowid, t.* FROM {source} WHERE {where} UNION ALL
+                    SELECT t.rowid, t.* FROM {source} WHERE {null_where}
+                    ORDER BY {sort_number} DESC, 1 DESC LIMIT ? OFFSET ?""",
+            parameters + (row[0], after_rowid) + parameters + (limit, offset))
+
+    @media_stats.instrumented
+    def optimize(self):
+        """Maintenance for large or long used libraries. Merges the search index into a single b-tree
+        so searches read fewer pages, removes the words of deleted records from the fuzzy search index and
+        lets SQLite update the statistics its query planner uses"""
+        with self.transaction():
+            if self.__search_enabled:
+                self.__db_cursor.execute(f"INSERT INTO {self.__search_table_name} ({self.__search_table_name}) VALUES ('optimize')")
+            if self.__fuzzy_enabled:
+                self.__sync_words()
+                self.__db_cursor.execute(f"INSERT INTO {self.__word_trigrams_table_name} ({self.__word_trigrams_table_name}) VALUES ('optimize')")
+        # Can run ANALYZE, which writes, so it waits for any transaction another thread has open on the connection
+        with self.__write_lock:
+            self.__db_cursor.execute("PRAGMA optimize")
+
+    @media_stats.instrumented
+    def get_category_names(self):
+        return list(self.__get_category_catalog())
+    
+    @media_stats.instrumented
+    def get_category_catalog(self):
+        # Copy the items first in case another thread changes the catalog while it is read
+        return [(x[0], x[1][1]) for x in list(self.__get_category_catalog().items())]
+    
+    @media_stats.instrumented
     def add_new_category(self, category_name):
-        # Add category table if it doesn't exist
-        table_name = f"{self.__table_name}_{category_name}"
-        self.__create_category_table(table_name)
+        # Add category if it doesn't exist
+        with self.transaction():
+            self.__get_or_create_category_id(category_name)
 
+    @media_stats.instrumented
     def add_to_category(self, id, category_name):
-        # Get record
-        self.__db_cursor.execute(f"SELECT rowid, * FROM {self.__table_name} WHERE rowid = '{id}'")
-        self.__db_connection.commit()
-        record = self.__db_cursor.fetchone()
-        record_placeholder = ("?, "*len(record))[:-2]
+        with self.transaction():
+            # Add category if it doesn't exist
+            category_id = self.__get_or_create_category_id(category_name)
 
-        # Add category table if it doesn't exist
-        table_name = f"{self.__table_name}_{category_name}"
-        self.add_new_category(category_name)
-
-        # Add record to new category (but only if it hasn't already been added)
-        self.__db_cursor.execute(f"SELECT rowid, * FROM {table_name} WHERE orig_id = '{id}'")
-        self.__db_connection.commit()
-        fetched_data = self.__db_cursor.fetchone()
-        if fetched_data is None:
-            self.__db_cursor.execute(f"INSERT INTO {table_name} VALUES ({record_placeholder})", record)
-            self.__db_connection.commit()
+            # Add record to category (but only if the record exists and hasn't already been added). A cached
+            # record is known to exist so the main table isn't read
+            if self.row_cache is not None and self.row_cache.get((self.__table_name, id)) is not None:
+                self.__db_cursor.execute(f"INSERT OR IGNORE INTO {self.__members_table_name} (category_id, record_id) VALUES (?, ?)",
+                    (category_id, id))
+            else:
+                self.__db_cursor.execute(f"""INSERT OR IGNORE INTO {self.__members_table_name} (category_id, record_id)
+                                            SELECT ?, rowid FROM {self.__table_name} WHERE rowid = ?""", (category_id, id))
+            self.__get_category_catalog()[category_name][1] += self.__db_cursor.rowcount
     
+    @media_stats.instrumented
     def remove_from_category(self, id, category_name):
-        table_name = f"{self.__table_name}_{category_name}"
-        # Remove record from category
-        self.__db_cursor.execute(f"DELETE from {table_name} WHERE orig_id = '{id}'")
-        self.__db_connection.commit()
+        with self.transaction():
+            category_id = self.__get_category_id(category_name)
+            if category_id is None:
+                return
+            # Remove record from category
+            self.__db_cursor.execute(f"DELETE from {self.__members_table_name} WHERE category_id = ? AND record_id = ?", (category_id, id))
+            self.__get_category_catalog()[category_name][1] -= self.__db_cursor.rowcount
 
-    def __get_table_names(self):
-        self.__db_cursor.execute("""SELECT name FROM sqlite_master WHERE type='table';""")
-        self.__db_connection.commit()
-        data = self.__db_cursor.fetchall()
-        table_names = [x[0] for x in data]
-        table_names = [x for x in table_names if self.__table_name in x]
-        return table_names
+    @media_stats.instrumented
+    def add_records_to_category(self, ids, category_name):
+        ids, id_list = self.__id_list(ids)
+        with self.transaction():
+            category_id = self.__get_or_create_category_id(category_name)
+            # Joining on the main table skips records that don't exist
+            self.__db_cursor.execute(f"""INSERT OR IGNORE INTO {self.__members_table_name} (category_id, record_id)
+                                        SELECT ?, rowid FROM {self.__table_name} WHERE rowid IN (SELECT value FROM json_each(?))""",
+                                        (category_id, id_list))
+            count = self.__db_cursor.rowcount
+            self.__get_category_catalog()[category_name][1] += count
+        return count
+
+    @media_stats.instrumented
+    def remove_records_from_category(self, ids, category_name):
+        ids, id_list = self.__id_list(ids)
+        with self.transaction():
+            category_id = self.__get_category_id(category_name)
+            if category_id is None:
+                return 0
+            self.__db_cursor.execute(f"""DELETE from {self.__members_table_name}
+                                        WHERE category_id = ? AND record_id IN (SELECT value FROM json_each(?))""", (category_id, id_list))
+            count = self.__db_cursor.rowcount
+            self.__get_category_catalog()[category_name][1] -= count
+        return count
+
+    def __get_categories(self):
+        return [(x[1][0], x[0]) for x in list(self.__get_category_catalog().items())]
 
 
 def print_tables(table_obj):
-    tables = table_obj.get_all_records()
-    for table in tables:
-        print(table)
-        for record in tables[table]:
+    table_names = [None] + table_obj.get_category_names()
+    for table_name in table_names:
+        print(table_name or "All")
+        for record in table_obj.iter_records(table_name):
             print("\t", record)
     print()
 
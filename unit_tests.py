@@ -1,8 +1,20 @@
 import unittest
 import media_tables
+import media_files
+import media_async
+import media_server
+import media_benchmark
+import media_gui
+import media_stats
+import http.client
+import json
+import asyncio
 import sqlite3
 import datetime
+import threading
 import os
+import subprocess
+import sys
 os.makedirs('./test_databases', exist_ok=True)
 
 class MediaTablesTesting(unittest.TestCase):
@@ -42,6 +54,570 @@ class MediaTablesTesting(unittest.TestCase):
             record_id_retrieved = table[-1][0]
             self.assertTrue(record_id!=record_id_retrieved)
 
+    def test_category_follows_edit_and_delete(self):
+        """Edits to a record should show up in its categories and deleting it should remove it from them"""
+        record = ("val1", "val2", "val3")
+        self.test_media_table.add_record(record)
+        record_id = self.test_media_table.get_all_records()[self.table_name][-1][0]
+        self.test_media_table.add_to_category(record_id, "favourites")
+        self.test_media_table.edit_record(record_id, col1="new1")
+        category = self.test_media_table.get_all_records()[f"{self.table_name}_favourites"]
+        self.assertIn((record_id, "new1", "val2", "val3"), [tuple(x[1:]) for x in category])
+        self.test_media_table.delete_record(record_id)
+        category = self.test_media_table.get_all_records()[f"{self.table_name}_favourites"]
+        self.assertNotIn(record_id, [x[1] for x in category])
+
+    def test_migrate_legacy_category_tables(self):
+        """Copy tables from older databases should be converted to category membership"""
+        db_connection = sqlite3.connect(":memory:")
+        db_cursor = db_connection.cursor()
+        db_cursor.execute("CREATE TABLE legacy_table (col1 text, col2 text)")
+        db_cursor.executemany("INSERT INTO legacy_table VALUES (?, ?)", [("a", "b"), ("c", "d")])
+        db_cursor.execute("CREATE TABLE legacy_table_favourites (orig_id int, col1 text, col2 text)")
+        db_cursor.execute("INSERT INTO legacy_table_favourites VALUES (2, 'c', 'd')")
+        db_connection.commit()
+        legacy_media_table = media_tables.MediaTable(db_connection, db_cursor, main_table_name="legacy_table",
+            column_dict={"col1": "text", "col2": "text"})
+        tables = legacy_media_table.get_all_records()
+        self.assertEqual([tuple(x[1:]) for x in tables["legacy_table_favourites"]], [(2, "c", "d")])
+        db_cursor.execute("SELECT name FROM sqlite_master WHERE name = 'legacy_table_favourites'")
+        self.assertIsNone(db_cursor.fetchone())
+        db_connection.close()
+
+    def test_get_records_pages(self):
+        """Pages retrieved by keyset pagination should join up to the full table"""
+        for i in range(5):
+            self.test_media_table.add_record((f"page{i}", "val2", "val3"))
+        all_records = self.test_media_table.get_all_records()[self.table_name]
+        pages = []
+        after_rowid = 0
+        while True:
+            page = self.test_media_table.get_records(after_rowid=after_rowid, limit=2)
+            if len(page) == 0:
+                break
+            self.assertTrue(len(page) <= 2)
+            pages += page
+            after_rowid = page[-1][0]
+        self.assertEqual(pages, all_records)
+        self.assertEqual(list(self.test_media_table.iter_records(batch_size=2)), all_records)
+
+    def test_count_and_offset(self):
+        """Offsets should skip records in rowid order and counts should match the table"""
+        for i in range(3):
+            self.test_media_table.add_record((f"offset{i}", "val2", "val3"))
+        all_records = self.test_media_table.get_all_records()[self.table_name]
+        self.assertEqual(self.test_media_table.count_records(), len(all_records))
+        self.assertEqual(self.test_media_table.get_records(limit=1, offset=2), all_records[2:3])
+        self.assertEqual(self.test_media_table.get_records(after_rowid=all_records[0][0], limit=1, offset=1), all_records[2:3])
+        self.test_media_table.add_to_category(all_records[1][0], "counted")
+        self.assertEqual(self.test_media_table.count_records("counted"), 1)
+
+    def test_add_returns_rowid(self):
+        """add_record should return the rowid that get_record can look up"""
+        record = ("val1", "val2", "val3")
+        record_id = self.test_media_table.add_record(record)
+        self.assertEqual(self.test_media_table.get_record(record_id), (record_id,) + record)
+        self.test_media_table.delete_record(record_id)
+        self.assertIsNone(self.test_media_table.get_record(record_id))
+
+    def test_add_records(self):
+        """Records added in bulk should all be retrievable"""
+        count = self.test_media_table.count_records()
+        records = [(f"bulk{i}", "val2", "val3") for i in range(25)]
+        added = self.test_media_table.add_records(iter(records), batch_size=10)
+        self.assertEqual(added, 25)
+        self.assertEqual(self.test_media_table.count_records(), count + 25)
+
+    def test_import_file(self):
+        """Valid rows of CSV and JSONL files should be added and invalid rows reported"""
+        db_connection = sqlite3.connect(":memory:")
+        import_table = media_tables.MediaTable(db_connection, db_connection.cursor(), main_table_name="import_table",
+            column_dict={"title": "text", "year": "integer"})
+        csv_path = "./test_databases/import_test.csv"
+        with open(csv_path, "w") as file:
+            file.write("title,year\nFirst,1994\nSecond,not a year\nThird,\n")
+        added, rejected = media_files.import_file(import_table, csv_path)
+        self.assertEqual(added, 2)
+        self.assertEqual([x[0] for x in rejected], [3])
+        jsonl_path = "./test_databases/import_test.jsonl"
+        with open(jsonl_path, "w") as file:
+            file.write('{"title": "Fourth", "year": "2001"}\n{"title": "Fifth"}\n')
+        added, rejected = media_files.import_file(import_table, jsonl_path)
+        self.assertEqual(added, 1)
+        self.assertEqual([x[0] for x in rejected], [2])
+        self.assertEqual([x[1:] for x in import_table.get_records()], [("First", 1994), ("Third", None), ("Fourth", 2001)])
+        db_connection.close()
+
+    def test_export_and_import(self):
+        """Exporting a category to gzipped CSV and JSONL and importing it again should give the same records"""
+        db_connection = sqlite3.connect(":memory:")
+        export_table = media_tables.MediaTable(db_connection, db_connection.cursor(), main_table_name="export_table",
+            column_dict={"title": "text", "year": "integer"})
+        export_table.add_records([("First, with a comma", 1994), ('Second "quoted"', 2001), ("Third", None)])
+        export_table.add_to_category(1, "exported")
+        export_table.add_to_category(3, "exported")
+        for path in ["./test_databases/export_test.csv.gz", "./test_databases/export_test.jsonl.gz"]:
+            media_files.export_file(export_table, path, "exported", batch_size=1)
+            import_table = media_tables.MediaTable(db_connection, db_connection.cursor(), main_table_name="import_table",
+                column_dict={"title": "text", "year": "integer"})
+            added, rejected = media_files.import_file(import_table, path)
+            self.assertEqual(rejected, [])
+            self.assertEqual(added, 2)
+            self.assertEqual([x[1:] for x in import_table.get_records(after_rowid=import_table.count_records() - 2)],
+                [("First, with a comma", 1994), ("Third", None)])
+        db_connection.close()
+
+    def test_search(self):
+        """Search should match word prefixes and follow edits and deletes"""
+        record_id = self.test_media_table.add_record(("Searchable Title", "val2", "val3"))
+        self.assertIn(record_id, [x[0] for x in self.test_media_table.search("searcha tit")])
+        self.assertEqual(self.test_media_table.search("earchable"), [])
+        self.test_media_table.edit_record(record_id, col1="Renamed")
+        self.assertNotIn(record_id, [x[0] for x in self.test_media_table.search("searchable")])
+        self.assertIn(record_id, [x[0] for x in self.test_media_table.search("renamed")])
+        self.test_media_table.delete_record(record_id)
+        self.assertNotIn(record_id, [x[0] for x in self.test_media_table.search("renamed")])
+
+    def test_category_catalog(self):
+        """Catalog counts should follow records being added to, removed from and deleted from categories"""
+        db_connection = sqlite3.connect(":memory:")
+        catalog_table = media_tables.MediaTable(db_connection, db_connection.cursor(), main_table_name="catalog_table",
+            column_dict={"col1": "text"})
+        record_ids = [catalog_table.add_record((f"val{i}",)) for i in range(3)]
+        catalog_table.add_new_category("empty")
+        for record_id in record_ids:
+            catalog_table.add_to_category(record_id, "full")
+        catalog_table.add_to_category(record_ids[0], "full")
+        self.assertEqual(catalog_table.get_category_catalog(), [("empty", 0), ("full", 3)])
+        catalog_table.remove_from_category(record_ids[1], "full")
+        catalog_table.delete_record(record_ids[2])
+        self.assertEqual(catalog_table.get_category_catalog(), [("empty", 0), ("full", 1)])
+        self.assertEqual(catalog_table.count_records(), 2)
+        db_connection.close()
+
+        # Counts read on a reader connection while a transaction is running mustn't be kept after it commits
+        time_str = datetime.datetime.now().strftime("%Y%m%d_%H%M%S_%f")
+        connection_manager = media_tables.ConnectionManager(f"./test_databases/test_category_catalog_{time_str}.db")
+        db_connection = connection_manager.writer()
+        catalog_table = media_tables.MediaTable(db_connection, db_connection.cursor(), main_table_name="catalog_table",
+            column_dict={"col1": "text"}, connection_manager=connection_manager)
+        catalog_table.add_records([("a",), ("b",)])
+        catalog_table.add_to_category(1, "fav")
+        with catalog_table.transaction():
+            catalog_table.delete_record(1)
+            reader = threading.Thread(target=lambda : (catalog_table.get_category_catalog(), catalog_table.count_records()))
+            reader.start()
+            reader.join()
+        self.assertEqual(catalog_table.get_category_catalog(), [("fav", 0)])
+        self.assertEqual(catalog_table.count_records(), 1)
+        connection_manager.close()
+
+    def test_transaction(self):
+        """Operations in a transaction should be committed together or rolled back together"""
+        db_connection = sqlite3.connect(":memory:")
+        transaction_table = media_tables.MediaTable(db_connection, db_connection.cursor(), main_table_name="transaction_table",
+            column_dict={"col1": "text"})
+        with transaction_table.transaction():
+            record_id = transaction_table.add_record(("kept",))
+            transaction_table.add_to_category(record_id, "kept_category")
+            self.assertTrue(db_connection.in_transaction)
+        self.assertFalse(db_connection.in_transaction)
+        with self.assertRaises(ValueError):
+            with transaction_table.transaction():
+                transaction_table.add_record(("discarded",))
+                transaction_table.add_to_category(record_id, "discarded_category")
+                raise ValueError
+        self.assertEqual([x[1:] for x in transaction_table.get_records()], [("kept",)])
+        self.assertEqual(transaction_table.get_category_catalog(), [("kept_category", 1)])
+        db_connection.close()
+
+    def test_edit_records(self):
+        """Single and batch edits should store values exactly, including quotes"""
+        record_ids = [self.test_media_table.add_record((f"edit{i}", "val2", "val3")) for i in range(3)]
+        self.test_media_table.edit_record(record_ids[0], col1="It's \"quoted\"", col3="new3")
+        self.assertEqual(self.test_media_table.get_record(record_ids[0]), (record_ids[0], "It's \"quoted\"", "val2", "new3"))
+        edited = self.test_media_table.edit_records({record_ids[1]: {"col2": "batch2"}, record_ids[2]: {"col2": "batch3", "col1": "x"}})
+        self.assertEqual(edited, 2)
+        self.assertEqual(self.test_media_table.get_record(record_ids[1]), (record_ids[1], "edit1", "batch2", "val3"))
+        self.assertEqual(self.test_media_table.get_record(record_ids[2]), (record_ids[2], "x", "batch3", "val3"))
+        with self.assertRaises(ValueError):
+            self.test_media_table.edit_record(record_ids[0], rowid=1)
+
+    def test_connection_manager(self):
+        """Readers should use WAL mode, get a connection per thread and not see uncommitted writes"""
+        time_str = datetime.datetime.now().strftime("%Y%m%d_%H%M%S_%f")
+        connection_manager = media_tables.ConnectionManager(f"./test_databases/test_manager_{time_str}.db", synchronous="normal")
+        db_connection = connection_manager.writer()
+        managed_table = media_tables.MediaTable(db_connection, db_connection.cursor(), main_table_name="managed_table",
+            column_dict={"col1": "text"}, connection_manager=connection_manager)
+        self.assertEqual(db_connection.execute("PRAGMA journal_mode").fetchone()[0], "wal")
+        managed_table.add_record(("committed",))
+        readers = []
+        thread = threading.Thread(target=lambda : readers.append(connection_manager.reader()))
+        thread.start()
+        thread.join()
+        self.assertIsNot(readers[0], connection_manager.reader())
+        with managed_table.transaction():
+            managed_table.add_record(("uncommitted",))
+            # Other threads read from their own connection so only see the committed record
+            results = []
+            thread = threading.Thread(target=lambda : results.append(managed_table.get_records()))
+            thread.start()
+            thread.join()
+            self.assertEqual([x[1] for x in results[0]], ["committed"])
+            self.assertEqual(len(managed_table.get_records()), 2)
+        self.assertEqual(len(managed_table.get_records()), 2)
+        connection_manager.close()
+
+    def test_async_parity(self):
+        """AsyncMediaTable should give the same results as MediaTable for the same operations"""
+        time_str = datetime.datetime.now().strftime("%Y%m%d_%H%M%S_%f")
+        connection_manager = media_tables.ConnectionManager(f"./test_databases/test_async_{time_str}.db")
+        db_connection = connection_manager.writer()
+        column_dict = {"col1": "text", "col2": "integer"}
+        sync_table = media_tables.MediaTable(db_connection, db_connection.cursor(), main_table_name="sync_table",
+            column_dict=column_dict, connection_manager=connection_manager)
+
+        def run_sync():
+            record_ids = [sync_table.add_record((f"val{i}", i)) for i in range(5)]
+            sync_table.add_records([(f"bulk{i}", i) for i in range(20)])
+            sync_table.edit_record(record_ids[0], col1="edited")
+            sync_table.delete_record(record_ids[1])
+            sync_table.add_to_category(record_ids[2], "favourites")
+            sync_table.add_to_category(record_ids[3], "favourites")
+            sync_table.remove_from_category(record_ids[3], "favourites")
+            return (sync_table.get_records(limit=10, offset=2), sync_table.get_records("favourites"),
+                sync_table.search("bulk1"), sync_table.count_records(), sync_table.get_category_catalog(),
+                list(sync_table.iter_records(batch_size=7)))
+
+        async def run_async():
+            async_table = media_async.AsyncMediaTable(connection_manager, "async_table", column_dict)
+            record_ids = [await async_table.add_record((f"val{i}", i)) for i in range(5)]
+            await async_table.add_records([(f"bulk{i}", i) for i in range(20)])
+            await async_table.edit_record(record_ids[0], col1="edited")
+            await async_table.delete_record(record_ids[1])
+            await async_table.add_to_category(record_ids[2], "favourites")
+            await async_table.add_to_category(record_ids[3], "favourites")
+            await async_table.remove_from_category(record_ids[3], "favourites")
+            # Reads can run concurrently on the reader pool
+            results = await asyncio.gather(async_table.get_records(limit=10, offset=2), async_table.get_records("favourites"),
+                async_table.search("bulk1"), async_table.count_records(), async_table.get_category_catalog())
+            records = [x async for x in async_table.iter_records(batch_size=7)]
+            await async_table.close()
+            return tuple(results) + (records,)
+
+        # Remember the reader connections opened by the async table's threads
+        thread_readers = []
+        reader = connection_manager.reader
+        def recording_reader():
+            connection = reader()
+            if threading.current_thread() is not threading.main_thread():
+                thread_readers.append(connection)
+            return connection
+        connection_manager.reader = recording_reader
+        self.assertEqual(run_sync(), asyncio.run(run_async()))
+        # Closing the async table closes them, so they don't keep WAL snapshots open
+        self.assertGreater(len(thread_readers), 0)
+        for connection in thread_readers:
+            with self.assertRaises(sqlite3.ProgrammingError):
+                connection.execute("SELECT 1")
+        connection_manager.close()
+
+    def test_server(self):
+        """The HTTP server should add, list and conditionally list records over one keep-alive connection"""
+        time_str = datetime.datetime.now().strftime("%Y%m%d_%H%M%S_%f")
+        connection_manager = media_tables.ConnectionManager(f"./test_databases/test_server_{time_str}.db")
+        server = media_server.MediaServer(("127.0.0.1", 0), media_server.MediaLibrary(connection_manager), threads=2)
+        thread = threading.Thread(target=server.serve_forever)
+        thread.start()
+        connection = http.client.HTTPConnection("127.0.0.1", server.server_address[1])
+
+        def request(method, path, body=None, headers={}):
+            connection.request(method, path, body=body, headers=headers)
+            response = connection.getresponse()
+            data = response.read()
+            return response.status, response.getheader("ETag"), json.loads(data) if data else None
+
+        status, etag, body = request("POST", "/movies", json.dumps({"title": "Heat", "director": "Michael Mann", "year": 1995}))
+        self.assertEqual(status, 201)
+        record_id = body["id"]
+        status, etag, body = request("GET", "/movies?limit=10")
+        self.assertEqual(body["records"], [{"id": record_id, "title": "Heat", "director": "Michael Mann", "year": 1995}])
+        self.assertEqual(request("GET", "/movies?limit=10", headers={"If-None-Match": etag})[0], 304)
+        self.assertEqual(request("PUT", f"/movies/categories/crime/{record_id}")[0], 200)
+        self.assertNotEqual(request("GET", "/movies?limit=10")[1], etag)
+        self.assertEqual(request("GET", "/movies/search?q=hea")[2]["records"][0]["id"], record_id)
+        self.assertEqual(request("GET", "/movies/stats/decade?most_common=1")[2], {"stats": [{"value": 1990, "count": 1}]})
+        self.assertEqual(request("PATCH", f"/movies/{record_id}", json.dumps({"nope": 1}))[0], 400)
+        self.assertEqual(request("PATCH", f"/movies/{record_id}", json.dumps({"year": "not a year"}))[0], 400)
+        self.assertEqual(request("PATCH", f"/movies/{record_id}", json.dumps({"year": [1]}))[0], 400)
+        self.assertEqual(request("PATCH", f"/movies/{record_id}", json.dumps({"year": "1996"}))[2]["year"], 1996)
+        self.assertEqual(request("GET", "/movies?limit=-1")[0], 400)
+        self.assertEqual(request("GET", "/movies/search?q=hea&limit=0")[0], 400)
+        self.assertEqual(request("DELETE", f"/movies/{record_id}")[0], 204)
+        self.assertEqual(request("GET", f"/movies/{record_id}")[0], 404)
+
+        connection.close()
+        server.shutdown()
+        server.server_close()
+        thread.join()
+        connection_manager.close()
+
+    def test_benchmark(self):
+        """Generated libraries should be the same for a seed and benchmarking should leave them unchanged"""
+        column_dict = {"title": "text", "year": "integer"}
+        self.assertEqual(list(media_benchmark.generate_records(column_dict, 50, seed=3)),
+            list(media_benchmark.generate_records(column_dict, 50, seed=3)))
+        time_str = datetime.datetime.now().strftime("%Y%m%d_%H%M%S_%f")
+        connection_manager, media_table = media_benchmark.initialise_database_for_testing(
+            f"./test_databases/test_benchmark_{time_str}.db", "music", record_count=200, category_count=2)
+        self.assertEqual(media_table.get_category_catalog(), [("category_0", 20), ("category_1", 20)])
+        records = list(media_table.iter_records())
+        results = {"sizes": {"200": media_benchmark.run_benchmarks(media_table, repeat=1)}}
+        self.assertEqual(list(media_table.iter_records()), records)
+        connection_manager.close()
+        baseline = {"sizes": {"200": {"search": {"min": results["sizes"]["200"]["search"]["min"] / 2}}}}
+        self.assertEqual([x[:2] for x in media_benchmark.compare_results(results, baseline)], [("200", "search")])
+        results = {"sizes": {"1000": {"generate": {"min": 2.0}}, "2000": {"generate": {"min": 1.0}}}}
+        self.assertEqual(media_benchmark.check_insert_rates(results, 1000), [("1000", 500.0)])
+
+    def test_query_stats(self):
+        """Operations should be counted with their queries, rows and commits and slow queries traced"""
+        query_stats = media_stats.QueryStats(slow_query_ms=None)
+        db_connection = sqlite3.connect(":memory:")
+        stats_table = media_tables.MediaTable(db_connection, db_connection.cursor(), main_table_name="stats_table",
+            column_dict={"col1": "text", "col2": "text"}, query_stats=query_stats)
+        stats_table.add_records([("a", "b"), ("c", "d"), ("e", "f")])
+        stats_table.edit_record(1, col1="x", col2="y")
+        self.assertEqual(len(list(stats_table.iter_records(batch_size=2))), 3)
+        operations = query_stats.stats()["operations"]
+        self.assertEqual((operations["edit_record"]["calls"], operations["edit_record"]["queries"],
+            operations["edit_record"]["commits"]), (1, 5, 1))
+        self.assertEqual((operations["iter_records"]["calls"], operations["iter_records"]["rows"]), (1, 3))
+        self.assertEqual(sum(operations["iter_records"]["latency_ms"].values()), 1)
+        # Sorting a category page counts the records internally, which isn't a count_records call
+        stats_table.add_to_category(1, "favourites")
+        self.assertEqual(len(stats_table.get_records("favourites", sort="col2")), 1)
+        self.assertNotIn("count_records", query_stats.stats()["operations"])
+
+        query_stats.reset()
+        query_stats.slow_query_ms = 0
+        stats_table.get_record(2)
+        slow_query = query_stats.stats()["slow_queries"][0]
+        self.assertEqual(slow_query["operation"], "get_record")
+        self.assertIn("WHERE rowid = 2", slow_query["statements"][0])
+        db_connection.close()
+
+    def test_sort_and_filter(self):
+        """Pages sorted by a column should join up in order, including NULLs, and filters should combine with categories"""
+        db_connection = sqlite3.connect(":memory:")
+        sort_table = media_tables.MediaTable(db_connection, db_connection.cursor(), main_table_name="sort_table",
+            column_dict={"title": "text", "year": "integer"})
+        sort_table.add_records([("c", 1990), ("a", None), ("b", 1985), ("a", 2001), (None, 1990), ("b", 1990)])
+        for record_id in (1, 3, 4, 6):
+            sort_table.add_to_category(record_id, "picked")
+        for descending in (False, True):
+            expected = sorted(sort_table.get_records(limit=10), key=lambda x : (x[1] is not None, x[1] or "", x[0]), reverse=descending)
+            pages = []
+            after_rowid = 0
+            while True:
+                page = sort_table.get_records(after_rowid=after_rowid, limit=2, sort="title", descending=descending)
+                pages += page
+                if len(page) < 2:
+                    break
+                after_rowid = page[-1][0]
+            self.assertEqual(pages, expected)
+        self.assertEqual([x[0] for x in sort_table.get_records(sort="year", filters={"year": (1986, None)})], [1, 5, 6, 4])
+        self.assertEqual([x[0] for x in sort_table.iter_records("picked", sort="title", filters={"year": 1990})], [6, 1])
+        self.assertEqual(sort_table.count_records("picked", filters={"year": (None, 1995)}), 3)
+        with self.assertRaises(ValueError):
+            sort_table.get_records(sort="no_column")
+        db_connection.close()
+
+    def test_row_cache(self):
+        """Cached records should be returned until written through the table and the least recently used dropped"""
+        row_cache = media_tables.RowCache(size=2)
+        db_connection = sqlite3.connect(":memory:")
+        cache_table = media_tables.MediaTable(db_connection, db_connection.cursor(), main_table_name="cache_table",
+            column_dict={"col1": "text"}, row_cache=row_cache)
+        cache_table.add_records([("a",), ("b",), ("c",)])
+        self.assertEqual(cache_table.get_record(1), (1, "a"))
+        self.assertEqual(cache_table.get_record(1), (1, "a"))
+        self.assertEqual((row_cache.hits, row_cache.misses), (1, 1))
+        cache_table.edit_record(1, col1="z")
+        self.assertEqual(cache_table.get_record(1), (1, "z"))
+        cache_table.get_record(2)
+        cache_table.get_record(3)
+        self.assertEqual(row_cache.stats()["records"], 2)
+        self.assertIsNone(row_cache.get(("cache_table", 1)))
+        cache_table.delete_record(3)
+        self.assertIsNone(cache_table.get_record(3))
+        self.assertEqual(cache_table.get_records(limit=1), [(1, "z")])
+        self.assertEqual(row_cache.get(("cache_table", 1)), (1, "z"))
+        db_connection.close()
+
+    def test_batch_operations(self):
+        """Batch methods should each change every given record in a single statement and commit"""
+        query_stats = media_stats.QueryStats()
+        db_connection = sqlite3.connect(":memory:")
+        batch_table = media_tables.MediaTable(db_connection, db_connection.cursor(), main_table_name="batch_table",
+            column_dict={"col1": "text"}, query_stats=query_stats)
+        batch_table.add_records((str(x),) for x in range(5000))
+        query_stats.reset()
+        # Record 6000 doesn't exist so is skipped
+        self.assertEqual(batch_table.add_records_to_category(list(range(1, 5001)) + [6000], "playlist"), 5000)
+        self.assertEqual(batch_table.add_records_to_category([1, 2], "playlist"), 0)
+        self.assertEqual(batch_table.remove_records_from_category([1, 2], "playlist"), 2)
+        self.assertEqual(batch_table.remove_records_from_category([1], "no_category"), 0)
+        self.assertEqual(batch_table.delete_records(range(3, 1003)), 1000)
+        operations = query_stats.stats()["operations"]
+        self.assertEqual((operations["add_records_to_category"]["calls"], operations["add_records_to_category"]["commits"]), (2, 2))
+        self.assertEqual(operations["delete_records"]["commits"], 1)
+        self.assertEqual(batch_table.count_records(), 4000)
+        self.assertEqual(batch_table.get_category_catalog(), [("playlist", 3998)])
+        self.assertEqual(batch_table.count_records("playlist"), 3998)
+        self.assertIsNone(batch_table.get_record(3))
+        db_connection.close()
+
+    def test_columnar_records(self):
+        """Columnar records should hold the same rows as tuples, including NULLs and values of other types"""
+        db_connection = sqlite3.connect(":memory:")
+        columnar_table = media_tables.MediaTable(db_connection, db_connection.cursor(), main_table_name="columnar_table",
+            column_dict={"col1": "text", "col2": "integer"})
+        columnar_table.add_records([("a", 1), (None, None), ("é", 3), ("", 4)] * 600 + [("b", "not a number")])
+        columnar_table.add_records_to_category([2, 3], "category")
+        records = columnar_table.read_columns()
+        self.assertEqual(list(records), list(columnar_table.iter_records()))
+        self.assertEqual(records.names, ("id", "col1", "col2"))
+        self.assertEqual(records[1], (2, None, None))
+        self.assertEqual(records[-1], (2401, "b", "not a number"))
+        self.assertEqual(list(records[2:4]), [(3, "é", 3), (4, "", 4)])
+        self.assertEqual(list(records[2:4].select("col2", "id")), [(3, 3), (4, 4)])
+        self.assertEqual(list(records.column("id")[:3]), [1, 2, 3])
+        tables = columnar_table.get_all_records(columnar=True)
+        self.assertEqual(list(tables["columnar_table_category"].select("id", "col1", "col2")), [(2, None, None), (3, "é", 3)])
+        self.assertEqual(list(columnar_table.read_columns(filters={"col2": (3, 4)})[:2]), [(3, "é", 3), (4, "", 4)])
+        db_connection.close()
+
+    def test_duplicates(self):
+        """Records differing only in case and spacing should be found and handled by on_conflict"""
+        db_connection = sqlite3.connect(":memory:")
+        db_connection.execute("CREATE TABLE dup_table (title text, year integer)")
+        db_connection.execute("INSERT INTO dup_table VALUES ('Heat', 1995), ('heat ', 1995), ('Alien', 1979)")
+        # Records that were already in the table are given keys when it is opened
+        dup_table = media_tables.MediaTable(db_connection, db_connection.cursor(), main_table_name="dup_table",
+            column_dict={"title": "text", "year": "integer"})
+        self.assertEqual(dup_table.find_duplicates(), [[1, 2]])
+        self.assertEqual(dup_table.add_record(("ALIEN", 1979), on_conflict="skip"), 3)
+        with self.assertRaises(media_tables.DuplicateRecordError) as context:
+            dup_table.add_record(("  Alien", 1979), on_conflict="error")
+        self.assertEqual(context.exception.record_id, 3)
+        self.assertEqual(dup_table.add_record(("Alien  3", 1992), on_conflict="error"), 4)
+        self.assertEqual(dup_table.add_records([("Aliens", 1986), ("aliens", 1986), ("Heat", 1995)], on_conflict="skip"), 1)
+        self.assertEqual(dup_table.add_records([("ALIENS", 1986), ("Up", 2009)], on_conflict="update"), 1)
+        self.assertEqual(dup_table.get_record(5), (5, "ALIENS", 1986))
+        with self.assertRaises(media_tables.DuplicateRecordError):
+            dup_table.add_records([("Jaws", 1975), ("heat", 1995)], on_conflict="error")
+        self.assertEqual(dup_table.count_records(), 6)
+        dup_table.edit_record(6, title="alien 3", year=1992)
+        dup_table.delete_record(2)
+        self.assertEqual(dup_table.find_duplicates(), [[4, 6]])
+        self.assertEqual(dup_table.add_record(("Heat", 1995)), 7)
+        self.assertEqual(dup_table.find_duplicates(), [[1, 7], [4, 6]])
+        db_connection.close()
+
+        # add_records writes keys for the rowids its records will get, so other connections can't add records meanwhile
+        time_str = datetime.datetime.now().strftime("%Y%m%d_%H%M%S_%f")
+        connection_manager = media_tables.ConnectionManager(f"./test_databases/test_duplicates_{time_str}.db")
+        db_connection = connection_manager.writer()
+        dup_table = media_tables.MediaTable(db_connection, db_connection.cursor(), main_table_name="dup_table",
+            column_dict={"title": "text"}, connection_manager=connection_manager)
+        other_connection = sqlite3.connect(connection_manager.database_path, timeout=0)
+
+        def records():
+            with self.assertRaises(sqlite3.OperationalError):
+                other_connection.execute("INSERT INTO dup_table VALUES ('Jaws')")
+            yield ("Heat",)
+        dup_table.add_records(records())
+        self.assertEqual(dup_table.add_record(("heat",), on_conflict="skip"), 1)
+        other_connection.close()
+        connection_manager.close()
+
+    def test_fuzzy_search(self):
+        """Misspelt words should be corrected to words in the library, including words of added and edited records"""
+        db_connection = sqlite3.connect(":memory:")
+        db_connection.execute("CREATE TABLE fuzzy_table (title text, director text)")
+        db_connection.execute("INSERT INTO fuzzy_table VALUES ('The Terminator', 'Cameron'), ('Alien', 'Scott')")
+        # Words of records that were already in the table are indexed when it is opened
+        fuzzy_table = media_tables.MediaTable(db_connection, db_connection.cursor(), main_table_name="fuzzy_table",
+            column_dict={"title": "text", "director": "text"})
+        self.assertEqual(fuzzy_table.suggest("termnator"), "terminator")
+        self.assertIsNone(fuzzy_table.suggest("term"))
+        self.assertIsNone(fuzzy_table.suggest("qwxyz"))
+        fuzzy_table.add_records([("Predator", "McTiernan"), ("Terminal", "Spielberg")])
+        fuzzy_table.edit_record(2, director="Ridley Scott")
+        self.assertEqual(fuzzy_table.suggest("Aliem Ridly"), "alien ridley")
+        self.assertEqual([x[0] for x in fuzzy_table.fuzzy_search("ridly")], [2])
+        # The corrected word must be found together with the rest of the search
+        self.assertEqual(fuzzy_table.suggest("termina cameron"), None)
+        self.assertEqual(fuzzy_table.suggest("terminaltor cameron"), "terminator cameron")
+        self.assertEqual(media_gui.read_table(fuzzy_table, None, "Alen", 0, 10)[1:], ([(2, "Alien", "Ridley Scott")], "alien"))
+        db_connection.close()
+
+    def test_summary_stats(self):
+        """Summary counts should follow every kind of write, including writes made without a MediaTable"""
+        db_connection = sqlite3.connect(":memory:")
+        db_connection.execute("CREATE TABLE summary_table (title text, year integer)")
+        db_connection.execute("INSERT INTO summary_table VALUES ('Heat', 1995), ('Alien', 1979)")
+        # Records that were already in the table are counted when it is opened
+        summary_table = media_tables.MediaTable(db_connection, db_connection.cursor(), main_table_name="summary_table",
+            column_dict={"title": "text", "year": "integer"}, summaries={"decade": ("year", 10), "year": ("year", None)})
+        self.assertEqual(summary_table.get_summary_names(), ["decade", "year"])
+        self.assertEqual(summary_table.stats("decade"), [(1970, 1), (1990, 1)])
+        summary_table.add_records([("Aliens", 1986), ("Jaws", 1975), ("Up", None)])
+        summary_table.edit_record(1, year=1997)
+        summary_table.edit_records({2: {"title": "Alien 3"}, 3: {"year": 1992}})
+        summary_table.delete_record(4)
+        db_connection.execute("INSERT INTO summary_table VALUES ('Fargo', 1996)")
+        self.assertEqual(summary_table.stats("decade"), [(None, 1), (1970, 1), (1990, 3)])
+        self.assertEqual(summary_table.stats("decade", most_common=1), [(1990, 3)])
+        # add_records counts its records once at the end and only pauses the triggers of its own summaries
+        decade_table = media_tables.MediaTable(db_connection, db_connection.cursor(), main_table_name="summary_table",
+            column_dict={"title": "text", "year": "integer"}, summaries={"decade": ("year", 10)})
+        decade_table.add_records([("Psycho", 1960), ("Cube", None)], batch_size=1)
+        self.assertEqual(summary_table.stats("decade"), [(None, 2), (1960, 1), (1970, 1), (1990, 3)])
+        self.assertEqual(summary_table.stats("year", most_common=2), [(None, 2), (1960, 1)])
+        summary_table.delete_records([1, 3, 5, 6, 7, 8])
+        self.assertEqual(summary_table.stats("year"), [(1979, 1)])
+        with self.assertRaises(ValueError):
+            summary_table.stats("title")
+        with self.assertRaises(ValueError):
+            media_tables.MediaTable(db_connection, db_connection.cursor(), main_table_name="summary_table",
+                column_dict={"title": "text", "year": "integer"}, summaries={"rating": ("rating", None)})
+        db_connection.close()
+
+    def test_cli(self):
+        """The command line tool should run commands on a library without importing tkinter"""
+        time_str = datetime.datetime.now().strftime("%Y%m%d_%H%M%S_%f")
+        database_path = f"./test_databases/test_cli_{time_str}.db"
+        def run(*args):
+            result = subprocess.run([sys.executable, "-c", "import sys, media_cli; status = media_cli.main(sys.argv[1:]); "
+                "sys.exit(status if 'tkinter' not in sys.modules else 99)", "--database", database_path] + list(args),
+                capture_output=True, text=True)
+            return result.returncode, result.stdout
+        self.assertEqual(run("add", "movies", "title=Heat", "director=Mann", "year=1995"), (0, "1\n"))
+        self.assertEqual(run("add", "movies", "title=Alien", "director=Scott", "year=1979"), (0, "2\n"))
+        self.assertEqual(run("category-add", "movies", "favourites", "1", "2", "3"), (0, "2\n"))
+        self.assertEqual(run("--json", "list", "movies", "--filter", "year=1990..2000"),
+            (0, '{"id": 1, "title": "Heat", "director": "Mann", "year": 1995}\n'))
+        self.assertEqual(run("search", "movies", "ali"), (0, "2\tAlien\tScott\t1979\n"))
+        self.assertEqual(run("categories", "movies"), (0, "favourites\t2\n"))
+        self.assertEqual(run("stats", "movies", "decade"), (0, "1970\t1\n1990\t1\n"))
+        self.assertEqual(run("optimize", "movies"), (0, ""))
+        self.assertEqual(run("check"), (0, "ok\n"))
+        self.assertEqual(run("edit", "movies", "1", "year=soon")[0], 2)
+        self.assertEqual(run("get", "movies", "3"), (1, ""))
+
 
 if __name__ == '__main__':
     unittest.main()